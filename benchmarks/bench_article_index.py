@@ -0,0 +1,94 @@
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from scoop.article_index import ArticleIndex, _top_k, exact_search, normalize_rows
+
+
+def clustered_vectors(n: int, dim: int, n_topics: int, seed: int = 0) -> np.ndarray:
+    """ Embedding-like data: articles scattered around topic directions rather than uniform noise """
+    rng = np.random.RandomState(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    return topics[rng.randint(n_topics, size=n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def recall_at_k(found, expected: np.ndarray, jids: np.ndarray, rows: np.ndarray) -> float:
+    hits = 0
+    for neighbors, truth in zip(found, expected):
+        hits += len({(jid, row) for jid, row, _ in neighbors} & set(zip(jids[truth].tolist(), rows[truth].tolist())))
+    return hits / expected.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Article IVF index against exact search: recall@k, QPS, '
+                                                 'inserts, deletes and memory-mapped load')
+    parser.add_argument('--n-vectors', type=int, default=100_000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--n-topics', type=int, default=300)
+    parser.add_argument('--n-journals', type=int, default=500)
+    parser.add_argument('--n-queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    X = clustered_vectors(args.n_vectors + args.n_queries, args.dim, args.n_topics)
+    X, queries = X[:args.n_vectors], X[args.n_vectors:]
+    rng = np.random.RandomState(1)
+    jids = rng.randint(args.n_journals, size=args.n_vectors).astype(np.int64)
+    rows = np.arange(args.n_vectors, dtype=np.int64)
+
+    start = time.perf_counter()
+    index = ArticleIndex.from_vectors(X, jids, rows)
+    print(f'{args.n_vectors} x {args.dim} vectors, {index.nlist} lists, built in {time.perf_counter() - start:.1f} s')
+
+    expected = exact_search(X, queries, args.k)
+    normalized = normalize_rows(X)
+    start = time.perf_counter()
+    for q in normalize_rows(queries):
+        _top_k(normalized @ q, args.k)
+    exact_qps = len(queries) / (time.perf_counter() - start)
+    print(f'exact       recall@{args.k} 1.000  {exact_qps:8.0f} QPS (one query at a time)')
+
+    for nprobe in (1, 4, 8, 16, 32):
+        start = time.perf_counter()
+        found = [index.search(q, args.k, nprobe)[0] for q in queries]
+        qps = len(queries) / (time.perf_counter() - start)
+        print(f'nprobe {nprobe:3d}  recall@{args.k} {recall_at_k(found, expected, jids, rows):.3f}  {qps:8.0f} QPS '
+              f'({qps / exact_qps:.1f}x exact)')
+
+    jid = int(jids[0])
+    start = time.perf_counter()
+    found = [index.search(q, args.k, jids=[jid])[0] for q in queries[:100]]
+    print(f'jid filter  {100 / (time.perf_counter() - start):8.0f} QPS, '
+          f'all results in journal: {all(neighbor[0] == jid for result in found for neighbor in result)}')
+
+    new = clustered_vectors(10_000, args.dim, args.n_topics, seed=2)
+    start = time.perf_counter()
+    index.add(new, np.full(len(new), -1), np.arange(len(new)))
+    insert_s = time.perf_counter() - start
+    start = time.perf_counter()
+    deleted = sum(index.delete(journal) for journal in range(50))
+    delete_s = time.perf_counter() - start
+    print(f'insert 10000 vectors {insert_s * 1000:.0f} ms, delete {deleted} vectors of 50 journals '
+          f'{delete_s * 1000:.0f} ms, {len(index)} live')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'article_index.bin')
+        start = time.perf_counter()
+        index.save(path)
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = ArticleIndex.load(path)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for q in queries:
+            loaded.search(q, args.k)
+        qps = len(queries) / (time.perf_counter() - start)
+        print(f'save {save_s * 1000:.0f} ms ({os.path.getsize(path) / 2 ** 20:.0f} MB), mmap load {load_s * 1000:.1f} ms, '
+              f'{qps:.0f} QPS on the mapped index')
+
+
+if __name__ == '__main__':
+    main()
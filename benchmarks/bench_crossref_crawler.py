@@ -0,0 +1,94 @@
+import os
+import glob
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+import pandas as pd
+
+from benchmarks.crossref_stub import StubCrossrefServer
+from journal_crawler.crossref_crawler import CrossrefCrawler, flatten_dumps
+
+VARIABLES = ['abstract', 'title', 'DOI', 'created', 'score', 'URL']
+
+
+def notebook_flatten(store_path: str) -> pd.DataFrame:
+    """ scopus_crawler.ipynb: every dump loaded whole, then six try/except lookups per record """
+    df = {var: [] for var in VARIABLES}
+    df['journal'] = []
+    for path in sorted(glob.glob(os.path.join(store_path, '*_raw.jsonl'))):
+        journal = ' '.join(os.path.basename(path)[:-len('_raw.jsonl')].split('_'))
+        with open(path) as file:
+            article = [json.loads(line) for line in file]
+        for i in article:
+            values = {}
+            for var in VARIABLES:
+                try:
+                    values[var] = i[var]
+                except KeyError:
+                    values[var] = None
+            df['journal'].append(journal)
+            for var in VARIABLES:
+                df[var].append(values[var])
+    return pd.DataFrame(df)
+
+
+def crawl(stub: StubCrossrefServer, store_path: str, journals: dict, args, concurrency: int,
+          max_retries: int = 5) -> float:
+    crawler = CrossrefCrawler(store_path, stub.base_url, concurrency=concurrency, rate_limit=args.rate_limit,
+                              rows=args.rows, max_retries=max_retries, backoff_seconds=0.01)
+    start = time.perf_counter()
+    asyncio.run(crawler.crawl(journals, report_interval=5))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crossref crawler against a local works stub: concurrency, '
+                                                 'resume from cursor checkpoints and column-wise flattening')
+    parser.add_argument('--n-journals', type=int, default=8)
+    parser.add_argument('--n-works', type=int, default=2000, help='works per journal')
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.1, help='stub delay per page in seconds')
+    parser.add_argument('--rate-limit', type=float, default=40, help='crawler requests per second')
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    journals = {f'Stub Journal {j}': f'0000-{j:04d}' for j in range(args.n_journals)}
+    n_total = args.n_journals * args.n_works
+    with StubCrossrefServer(args.n_works, args.latency, rate_limit=50) as stub:
+        for concurrency in (1, args.concurrency):
+            with tempfile.TemporaryDirectory() as store_path:
+                elapsed = crawl(stub, store_path, journals, args, concurrency)
+            print(f'concurrency {concurrency}: {n_total} works in {elapsed:.2f} s, {n_total / elapsed:.0f} works/s')
+
+        with tempfile.TemporaryDirectory() as store_path:
+            # Every 9th request fails without retries: journals stop mid-way with their cursor checkpointed
+            stub.fail_every, requests = 9, stub.requests
+            crawl(stub, store_path, journals, args, args.concurrency, max_retries=0)
+            interrupted = stub.requests - requests
+            stub.fail_every, requests = 0, stub.requests
+            crawl(stub, store_path, journals, args, args.concurrency)
+            resumed = stub.requests - requests
+            pages = args.n_journals * -(-args.n_works // args.rows)
+            print(f'interrupted crawl: {interrupted} requests, resumed crawl: {resumed} requests '
+                  f'({pages} pages in all)')
+
+            start = time.perf_counter()
+            table = flatten_dumps(store_path)
+            flatten_s = time.perf_counter() - start
+            start = time.perf_counter()
+            baseline = notebook_flatten(store_path)
+            baseline_s = time.perf_counter() - start
+            assert len(table) == n_total and table['DOI'].unique().to_pylist().__len__() == n_total, \
+                'works lost or duplicated by the resume'
+            df = table.to_pandas()
+            for column in ('journal', 'DOI', 'abstract', 'URL'):
+                assert df[column].equals(baseline[column]), column
+            print(f'flatten {n_total} works: notebook loop {baseline_s:.2f} s, column-wise {flatten_s:.2f} s '
+                  f'({baseline_s / flatten_s:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import glob
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import xmltodict
+
+from typing import List, Optional, Tuple
+
+from benchmarks.oai_stub import list_records_page
+from corpus.store import normalize_oai_record
+from journal_crawler.dc_records import DC_NS, OAI_NS, OAIError, parse_list_records
+
+for _prefix, _uri in {'': OAI_NS, 'oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/', 'dc': DC_NS,
+                      'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}.items():
+    # As the harvester did, so records parse to the same keys as sickle's record.raw
+    ET.register_namespace(_prefix, _uri)
+
+
+def xmltodict_page(page: bytes) -> Tuple[List[dict], Optional[str]]:
+    """ The former harvester path: the page tree, then every record serialized again and parsed by xmltodict """
+    root = ET.fromstring(page)
+    error = root.find(f'{{{OAI_NS}}}error')
+    if error is not None:
+        raise OAIError(error.get('code', ''), (error.text or '').strip())
+    list_records = root.find(f'{{{OAI_NS}}}ListRecords')
+    if list_records is None:
+        return [], None
+    records = [xmltodict.parse(ET.tostring(record, encoding='unicode'))
+               for record in list_records.findall(f'{{{OAI_NS}}}record')]
+    token = list_records.find(f'{{{OAI_NS}}}resumptionToken')
+    token = token.text.strip() if token is not None and token.text and token.text.strip() else None
+    return records, token
+
+
+def record_pages(pages_dir: str, n_pages: int, page_size: int) -> List[str]:
+    """ Stub ListRecords pages written to disk, standing in for pages recorded from a live endpoint """
+    paths = []
+    for page in range(n_pages):
+        path = os.path.join(pages_dir, f'page{page:04d}.xml')
+        with open(path, 'wb') as file:
+            file.write(list_records_page(page, 0, page_size + 1, page_size))
+        paths.append(path)
+    return paths
+
+
+def run(name: str, pages: List[bytes], parse, to_json, dump_path: str, baseline: Optional[dict] = None) -> dict:
+    start = time.perf_counter()
+    n_records = 0
+    with open(dump_path, 'w') as file:
+        for page in pages:
+            records, _ = parse(page)
+            file.writelines(json.dumps(to_json(record)) + '\n' for record in records)
+            n_records += len(records)
+    harvest_s = time.perf_counter() - start
+
+    tracemalloc.start()
+    held = [parse(page)[0] for page in pages]
+    held_mb = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    del held
+
+    start = time.perf_counter()
+    with open(dump_path) as file:
+        rows = [normalize_oai_record(json.loads(line), 0) for line in file]
+    reload_s = time.perf_counter() - start
+
+    result = {'records_per_s': n_records / harvest_s, 'held_mb': held_mb,
+              'dump_mb': os.path.getsize(dump_path) / 2 ** 20, 'reload_s': reload_s, 'rows': rows}
+    line = (f'{name:10s} {n_records / harvest_s:8.0f} records/s parsed and dumped, {held_mb:6.1f} MB held, '
+            f'dump {result["dump_mb"]:6.1f} MB, reload + normalize {reload_s:5.2f} s')
+    if baseline is not None:
+        line += (f'  ({result["records_per_s"] / baseline["records_per_s"]:.1f}x faster, '
+                 f'{baseline["held_mb"] / held_mb:.1f}x less memory)')
+    print(line)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming Dublin Core extraction against the xmltodict '
+                                                 'record trees on recorded ListRecords pages')
+    parser.add_argument('--pages', default=None, help='directory of recorded ListRecords *.xml pages, '
+                                                      'stub pages are recorded when not given')
+    parser.add_argument('--n-pages', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = (sorted(glob.glob(os.path.join(args.pages, '*.xml'))) if args.pages
+                 else record_pages(tmp_dir, args.n_pages, args.page_size))
+        pages = []
+        for path in paths:
+            with open(path, 'rb') as file:
+                pages.append(file.read())
+        print(f'{len(pages)} pages, {sum(map(len, pages)) / 2 ** 20:.1f} MB of XML')
+
+        baseline = run('xmltodict', pages, xmltodict_page, lambda record: record,
+                       os.path.join(tmp_dir, 'xmltodict.jsonl'))
+        streamed = run('dc_records', pages, parse_list_records, lambda record: record.as_dict(),
+                       os.path.join(tmp_dir, 'dc.jsonl'), baseline)
+        assert streamed['rows'] == baseline['rows'], 'normalized records differ'
+        print('normalized corpus rows identical')
+
+
+if __name__ == '__main__':
+    main()
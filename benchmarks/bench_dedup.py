@@ -0,0 +1,62 @@
+import time
+import random
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.synthetic_corpus import generate_abstracts
+from text_handling.dedup import THRESHOLD, NearDuplicateFinder
+from text_handling.text_processing import preprocess_texts
+
+
+def near_duplicate(text: str, rng: random.Random) -> str:
+    """ Re-harvested variant: keyword line dropped, a few words edited or a sentence appended """
+    words = text.split()
+    kind = rng.randrange(3)
+    if kind == 0:
+        words = words[:-rng.randint(3, 6)]
+    elif kind == 1:
+        for _ in range(rng.randint(1, 3)):
+            words[rng.randrange(len(words))] = rng.choice(words)
+    else:
+        words += rng.sample(words, min(len(words), 10))
+    return ' '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MinHash LSH near-duplicate detection throughput and quality')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--n-jids', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # Abstracts are generated once and tiled, copies get their words shuffled so they are not duplicates
+    base = [text.split() for text in preprocess_texts(generate_abstracts(10_000), n_jobs=1)]
+    for size in args.sizes:
+        n_originals = int(size / (1 + args.duplicate_rate))
+        texts = [' '.join(rng.sample(base[i % len(base)], len(base[i % len(base)])) if i >= len(base)
+                          else base[i]) for i in range(n_originals)]
+        sources = [rng.randrange(n_originals) for _ in range(size - n_originals)]
+        texts += [near_duplicate(texts[source], rng) for source in sources]
+        jids = [i % args.n_jids for i in range(n_originals)] + [source % args.n_jids for source in sources]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        finder = NearDuplicateFinder(args.threshold)
+        finder.add(texts, jids)
+        labels = finder.labels()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        found = np.mean([labels[source] == labels[n_originals + i] for i, source in enumerate(sources)])
+        merged_originals = n_originals - len(np.unique(labels[:n_originals]))
+        print(f'{size:>9} texts: {elapsed:7.2f}s {size / elapsed:9.0f} texts/s  peak {peak / 2 ** 20:7.1f} MB  '
+              f'bands {finder.bands}x{finder.rows}  duplicate recall {found:.3f}  originals merged {merged_originals}')
+
+
+if __name__ == '__main__':
+    main()
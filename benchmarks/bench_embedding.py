@@ -0,0 +1,58 @@
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from embedding.encoder import MAX_LENGTH, BATCH_SIZE, load_encoder, pool_hidden_states, tokenize_data, embed_texts
+from benchmarks.synthetic_corpus import generate_abstracts
+from benchmarks.tiny_bert import build_tiny_encoder
+from text_handling.text_processing import preprocess_texts
+
+
+def embed_texts_static(texts, tokenizer, model, max_length=MAX_LENGTH, batch_size=BATCH_SIZE, pooling='mean'):
+    """ Previous path: per-text encode_plus padded to max_length, fixed batch_size x max_length batches """
+    input_ids, attention_masks = tokenize_data(texts, tokenizer, max_length=max_length)
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(input_ids), batch_size):
+            attention_mask = attention_masks[start:start + batch_size]
+            outputs = model(input_ids[start:start + batch_size], attention_mask=attention_mask)
+            embeddings.append(pool_hidden_states(outputs.last_hidden_state, attention_mask, pooling).numpy())
+    return np.concatenate(embeddings, axis=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static max_length padding against length-bucketed dynamic padding')
+    parser.add_argument('--n-docs', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--num-threads', type=int, default=None)
+    parser.add_argument('--model', default=None, help='pretrained model name, default a tiny random BERT')
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    if args.model is None:
+        tokenizer, model = build_tiny_encoder()
+    else:
+        tokenizer, model = load_encoder(args.model)
+
+    # Short and long abstracts mixed, like the word count spread in main.ipynb
+    texts = preprocess_texts(generate_abstracts(args.n_docs), n_jobs=1)
+    texts = [text[:len(text) // (1 + i % 4)] for i, text in enumerate(texts)]
+
+    start = time.perf_counter()
+    expected = embed_texts_static(texts, tokenizer, model, batch_size=args.batch_size)
+    static_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = embed_texts(texts, tokenizer, model, batch_size=args.batch_size)
+    dynamic_time = time.perf_counter() - start
+
+    print(f'docs: {args.n_docs}, threads: {torch.get_num_threads()}, max abs diff: {np.abs(expected - result).max():.2e}')
+    print(f'static padding  : {static_time:8.2f}s {args.n_docs / static_time:8.1f} docs/s')
+    print(f'dynamic padding : {dynamic_time:8.2f}s {args.n_docs / dynamic_time:8.1f} docs/s  x{static_time / dynamic_time:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from benchmarks.synthetic_corpus import generate_abstracts
+from benchmarks.tiny_bert import build_tiny_encoder
+from embedding.encoder import ENCODER_BACKENDS, apply_backend, embed_texts
+from scoop.journal_model import JournalModel, Projection, fit_journal_model
+from scoop.predict import scoop_labels
+from text_handling.text_processing import preprocess_texts
+
+
+def _throughput(texts, tokenizer, model, max_length):
+    start = time.perf_counter()
+    embed_texts(texts, tokenizer, model, max_length=max_length)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def _latency_ms(texts, tokenizer, model, max_length):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        embed_texts([text], tokenizer, model, max_length=max_length)
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000, np.percentile(timings, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encoder backends: embedding and scope decision parity against eager '
+                                                 'fp32, throughput and single-document latency')
+    parser.add_argument('--n-docs', type=int, default=300, help='journal corpus the scope model is fitted on')
+    parser.add_argument('--n-queries', type=int, default=300)
+    parser.add_argument('--n-latency', type=int, default=30)
+    parser.add_argument('--max-length', type=int, default=128)
+    # bert-base-multilingual-cased dimensions, the vocabulary is the synthetic corpus words
+    parser.add_argument('--hidden-size', type=int, default=768)
+    parser.add_argument('--layers', type=int, default=12)
+    parser.add_argument('--heads', type=int, default=12)
+    parser.add_argument('--min-cosine', type=float, default=0.99)
+    parser.add_argument('--min-agreement', type=float, default=0.98)
+    args = parser.parse_args()
+
+    tokenizer, eager = build_tiny_encoder(hidden_size=args.hidden_size, num_hidden_layers=args.layers,
+                                          num_attention_heads=args.heads)
+    corpus = preprocess_texts(generate_abstracts(args.n_docs), n_jobs=1)
+    queries = preprocess_texts(generate_abstracts(args.n_queries, seed=1), n_jobs=1)
+
+    reference = embed_texts(queries, tokenizer, eager, max_length=args.max_length)
+    pca, kmeans, threshold, _ = fit_journal_model(embed_texts(corpus, tokenizer, eager, max_length=args.max_length))
+    journal_model = JournalModel(0, kmeans, threshold, Projection.from_pca(pca))
+    reference_labels, _, _ = scoop_labels(reference, journal_model)
+
+    print(f'hidden {args.hidden_size}, layers {args.layers}, max_length {args.max_length}, '
+          f'threads {torch.get_num_threads()}, queries {args.n_queries}')
+    failed = False
+    for backend in ENCODER_BACKENDS:
+        model = apply_backend(eager, backend)
+        embeddings = embed_texts(queries, tokenizer, model, max_length=args.max_length)
+        cosine = (embeddings * reference).sum(axis=1) / (np.linalg.norm(embeddings, axis=1)
+                                                           * np.linalg.norm(reference, axis=1))
+        labels, _, _ = scoop_labels(embeddings, journal_model)
+        agreement = np.mean([label == expected for label, expected in zip(labels, reference_labels)])
+        throughput = _throughput(queries, tokenizer, model, args.max_length)
+        p50, p99 = _latency_ms(queries[:args.n_latency], tokenizer, model, args.max_length)
+        ok = cosine.min() >= args.min_cosine and agreement >= args.min_agreement
+        failed |= not ok
+        print(f'{backend:6s} {throughput:8.1f} docs/s  latency p50 {p50:7.1f} ms p99 {p99:7.1f} ms  '
+              f'cosine min {cosine.min():.5f} mean {cosine.mean():.5f}  '
+              f'max abs diff {np.abs(embeddings - reference).max():.4f}  scope agreement {agreement:.3f}  '
+              f'{"ok" if ok else "OUT OF TOLERANCE"}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
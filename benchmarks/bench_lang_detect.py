@@ -0,0 +1,70 @@
+import time
+import argparse
+
+import pandas as pd
+
+from transformers import pipeline
+
+from benchmarks.synthetic_corpus import generate_labelled_texts
+from benchmarks.tiny_bert import build_tiny_classifier
+from text_handling.check_lang import LANG_LABELS, LanguageDetector, bert_label_code, load_bert_pipeline
+
+
+def agreement(a, b) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cascaded language detection against BERT on every text')
+    parser.add_argument('--dataset', default=None,
+                        help='dataset_raw_deteksi_bahasa .xlsx/.csv (title, abstract, title_lang, abstract_lang), '
+                             'default synthetic rows')
+    parser.add_argument('--n-rows', type=int, default=2000)
+    parser.add_argument('--bert-model', default=None,
+                        help='language classifier, e.g. jb2k/bert-base-multilingual-cased-language-detection; '
+                             'default a tiny random classifier, which only measures cost')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n-jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.dataset is None:
+        df = pd.DataFrame(generate_labelled_texts(args.n_rows))
+    elif args.dataset.endswith('.xlsx'):
+        df = pd.read_excel(args.dataset)
+    else:
+        df = pd.read_csv(args.dataset)
+    texts = df['title'].astype(str).tolist() + df['abstract'].astype(str).tolist()
+    gold = df['title_lang'].tolist() + df['abstract_lang'].tolist()
+
+    if args.bert_model is None:
+        tokenizer, model = build_tiny_classifier(num_labels=len(LANG_LABELS))
+        bert_pipe = pipeline('text-classification', model=model, tokenizer=tokenizer)
+    else:
+        bert_pipe = load_bert_pipeline(args.bert_model)
+
+    start = time.perf_counter()
+    bert_codes = [bert_label_code(prediction['label'])
+                  for prediction in bert_pipe(texts, batch_size=args.batch_size, truncation=True)]
+    bert_time = time.perf_counter() - start
+
+    detector = LanguageDetector(bert_pipe=bert_pipe, batch_size=args.batch_size, n_jobs=args.n_jobs)
+    start = time.perf_counter()
+    cascade_codes = detector.detect(texts)
+    cascade_time = time.perf_counter() - start
+    stages = dict(detector.stage_counts)
+
+    start = time.perf_counter()
+    detector.detect(texts)
+    cached_time = time.perf_counter() - start
+
+    print(f'texts: {len(texts)}, stages: {stages}')
+    print(f'bert on all : {bert_time:8.2f}s {len(texts) / bert_time:10.1f} texts/s  accuracy {agreement(bert_codes, gold):.3f}')
+    print(f'cascade     : {cascade_time:8.2f}s {len(texts) / cascade_time:10.1f} texts/s  accuracy {agreement(cascade_codes, gold):.3f}'
+          f'  x{bert_time / cascade_time:.1f}')
+    print(f'cascade hit : {cached_time:8.2f}s {len(texts) / cached_time:10.1f} texts/s')
+    print(f'agreement with bert on all: {agreement(cascade_codes, bert_codes):.3f}'
+          + ('' if args.bert_model else ' (random tiny classifier, not meaningful)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from benchmarks.oai_stub import StubOAIServer
+from journal_crawler.oai_harvester import OAIHarvester, done_jids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asyncio OAI harvester against a local stub endpoint')
+    parser.add_argument('--n-journals', type=int, default=20)
+    parser.add_argument('--n-records', type=int, default=500, help='records per journal')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub delay per page in seconds')
+    parser.add_argument('--fail-every', type=int, default=7, help='stub answers 503 every n requests')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with StubOAIServer(args.n_records, args.page_size, args.latency, args.fail_every) as stub, \
+            tempfile.TemporaryDirectory() as store_path:
+        journals = [(jid, stub.journal_url(jid)) for jid in range(args.n_journals)]
+        harvester = OAIHarvester(store_path, concurrency=args.concurrency, per_host_concurrency=args.concurrency,
+                                 backoff_seconds=0.01)
+        start = time.perf_counter()
+        stats = asyncio.run(harvester.harvest(journals, report_interval=5))
+        elapsed = time.perf_counter() - start
+
+        assert done_jids(store_path) == set(range(args.n_journals)), 'some journals were not finished'
+        for jid in range(args.n_journals):
+            with open(os.path.join(store_path, f'jid{jid}_len{args.n_records}_oaisickle.jsonl')) as file:
+                assert sum(1 for _ in file) == args.n_records
+
+    print(f'journals: {args.n_journals}, records: {stats.records}, stub requests: {stub.requests} '
+          f'(every {args.fail_every}th failed), {elapsed:.2f}s, {stats.records / elapsed:.0f} records/s')
+
+
+if __name__ == '__main__':
+    main()
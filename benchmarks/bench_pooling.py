@@ -0,0 +1,61 @@
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+
+from embedding.storage import STORAGE_FORMATS, save_vectors, load_vectors
+
+MAX_LENGTH = 128
+HIDDEN_SIZE = 768
+
+
+def synthetic_hidden_states(n_docs: int, seed: int = 0):
+    """ Random hidden states with abstract-like lengths, padding rows zeroed like a masked encoder output """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(40, MAX_LENGTH + 1, size=n_docs)
+    attention_mask = (np.arange(MAX_LENGTH)[None, :] < lengths[:, None]).astype(np.float32)
+    hidden_states = rng.standard_normal((n_docs, MAX_LENGTH, HIDDEN_SIZE), dtype=np.float32)
+    hidden_states += rng.standard_normal((1, 1, HIDDEN_SIZE), dtype=np.float32)
+    return hidden_states, attention_mask
+
+
+def fit_journal_model(X: np.ndarray) -> float:
+    """ PCA + KMeans as in cluster_multibert_kmeans_pca.ipynb, returns the fit time """
+    start = time.perf_counter()
+    X_pca = PCA(n_components=2, random_state=0).fit_transform(X)
+    KMeans(n_clusters=1, random_state=42, n_init=10).fit(X_pca)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flattened hidden states against pooled document vectors')
+    parser.add_argument('--n-docs', type=int, default=500)
+    args = parser.parse_args()
+
+    hidden_states, attention_mask = synthetic_hidden_states(args.n_docs)
+    representations = {
+        'flatten': hidden_states.reshape(args.n_docs, -1),
+        'mean': (hidden_states * attention_mask[..., None]).sum(axis=1) / attention_mask.sum(axis=1, keepdims=True),
+    }
+
+    print(f'docs: {args.n_docs}')
+    print(f'{"representation":<16}{"dim":>8}{"RAM MB":>10}{"fit s":>10}' + ''.join(f'{"disk " + s + " MB":>18}' for s in STORAGE_FORMATS))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, X in representations.items():
+            sizes = []
+            for storage in STORAGE_FORMATS:
+                path = os.path.join(tmp_dir, f'{name}_{storage}.' + ('npz' if storage == 'int8' else 'npy'))
+                save_vectors(path, X, storage)
+                sizes.append(os.path.getsize(path) / 2 ** 20)
+                load_vectors(path)
+            fit_time = fit_journal_model(X)
+            print(f'{name:<16}{X.shape[1]:>8}{X.nbytes / 2 ** 20:>10.1f}{fit_time:>10.2f}' + ''.join(f'{size:>18.2f}' for size in sizes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from sklearn.decomposition import PCA
+
+from embedding.encoder import embed_texts
+from benchmarks.synthetic_corpus import generate_abstracts
+from benchmarks.tiny_bert import build_tiny_encoder
+from scoop.journal_model import JournalModel, fit_journal_model, save_journal_model, centroid_distances
+from scoop.predict import predict_scoop
+from text_handling.text_processing import comprehensive_preprocessing
+
+
+def predict_scoop_refit(title, abstract, tokenizer, model, kmeans_model, scoop_threshold, pca_data, X_bert, pooling):
+    """ Previous predict_multibert_kmeans.ipynb path: PCA re-fit on the journal's BERT matrix for every article """
+    new_embedding = embed_texts([comprehensive_preprocessing(title + abstract)], tokenizer, model, pooling=pooling)
+    pca = PCA(n_components=pca_data.shape[1], random_state=0)
+    pca.fit(X_bert)
+    new_data_pca = pca.transform(new_embedding.reshape(1, -1))
+    distance_to_centroid = centroid_distances(new_data_pca, kmeans_model.cluster_centers_)[0]
+    return ("in scoop" if distance_to_centroid <= scoop_threshold else "out scoop"), new_data_pca
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single-article scoring latency, PCA re-fit against persisted projection')
+    parser.add_argument('--n-docs', type=int, default=1000, help='size of the journal corpus')
+    parser.add_argument('--n-queries', type=int, default=20)
+    parser.add_argument('--pooling', default='flatten')
+    args = parser.parse_args()
+
+    tokenizer, model = build_tiny_encoder()
+    corpus = [comprehensive_preprocessing(text) for text in generate_abstracts(args.n_docs)]
+    X_bert = embed_texts(corpus, tokenizer, model, pooling=args.pooling)
+    pca, kmeans, threshold, X_pca = fit_journal_model(X_bert)
+    queries = generate_abstracts(args.n_queries, seed=1)
+
+    with tempfile.TemporaryDirectory() as src_dir:
+        save_journal_model(0, pca, kmeans, threshold, X_pca, X_bert, src_dir=src_dir)
+
+        before, expected_labels = [], []
+        for query in queries:
+            start = time.perf_counter()
+            label, _ = predict_scoop_refit('', query, tokenizer, model, kmeans, threshold, X_pca, X_bert, args.pooling)
+            before.append(time.perf_counter() - start)
+            expected_labels.append(label)
+
+        start = time.perf_counter()
+        journal_model = JournalModel.load(0, src_dir)
+        load_time = time.perf_counter() - start
+        after, labels = [], []
+        for query in queries:
+            start = time.perf_counter()
+            label, _ = predict_scoop('', query, tokenizer, model, journal_model, pooling=args.pooling)
+            after.append(time.perf_counter() - start)
+            labels.append(label)
+
+    assert labels == expected_labels, 'persisted projection gives different scoop decisions'
+
+    print(f'journal docs: {args.n_docs}, vector dim: {X_bert.shape[1]}, queries: {args.n_queries}')
+    print(f'PCA re-fit per article : median {np.median(before) * 1000:8.1f} ms')
+    print(f'persisted projection   : median {np.median(after) * 1000:8.1f} ms  (one-off load {load_time * 1000:.1f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import time
+import argparse
+
+import pandas as pd
+
+from text_handling.text_processing import preprocess_text, preprocess_texts
+from benchmarks.synthetic_corpus import generate_abstracts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-row Series.apply(preprocess_text) against preprocess_texts')
+    parser.add_argument('--n-docs', type=int, default=100_000)
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = pd.Series(generate_abstracts(args.n_docs))
+
+    start = time.perf_counter()
+    expected = corpus.apply(preprocess_text)
+    apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = preprocess_texts(corpus, n_jobs=1)
+    plan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result_parallel = preprocess_texts(corpus, n_jobs=args.n_jobs, chunk_size=args.chunk_size)
+    parallel_time = time.perf_counter() - start
+
+    assert expected.equals(result) and expected.equals(result_parallel), 'batch output differs from preprocess_text'
+
+    print(f'docs: {args.n_docs}')
+    print(f'Series.apply(preprocess_text) : {apply_time:8.2f}s {args.n_docs / apply_time:10.0f} docs/s')
+    print(f'preprocess_texts (n_jobs=1)   : {plan_time:8.2f}s {args.n_docs / plan_time:10.0f} docs/s  x{apply_time / plan_time:.2f}')
+    print(f'preprocess_texts (pool)       : {parallel_time:8.2f}s {args.n_docs / parallel_time:10.0f} docs/s  x{apply_time / parallel_time:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.synthetic_corpus import generate_abstracts
+from corpus.store import write_partition
+from pipeline.scheduler import TrainConfig, train_journals
+
+
+def build_store(corpus_path: str, n_journals: int, max_docs: int, seed: int = 0):
+    """ Journals of 10 to max_docs synthetic records, most of them small like the harvested ones """
+    rng = random.Random(seed)
+    for jid in range(n_journals):
+        n_docs = min(max_docs, int(10 + rng.paretovariate(1.2) * 20))
+        rows = [{'jid': jid, 'record_id': f'{jid}-{i}', 'title': '', 'abstract': abstract, 'language': None}
+                for i, abstract in enumerate(generate_abstracts(n_docs, seed=jid))]
+        write_partition(corpus_path, jid, 'oai', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-journal training: packed against per-journal embedding, '
+                                                 'and a rerun that finds everything up to date')
+    parser.add_argument('--n-journals', type=int, default=60)
+    parser.add_argument('--max-docs', type=int, default=400)
+    parser.add_argument('--n-jobs', type=int, default=2)
+    args = parser.parse_args()
+
+    # Imported here, the spawned fit workers re-import this module and do not need torch
+    from benchmarks.tiny_bert import build_tiny_encoder
+    tokenizer, model = build_tiny_encoder()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_path = os.path.join(tmp_dir, 'corpus')
+        build_store(corpus_path, args.n_journals, args.max_docs)
+        config = TrainConfig('tiny', min_words=0, max_words=10_000, languages=())
+
+        timings = {}
+        for name, pack_docs in [('per journal', 1), ('packed', 20_000)]:
+            src_dir = os.path.join(tmp_dir, f'src_{pack_docs}')
+            start = time.perf_counter()
+            counts = train_journals(corpus_path, src_dir, tokenizer, model, config, n_jobs=args.n_jobs,
+                                    pack_docs=pack_docs)
+            timings[name] = time.perf_counter() - start
+            print(f'{name:12s} {timings[name]:7.2f} s  {counts}')
+
+        start = time.perf_counter()
+        counts = train_journals(corpus_path, src_dir, tokenizer, model, config, n_jobs=args.n_jobs)
+        print(f'{"rerun":12s} {time.perf_counter() - start:7.2f} s  {counts}')
+
+        os.utime(os.path.join(corpus_path, 'jid=0', 'oai.parquet'))
+        start = time.perf_counter()
+        counts = train_journals(corpus_path, src_dir, tokenizer, model, config, n_jobs=args.n_jobs)
+        print(f'{"one touched":12s} {time.perf_counter() - start:7.2f} s  {counts}')
+
+
+if __name__ == '__main__':
+    main()
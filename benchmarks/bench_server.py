@@ -0,0 +1,65 @@
+import json
+import time
+import argparse
+import threading
+import urllib.request
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding.encoder import embed_texts
+from benchmarks.synthetic_corpus import generate_abstracts
+from benchmarks.tiny_bert import build_tiny_encoder
+from scoop.journal_model import JournalModel, Projection, fit_journal_model
+from scoop.server import ScoopScorer, make_server
+from text_handling.text_processing import comprehensive_preprocessing
+
+
+def run_load(url: str, abstracts, concurrency: int):
+    """ Fire every abstract at the server from concurrency client threads, returns client-side latencies """
+    def post(abstract):
+        request = urllib.request.Request(url + '/score', data=json.dumps({'title': '', 'abstract': abstract}).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            json.load(response)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(post, abstracts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the scoop scoring server')
+    parser.add_argument('--n-requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    tokenizer, model = build_tiny_encoder()
+    corpus = [comprehensive_preprocessing(text) for text in generate_abstracts(300)]
+    pca, kmeans, threshold, _ = fit_journal_model(embed_texts(corpus, tokenizer, model))
+    journal_models = {0: JournalModel(0, kmeans, threshold, Projection.from_pca(pca))}
+    abstracts = generate_abstracts(args.n_requests, seed=1)
+
+    print(f'requests: {args.n_requests}, concurrency: {args.concurrency}')
+    for max_batch_size in (1, 32):
+        scorer = ScoopScorer(tokenizer, model, journal_models, max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms)
+        server = make_server(scorer, port=0, default_jid=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        start = time.perf_counter()
+        latencies = np.array(run_load(url, abstracts, args.concurrency)) * 1000
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        stats = scorer.stats.snapshot()
+
+        print(f'max_batch_size {max_batch_size:>3}: {args.n_requests / elapsed:8.1f} req/s, '
+              f'p50 {np.percentile(latencies, 50):7.1f} ms, p99 {np.percentile(latencies, 99):7.1f} ms, '
+              f'mean batch {stats["mean_batch_size"]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
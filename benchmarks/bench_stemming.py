@@ -0,0 +1,86 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from text_handling.stemming import IndonesianNormalizer
+from text_handling.text_processing import preprocess_texts
+
+_PREFIXES = ['', '', '', 'me', 'mem', 'men', 'meng', 'di', 'ber', 'ter', 'pe', 'pen', 'per', 'ke', 'se']
+_SUFFIXES = ['', '', '', 'kan', 'an', 'i', 'nya', 'lah']
+
+
+def generate_vocabulary(n_words: int, seed: int = 0) -> list:
+    """ Affixed Indonesian words built on Sastrawi's root word list, the shape of a real abstract vocabulary """
+    from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+    rng = random.Random(seed)
+    roots = StemmerFactory().get_words()
+    from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
+    stopwords = StopWordRemoverFactory().get_stop_words()
+    words = {rng.choice(_PREFIXES) + rng.choice(roots) + rng.choice(_SUFFIXES) for _ in range(n_words)}
+    # Stopwords are among the most frequent words of any text
+    return stopwords[:100] + sorted(words)
+
+
+def generate_texts(n_texts: int, vocabulary: list, words_per_text: int = 150, seed: int = 0) -> list:
+    """ Texts drawing words with Zipf-like frequencies, so the vocabulary repeats as in a corpus """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    return [' '.join(rng.choices(vocabulary, weights, k=words_per_text)) for _ in range(n_texts)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memoized stemming and stopword stage against Sastrawi '
+                                                 'called on every full text')
+    parser.add_argument('--n-texts', type=int, default=20,
+                        help='Sastrawi with its list dictionary spends tens of ms per word, keep this small')
+    parser.add_argument('--n-words', type=int, default=2000, help='distinct affixed words of the corpus')
+    parser.add_argument('--n-jobs', type=int, default=2)
+    args = parser.parse_args()
+
+    from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+    from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
+    texts = generate_texts(args.n_texts, generate_vocabulary(args.n_words))
+    n_words = sum(len(text.split()) for text in texts)
+    print(f'{args.n_texts} texts, {n_words} words, {len(set(" ".join(texts).split()))} distinct')
+
+    def sastrawi(stemmer):
+        stopword_remover = StopWordRemoverFactory().create_stop_word_remover()
+        return [stemmer.stem(stopword_remover.remove(text)) for text in texts]
+
+    cached_stemmer = StemmerFactory().create_stemmer()
+    _, baseline = timed(sastrawi, cached_stemmer.delegatedStemmer)
+    print(f'Sastrawi Stemmer.stem per text          {baseline:7.2f} s')
+    _, cached = timed(sastrawi, cached_stemmer)
+    print(f'Sastrawi CachedStemmer.stem per text    {cached:7.2f} s')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, 'stems.tsv')
+        normalizer = IndonesianNormalizer(cache_path=cache_path)
+        normalized, cold = timed(preprocess_texts, texts, [normalizer], 1)
+        normalizer.save()
+        print(f'IndonesianNormalizer, cold cache        {cold:7.2f} s  {baseline / cold:5.1f}x / {cached / cold:4.1f}x')
+
+        _, warm = timed(preprocess_texts, texts, [IndonesianNormalizer(cache_path=cache_path)], 1)
+        print(f'IndonesianNormalizer, cache file        {warm:7.2f} s  {baseline / warm:5.1f}x / {cached / warm:4.1f}x '
+              f'({os.path.getsize(cache_path) / 1024:.0f} KB)')
+
+        pooled, pool_time = timed(preprocess_texts, texts, [IndonesianNormalizer(cache_path=cache_path)], args.n_jobs, 500)
+        print(f'IndonesianNormalizer, {args.n_jobs} workers, file  {pool_time:7.2f} s  (includes pool start-up)')
+        assert pooled == normalized
+
+        stems = dict(line.rstrip('\n').split('\t') for line in open(cache_path, encoding='utf-8'))
+        stemmer = cached_stemmer.delegatedStemmer
+        mismatches = sum(stems[word] != stemmer.stem_word(word) for word in list(stems)[:300])
+        print(f'stems differing from Sastrawi on 300 cached words: {mismatches}')
+
+
+if __name__ == '__main__':
+    main()
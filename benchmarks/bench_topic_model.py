@@ -0,0 +1,186 @@
+import os
+import time
+import random
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+from benchmarks.synthetic_corpus import _EN_WORDS, _ID_WORDS
+
+DIM = 768
+CHUNK = 20_000
+WORDS_PER_TEXT = 40
+TOPIC_WORDS = 15
+
+
+class SyntheticTopics:
+    """
+    Corpus of n_docs embeddings scattered around n_topics directions, with cleaned texts mixing
+    the shared abstract vocabulary and TOPIC_WORDS words of their topic. Any chunk is generated
+    again from its offset, so a pass over the corpus never holds more than one chunk.
+    """
+    def __init__(self, n_docs: int, n_topics: int, seed: int = 0):
+        self.n_docs = n_docs
+        self.n_topics = n_topics
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self.centers = rng.standard_normal((n_topics, DIM)).astype(np.float32)
+        self.words = [[f'{rng.choice(_ID_WORDS)}{topic}x{i}' for i in range(TOPIC_WORDS)] for topic in range(n_topics)]
+
+    def chunk(self, start: int, texts: bool = False) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        n = min(CHUNK, self.n_docs - start)
+        rng = np.random.RandomState((self.seed, start))
+        labels = rng.randint(self.n_topics, size=n)
+        X = self.centers[labels] + 1.5 * rng.standard_normal((n, DIM)).astype(np.float32)
+        documents = []
+        if texts:
+            text_rng = random.Random(start)
+            common = _ID_WORDS + _EN_WORDS
+            for label in labels:
+                words = text_rng.choices(common, k=WORDS_PER_TEXT * 7 // 10)
+                words += text_rng.choices(self.words[label], k=WORDS_PER_TEXT - len(words))
+                documents.append(' '.join(words))
+        return X, documents, labels
+
+    def write(self, directory: str) -> Tuple[str, str, str]:
+        """ vectors.npy, texts.txt and labels.npy of the whole corpus, written chunk by chunk """
+        paths = tuple(os.path.join(directory, name) for name in ('vectors.npy', 'texts.txt', 'labels.npy'))
+        vectors = np.lib.format.open_memmap(paths[0], mode='w+', dtype=np.float32, shape=(self.n_docs, DIM))
+        labels = np.empty(self.n_docs, dtype=np.int64)
+        with open(paths[1], 'w') as file:
+            for start in range(0, self.n_docs, CHUNK):
+                X, texts, chunk_labels = self.chunk(start, texts=True)
+                vectors[start:start + len(X)] = X
+                labels[start:start + len(X)] = chunk_labels
+                file.writelines(text + '\n' for text in texts)
+        vectors.flush()
+        del vectors
+        np.save(paths[2], labels)
+        return paths
+
+
+def stored_batches(vectors_path: str) -> Iterator[np.ndarray]:
+    """
+    The stored vectors CHUNK rows at a time. Read into memory rather than sliced from a memory map,
+    whose pages would count in the peak RSS although the page cache can drop them.
+    """
+    with open(vectors_path, 'rb') as file:
+        np.lib.format.read_magic(file)
+        shape, _, _ = np.lib.format.read_array_header_1_0(file)
+        for start in range(0, shape[0], CHUNK):
+            yield np.fromfile(file, dtype=np.float32, count=min(CHUNK, shape[0] - start) * DIM).reshape(-1, DIM)
+
+
+def stored_chunks(vectors_path: str, texts_path: str) -> Iterator[Tuple[np.ndarray, List[str]]]:
+    with open(texts_path) as file:
+        for X in stored_batches(vectors_path):
+            yield X, [file.readline().rstrip('\n') for _ in range(len(X))]
+
+
+def keyword_precision(model, corpus: SyntheticTopics, labels: np.ndarray, predicted: np.ndarray) -> float:
+    """ Share of every found topic's top 10 keywords that are words of its majority true topic """
+    hits = total = 0
+    for topic, words in enumerate(model.topic_words(10)):
+        members = labels[predicted == topic]
+        if not len(members) or not words:
+            continue
+        truth = set(corpus.words[np.bincount(members).argmax()])
+        hits += sum(word in truth for word, _ in words)
+        total += len(words)
+    return hits / max(total, 1)
+
+
+def run_size(n_docs: int, n_topics: int, reducer: str, epochs: int, paths: Tuple[str, str, str]) -> dict:
+    """ One fit over the stored corpus in a fresh process, so its peak RSS is its own """
+    from sklearn.metrics import adjusted_rand_score
+    from scoop.topic_model import TopicModel
+
+    corpus = SyntheticTopics(n_docs, n_topics)
+    vectors_path, texts_path, labels_path = paths
+    timings = {}
+    model = TopicModel(n_topics, reducer=reducer)
+    start = time.perf_counter()
+    model.fit_projection(stored_batches(vectors_path))
+    timings['projection'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(epochs):
+        model.fit_clusters(stored_batches(vectors_path))
+    timings['clustering'] = time.perf_counter() - start
+    start = time.perf_counter()
+    model.fit_vocabulary(next(stored_chunks(vectors_path, texts_path))[1])
+    predicted = np.concatenate([model.update(X, texts) for X, texts in stored_chunks(vectors_path, texts_path)])
+    timings['c-TF-IDF'] = time.perf_counter() - start
+    labels = np.load(labels_path)
+    start = time.perf_counter()
+    model.topic_words()
+    timings['keywords'] = time.perf_counter() - start
+
+    X, texts, _ = corpus.chunk(0, texts=True)
+    start = time.perf_counter()
+    model.update(X[:1000], texts[:1000], learn=True)
+    assign_ms = (time.perf_counter() - start)
+
+    return {'timings': timings, 'ari': adjusted_rand_score(labels, predicted),
+            'keywords': keyword_precision(model, corpus, labels, predicted), 'assign_docs_per_s': 1000 / assign_ms,
+            'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def run_in_memory(n_topics: int, paths: Tuple[str, str, str]) -> dict:
+    """ The per-journal recipe on the whole corpus at once: PCA and KMeans on every vector in memory """
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+    from sklearn.metrics import adjusted_rand_score
+    from scoop.article_index import normalize_rows
+
+    start = time.perf_counter()
+    X = np.load(paths[0])
+    labels = np.load(paths[2])
+    X_pca = normalize_rows(PCA(n_components=50, random_state=0).fit_transform(normalize_rows(X)))
+    predicted = KMeans(n_clusters=n_topics, n_init=1, random_state=0).fit_predict(X_pca)
+    return {'seconds': time.perf_counter() - start, 'ari': adjusted_rand_score(labels, predicted),
+            'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def write_corpus(n_docs: int, n_topics: int, directory: str) -> Tuple[str, str, str]:
+    return SyntheticTopics(n_docs, n_topics).write(directory)
+
+
+def in_fresh_process(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(func, *args).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corpus topic model fit time, memory and quality at several '
+                                                 'corpus sizes, against PCA + KMeans on the corpus in memory')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--n-topics', type=int, default=100)
+    parser.add_argument('--reducer', choices=['randomized', 'incremental'], default='randomized')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--max-in-memory', type=int, default=100_000, help='largest size of the in-memory baseline')
+    args = parser.parse_args()
+
+    for n_docs in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Written in a process of its own too: a child starts with the peak RSS of the process it was forked from
+            paths = in_fresh_process(write_corpus, n_docs, args.n_topics, tmp_dir)
+            result = in_fresh_process(run_size, n_docs, args.n_topics, args.reducer, args.epochs, paths)
+            baseline = in_fresh_process(run_in_memory, args.n_topics, paths) if n_docs <= args.max_in_memory else None
+        total = sum(result['timings'].values())
+        stages = ', '.join(f'{stage} {seconds:.1f} s' for stage, seconds in result['timings'].items())
+        print(f'{n_docs:>9d} docs  fit {total:6.1f} s ({stages})  peak {result["peak_mb"]:.0f} MB  '
+              f'ARI {result["ari"]:.3f}  keyword precision {result["keywords"]:.2f}  '
+              f'assign+learn {result["assign_docs_per_s"]:.0f} docs/s')
+        if baseline is not None:
+            print(f'{"":>9s}       in memory PCA + KMeans {baseline["seconds"]:6.1f} s  peak {baseline["peak_mb"]:.0f} MB  '
+                  f'ARI {baseline["ari"]:.3f}')
+
+
+if __name__ == '__main__':
+    main()
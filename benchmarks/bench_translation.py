@@ -0,0 +1,63 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from benchmarks.synthetic_corpus import generate_labelled_texts
+from benchmarks.translate_stub import StubTranslationBackend
+from text_handling.translation import TranslationCache, Translator, split_chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial per-row translation against the batched Translator, on a stub backend')
+    parser.add_argument('--n-rows', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per backend request')
+    parser.add_argument('--fail-every', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate-limit', type=float, default=100.0)
+    parser.add_argument('--max-chars', type=int, default=500)
+    args = parser.parse_args()
+
+    # English titles and abstracts, with repeated titles as in harvested data
+    rows = generate_labelled_texts(args.n_rows)
+    rng = random.Random(0)
+    titles = [row['title'] for row in rows if row['title_lang'] == 'en']
+    texts = [row['abstract'] for row in rows if row['abstract_lang'] == 'en']
+    texts += [rng.choice(titles) for _ in range(len(titles) * 2)]
+
+    # Previous path: one request per row, long texts cut into size-limited chunks sent one by one
+    backend = StubTranslationBackend(args.latency, max_chars=args.max_chars)
+    start = time.perf_counter()
+    for text in texts:
+        for chunk in split_chunks(text, args.max_chars):
+            backend.translate(chunk, 'en', 'id')
+    serial_time = time.perf_counter() - start
+    serial_requests = backend.requests
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, 'translations.sqlite')
+        backend = StubTranslationBackend(args.latency, fail_every=args.fail_every, max_chars=args.max_chars)
+        translator = Translator(backend, TranslationCache(cache_path), concurrency=args.concurrency,
+                                rate_limit=args.rate_limit, backoff_seconds=0.01)
+        start = time.perf_counter()
+        results = translator.translate_texts(texts)
+        batched_time = time.perf_counter() - start
+        assert all(result is not None for result in results)
+        print(translator.stats.summary())
+        translator.cache.close()
+
+        warm = Translator(StubTranslationBackend(args.latency, max_chars=args.max_chars), TranslationCache(cache_path),
+                          rate_limit=args.rate_limit)
+        start = time.perf_counter()
+        warm.translate_texts(texts)
+        warm_time = time.perf_counter() - start
+
+    print(f'texts: {len(texts)}, latency: {args.latency * 1000:.0f} ms, failure every {args.fail_every} requests')
+    print(f'serial     : {serial_time:7.2f}s {serial_requests:6d} requests')
+    print(f'translator : {batched_time:7.2f}s {backend.requests:6d} requests  x{serial_time / batched_time:.1f}')
+    print(f'warm cache : {warm_time:7.2f}s {warm.stats.requests:6d} requests')
+
+
+if __name__ == '__main__':
+    main()
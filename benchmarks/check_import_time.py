@@ -0,0 +1,68 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+
+from typing import Dict, List, Tuple
+
+from benchmarks.synthetic_corpus import generate_abstracts
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cumulative import time allowed per light command, in milliseconds, and modules it must not import
+BUDGETS_MS = {'--help': 100, 'clean': 150, 'detect-lang': 200}
+FORBIDDEN = ('torch', 'transformers', 'sklearn', 'scipy', 'pandas', 'pyarrow', 'deep_translator')
+
+_IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_profile(stderr: str) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """ Cumulative ms of the top-level imports (their sum is the total import time) and of every imported module """
+    top_level, modules = {}, {}
+    for match in _IMPORT_LINE.finditer(stderr):
+        cumulative_ms = int(match.group(2)) / 1000
+        modules[match.group(4)] = cumulative_ms
+        if len(match.group(3)) == 1:
+            top_level[match.group(4)] = cumulative_ms
+    return top_level, modules
+
+
+def run_command(command: List[str]) -> Tuple[Dict[str, float], Dict[str, float]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime', 'main.py'] + command, cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    return import_profile(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time budget of the light CLI commands, '
+                                                 'exits 1 when one is over budget or imports a heavy dependency')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the budgets, for slow machines')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per command, the fastest one counts')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'abstracts.txt')
+        with open(input_path, 'w') as file:
+            file.write('\n'.join(text.replace('\n', ' ') for text in generate_abstracts(20)) + '\n')
+
+        for name, budget in BUDGETS_MS.items():
+            command = [name] if name.startswith('-') else [name, input_path, '-o', os.devnull]
+            runs = [run_command(command) for _ in range(args.repeat)]
+            top_level, modules = min(runs, key=lambda run: sum(run[0].values()))
+            total = sum(top_level.values())
+            heavy = [module for module in FORBIDDEN if module in modules]
+            limit = budget * args.scale
+            ok = total <= limit and not heavy
+            failed |= not ok
+            slowest = sorted(((ms, module) for module, ms in top_level.items()), reverse=True)[:3]
+            print(f'{name:12s} {total:7.1f} ms (budget {limit:.0f} ms)  slowest: '
+                  f'{", ".join(f"{module} {ms:.0f} ms" for ms, module in slowest)}'
+                  f'{"  heavy imports: " + ", ".join(heavy) if heavy else ""}  {"ok" if ok else "FAILED"}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
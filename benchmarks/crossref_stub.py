@@ -0,0 +1,105 @@
+import json
+import time
+import random
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.synthetic_corpus import generate_abstract
+
+
+def work_item(issn: str, i: int) -> dict:
+    """ One works item as selected by the crawler, some without score or URL like real Crossref answers """
+    rng = random.Random(f'{issn}/{i}')
+    day = 1 + i % 28
+    item = {
+        'DOI': f'10.0000/{issn}.{i}',
+        'title': [f'Article {i} of {issn}'] if i % 50 else [],
+        'abstract': '<jats:p>' + generate_abstract(rng) + '</jats:p>',
+        'created': {'date-parts': [[2023, 1, day]], 'date-time': f'2023-01-{day:02d}T00:00:00Z',
+                    'timestamp': 1672531200000 + day * 86_400_000},
+    }
+    if i % 7:
+        item['score'] = 1.0
+    if i % 11:
+        item['URL'] = f'http://dx.doi.org/10.0000/{issn}.{i}'
+    return item
+
+
+class StubCrossrefServer:
+    """
+    Local /journals/{issn}/works endpoint with n_works works per ISSN and deep-paging cursors,
+    latency seconds of delay per page and a 503 every fail_every requests (0 disables it).
+    Answers with X-Rate-Limit-* headers of rate_limit requests per second; cursors of more than
+    cursor_ttl seconds are rejected with a 400 as expired Crossref cursors are.
+    """
+    def __init__(self, n_works: int = 2000, latency: float = 0.0, fail_every: int = 0, rate_limit: int = 50,
+                 cursor_ttl: float = 300.0):
+        self.n_works = n_works
+        self.latency = latency
+        self.fail_every = fail_every
+        self.rate_limit = rate_limit
+        self.cursor_ttl = cursor_ttl
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 128
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def works_page(self, issn: str, cursor: str, rows: int) -> dict:
+        start = 0 if cursor == '*' else int(cursor.split(':')[1])
+        end = min(start + rows, self.n_works)
+        items = [work_item(issn, i) for i in range(start, end)]
+        return {'status': 'ok', 'message-type': 'work-list',
+                'message': {'next-cursor': f'{issn}:{end}:{time.time()}', 'total-results': self.n_works,
+                            'items-per-page': rows, 'items': items}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status: int, payload: bytes = b''):
+                self.send_response(status)
+                self.send_header('X-Rate-Limit-Limit', str(stub.rate_limit))
+                self.send_header('X-Rate-Limit-Interval', '1s')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                    fail = stub.fail_every and stub.requests % stub.fail_every == 0
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if fail:
+                    self._send(503)
+                    return
+                url = urlparse(self.path)
+                issn = url.path.strip('/').split('/')[1]
+                query = parse_qs(url.query)
+                cursor = query.get('cursor', ['*'])[0]
+                if cursor != '*' and time.time() - float(cursor.split(':')[2]) > stub.cursor_ttl:
+                    self._send(400, b'{"status": "failed", "message": "expired cursor"}')
+                    return
+                page = stub.works_page(issn, cursor, int(query.get('rows', ['20'])[0]))
+                self._send(200, json.dumps(page).encode('utf-8'))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,95 @@
+import time
+import random
+import threading
+
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.synthetic_corpus import generate_abstract
+
+RECORD_TEMPLATE = '''<record><header><identifier>oai:stub:{jid}/{i}</identifier><datestamp>2023-01-01</datestamp><setSpec>stub:ART</setSpec></header><metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/oai_dc/ http://www.openarchives.org/OAI/2.0/oai_dc.xsd"><dc:title xml:lang="id-ID">Judul artikel {i} jurnal {jid}</dc:title><dc:title xml:lang="en-US">Article title {i} journal {jid}</dc:title><dc:creator>Penulis {i}</dc:creator><dc:subject xml:lang="id-ID">pendidikan; kesehatan</dc:subject><dc:description xml:lang="id-ID">{abstract}</dc:description><dc:description xml:lang="en-US">{abstract_en}</dc:description><dc:publisher xml:lang="id-ID">Universitas Stub</dc:publisher><dc:date>2023-01-{day:02d}</dc:date><dc:type>info:eu-repo/semantics/article</dc:type><dc:format>application/pdf</dc:format><dc:identifier>https://stub.ac.id/index.php/j{jid}/article/view/{i}</dc:identifier><dc:identifier>10.0000/stub.{jid}.{i}</dc:identifier><dc:source xml:lang="id-ID">Jurnal Stub {jid}</dc:source><dc:language>ind</dc:language><dc:rights xml:lang="id-ID">Copyright (c) 2023</dc:rights></oai_dc:dc></metadata></record>'''
+
+PAGE_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd"><responseDate>2023-01-01T00:00:00Z</responseDate><request verb="ListRecords">{url}</request>{body}</OAI-PMH>'''
+
+
+def record_xml(jid: int, i: int) -> str:
+    rng = random.Random(jid * 1_000_003 + i)
+    return RECORD_TEMPLATE.format(jid=jid, i=i, day=1 + i % 28, abstract=escape(generate_abstract(rng)),
+                                  abstract_en=escape(generate_abstract(rng)))
+
+
+def list_records_page(jid: int, start: int, n_records: int, page_size: int, url: str = '') -> bytes:
+    """ One ListRecords page of the stub journal jid, with a resumptionToken unless it is the last """
+    end = min(start + page_size, n_records)
+    if n_records == 0:
+        body = '<error code="noRecordsMatch">No records</error>'
+    else:
+        records = ''.join(record_xml(jid, i) for i in range(start, end))
+        token = f'{jid}:{end}' if end < n_records else ''
+        body = (f'<ListRecords>{records}<resumptionToken completeListSize="{n_records}" cursor="{start}">'
+                f'{token}</resumptionToken></ListRecords>')
+    return PAGE_TEMPLATE.format(url=escape(url), body=body).encode('utf-8')
+
+
+class StubOAIServer:
+    """
+    Local OAI-PMH endpoint serving /j{jid}/oai with n_records synthetic oai_dc records per journal,
+    latency seconds of delay per page and a 503 every fail_every requests (0 disables it).
+    """
+    def __init__(self, n_records: int = 500, page_size: int = 100, latency: float = 0.0, fail_every: int = 0):
+        self.n_records = n_records
+        self.page_size = page_size
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 128
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def journal_url(self, jid: int) -> str:
+        return f'{self.base_url}/j{jid}/oai'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                    fail = stub.fail_every and stub.requests % stub.fail_every == 0
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                url = urlparse(self.path)
+                jid = int(url.path.strip('/').split('/')[0][1:])
+                query = parse_qs(url.query)
+                start = int(query['resumptionToken'][0].split(':')[1]) if 'resumptionToken' in query else 0
+                payload = list_records_page(jid, start, stub.n_records, stub.page_size, stub.journal_url(jid))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import platform
+import argparse
+import subprocess
+
+import numpy as np
+
+from functools import cached_property
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic_corpus import generate_abstracts
+from scoop.journal_model import JournalModel, Projection, fit_journal_model
+from text_handling import text_processing
+
+SCALES = {'1k': 1_000, '100k': 100_000, '1M': 1_000_000}
+# Larger scales repeat the first UNIQUE_DOCS generated abstracts, generating 1M takes minutes and GBs
+UNIQUE_DOCS = 100_000
+REPEAT = 3
+THRESHOLD = 0.10
+EMBED_MAX_LENGTH = 256
+EMBED_DIM = 768
+N_JOURNALS = 50
+
+TEXT_FUNCTIONS = ['to_lower', 'remove_url', 'remove_number', 'remove_nbsp', 'remove_abs_word', 'remove_multilang',
+                  'remove_katakunci', 'remove_itemized_bullet_and_numbering', 'remove_punctuation',
+                  'remove_special_character', 'keep_alpha_numeric', 'remove_whitespace', 'remove_email',
+                  'remove_tag', 'remove_phone_number', 'bersihkan_abstrak', 'preprocess_text',
+                  'comprehensive_preprocessing']
+
+
+class BenchContext:
+    """ Corpus and models shared by the cases, built on first use so a filtered run only pays for what it needs """
+    def __init__(self, n_docs: int, seed: int):
+        self.n_docs = n_docs
+        self.seed = seed
+
+    @cached_property
+    def texts(self) -> List[str]:
+        unique = generate_abstracts(min(self.n_docs, UNIQUE_DOCS), seed=self.seed)
+        return (unique * -(-self.n_docs // len(unique)))[:self.n_docs]
+
+    @cached_property
+    def cleaned(self) -> List[str]:
+        unique = text_processing.preprocess_texts(self.texts[:UNIQUE_DOCS], n_jobs=1)
+        return (unique * -(-self.n_docs // len(unique)))[:self.n_docs]
+
+    @cached_property
+    def encoder(self):
+        from benchmarks.tiny_bert import build_tiny_encoder
+        return build_tiny_encoder(seed=self.seed)
+
+    @cached_property
+    def journal_model(self) -> JournalModel:
+        from embedding.encoder import embed_texts
+        tokenizer, model = self.encoder
+        X = embed_texts(self.cleaned[:1000], tokenizer, model, max_length=EMBED_MAX_LENGTH)
+        pca, kmeans, threshold, _ = fit_journal_model(X)
+        return JournalModel(0, kmeans, threshold, Projection.from_pca(pca))
+
+    def vectors(self, n: int, dim: int = EMBED_DIM) -> np.ndarray:
+        return np.random.RandomState(self.seed).standard_normal((n, dim)).astype(np.float32)
+
+
+class Case:
+    """
+    One benchmark: setup(context, n) returns the timed callable, n is the scale capped at max_docs
+    for the cases too slow to run on the whole corpus
+    """
+    def __init__(self, name: str, setup: Callable[[BenchContext, int], Callable[[], object]],
+                 max_docs: Optional[int] = None):
+        self.name = name
+        self.setup = setup
+        self.max_docs = max_docs
+
+    def n_docs(self, scale: int) -> int:
+        return min(scale, self.max_docs) if self.max_docs else scale
+
+
+def _text_function_case(name: str) -> Case:
+    func = getattr(text_processing, name)
+
+    def setup(context: BenchContext, n: int):
+        texts = context.texts[:n]
+        return lambda: [func(text) for text in texts]
+    return Case(f'text_processing.{name}', setup)
+
+
+def _preprocess_texts(context, n):
+    texts = context.texts[:n]
+    return lambda: text_processing.preprocess_texts(texts, n_jobs=1)
+
+
+def _pycld2(context, n):
+    from text_handling.check_lang import lang_checker_pycld2
+    texts = context.cleaned[:n]
+    return lambda: [lang_checker_pycld2(text) for text in texts]
+
+
+def _langdetect(context, n):
+    from text_handling.check_lang import lang_checker_langdetect
+    texts = context.cleaned[:n]
+    return lambda: [lang_checker_langdetect(text) for text in texts]
+
+
+def _language_detector(context, n):
+    from text_handling.check_lang import LanguageDetector
+    texts = context.cleaned[:n]
+    # A new detector per run, the memo cache would turn every repeat after the first into lookups
+    return lambda: LanguageDetector(n_jobs=1).detect(texts)
+
+
+def _tokenize_data(context, n):
+    from embedding.encoder import tokenize_data
+    tokenizer, _ = context.encoder
+    texts = context.cleaned[:n]
+    return lambda: tokenize_data(texts, tokenizer, max_length=EMBED_MAX_LENGTH)
+
+
+def _embed_texts(context, n):
+    from embedding.encoder import embed_texts
+    tokenizer, model = context.encoder
+    texts = context.cleaned[:n]
+    return lambda: embed_texts(texts, tokenizer, model, max_length=EMBED_MAX_LENGTH)
+
+
+def _embed_texts_int8(context, n):
+    from embedding.encoder import apply_backend, embed_texts
+    tokenizer, model = context.encoder
+    model = apply_backend(model, 'int8')
+    texts = context.cleaned[:n]
+    return lambda: embed_texts(texts, tokenizer, model, max_length=EMBED_MAX_LENGTH)
+
+
+def _pca_kmeans_fit(context, n):
+    X = context.vectors(n)
+    # sklearn is imported on the first fit, keep that out of the timing
+    fit_journal_model(X[:10])
+    return lambda: fit_journal_model(X)
+
+
+def _scope_single(context, n):
+    from scoop.predict import predict_scoop
+    tokenizer, model = context.encoder
+    journal_model = context.journal_model
+    texts = context.texts[:n]
+    return lambda: [predict_scoop('', text, tokenizer, model, journal_model, max_length=EMBED_MAX_LENGTH)
+                    for text in texts]
+
+
+def _scope_batch(context, n):
+    from scoop.predict import predict_scoop_batch
+    tokenizer, model = context.encoder
+    journal_model = context.journal_model
+    articles = [('', text) for text in context.texts[:n]]
+    return lambda: predict_scoop_batch(articles, tokenizer, model, journal_model, max_length=EMBED_MAX_LENGTH)
+
+
+def _scope_index_query(context, n):
+    from scoop.scope_index import ScopeIndex
+    rng = np.random.RandomState(context.seed)
+    journals = []
+    for jid in range(N_JOURNALS):
+        X = rng.standard_normal((200, EMBED_DIM)).astype(np.float32) + rng.standard_normal(EMBED_DIM)
+        pca, kmeans, threshold, _ = fit_journal_model(X)
+        journals.append(JournalModel(jid, kmeans, threshold, Projection.from_pca(pca)))
+    index = ScopeIndex.from_journal_models(journals)
+    X = context.vectors(n)
+    return lambda: index.query(X, top_k=5)
+
+
+CASES = ([_text_function_case(name) for name in TEXT_FUNCTIONS] + [
+    Case('text_processing.preprocess_texts', _preprocess_texts),
+    Case('check_lang.pycld2', _pycld2, max_docs=100_000),
+    Case('check_lang.langdetect', _langdetect, max_docs=2_000),
+    Case('check_lang.cascade', _language_detector, max_docs=20_000),
+    Case('encoder.tokenize_data', _tokenize_data, max_docs=20_000),
+    Case('encoder.embed_texts', _embed_texts, max_docs=2_000),
+    Case('encoder.embed_texts_int8', _embed_texts_int8, max_docs=2_000),
+    Case('journal_model.pca_kmeans_fit', _pca_kmeans_fit, max_docs=50_000),
+    Case('predict.scope_single', _scope_single, max_docs=200),
+    Case('predict.scope_batch', _scope_batch, max_docs=2_000),
+    Case('scope_index.query', _scope_index_query, max_docs=100_000),
+])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    import sklearn
+    import torch
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'sklearn': sklearn.__version__, 'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(), 'commit': _git_commit()}
+
+
+def run_case(case: Case, context: BenchContext, repeat: int) -> dict:
+    n = case.n_docs(context.n_docs)
+    run = case.setup(context, n)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {'docs': n, 'repeat': repeat, 'best_s': best, 'median_s': float(np.median(timings)),
+            'docs_per_s': n / best if best > 0 else float('inf')}
+
+
+def run_suite(scale: str, seed: int = 0, repeat: int = REPEAT, patterns: Optional[List[str]] = None) -> dict:
+    """ Run every case matching one of the glob patterns at the given scale """
+    context = BenchContext(SCALES[scale], seed)
+    results = {}
+    for case in CASES:
+        if patterns and not any(fnmatch.fnmatch(case.name, pattern) for pattern in patterns):
+            continue
+        results[case.name] = run_case(case, context, repeat)
+        result = results[case.name]
+        print(f'{case.name:55s} {result["docs"]:>9d} docs {result["best_s"]:9.3f} s {result["docs_per_s"]:12.1f} docs/s',
+              flush=True)
+    return {'scale': scale, 'seed': seed, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': environment(), 'results': results}
+
+
+def compare(current: dict, baseline: dict, threshold: float = THRESHOLD,
+            case_thresholds: Optional[Dict[str, float]] = None) -> List[str]:
+    """
+    Cases whose throughput fell more than their threshold (a fraction, 0.1 = 10% slower) below the
+    baseline. Cases missing from either run or run on a different number of docs are not compared.
+    """
+    case_thresholds = case_thresholds or {}
+    regressions = []
+    for name, result in current['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None or reference['docs'] != result['docs']:
+            continue
+        limit = case_thresholds.get(name, threshold)
+        slowdown = reference['docs_per_s'] / result['docs_per_s'] - 1
+        status = 'REGRESSION' if slowdown > limit else 'ok'
+        print(f'{name:55s} {reference["docs_per_s"]:12.1f} -> {result["docs_per_s"]:12.1f} docs/s '
+              f'{-slowdown:+8.1%} (limit -{limit:.0%}) {status}')
+        if slowdown > limit:
+            regressions.append(name)
+    return regressions
+
+
+def _parse_case_thresholds(values: List[str]) -> Dict[str, float]:
+    thresholds = {}
+    for value in values:
+        name, _, limit = value.rpartition('=')
+        if not name:
+            raise argparse.ArgumentTypeError(f'expected case=fraction, got {value}')
+        thresholds[name] = float(limit)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproducible benchmark suite on a seeded synthetic corpus, '
+                                                 'exits 1 when a case regressed against the baseline')
+    parser.add_argument('--scale', choices=list(SCALES), default='1k')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per case, the best one is reported')
+    parser.add_argument('--cases', nargs='*', default=None, help='glob patterns of case names, e.g. "check_lang.*"')
+    parser.add_argument('--output', default=None, help='JSON results, default benchmark_results_{scale}.json')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed throughput drop as a fraction, default %(default)s')
+    parser.add_argument('--case-threshold', nargs='*', default=[], metavar='CASE=FRACTION',
+                        help='per-case override of --threshold for noisy cases')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for case in CASES:
+            print(f'{case.name:55s} max docs {case.max_docs or "scale"}')
+        return
+
+    results = run_suite(args.scale, args.seed, args.repeat, args.cases)
+    output = args.output or f'benchmark_results_{args.scale}.json'
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'results written to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('scale') != results['scale'] or baseline.get('seed') != results['seed']:
+            print(f'baseline is scale {baseline.get("scale")} seed {baseline.get("seed")}, '
+                  f'not comparable with scale {results["scale"]} seed {results["seed"]}')
+            sys.exit(2)
+        regressions = compare(results, baseline, args.threshold, _parse_case_thresholds(args.case_threshold))
+        if regressions:
+            print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+        print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import random
+
+from typing import Dict, List
+
+_ID_WORDS = (
+    'penelitian ini bertujuan untuk mengetahui pengaruh metode yang digunakan adalah analisis data '
+    'hasil menunjukkan bahwa terdapat hubungan signifikan antara variabel kinerja pegawai siswa sekolah '
+    'kesehatan masyarakat pendidikan ekonomi pertanian produksi kualitas pelayanan pembelajaran model '
+    'sistem informasi pengembangan perusahaan daerah kabupaten kota provinsi sampel responden kuesioner'
+).split()
+_EN_WORDS = (
+    'this study aims to determine the effect of method used is data analysis results show that there '
+    'is a significant relationship between variables employee performance students school public health '
+    'education economy agriculture production quality service learning model information system development'
+).split()
+_ID_KEYWORDS = ['pendidikan', 'kesehatan', 'ekonomi', 'pertanian', 'sistem informasi', 'kinerja']
+_EN_KEYWORDS = ['education', 'health', 'economy', 'agriculture', 'information system', 'performance']
+_NOISE = ['&nbsp;', '<p>', '</p>', '<br/>', '(2019)', '95%', 'p<0.05', '©', '°C', '±']
+
+
+def _sentences(rng: random.Random, words: List[str], n_sentences: int) -> str:
+    sentences = []
+    for _ in range(n_sentences):
+        sentence = [rng.choice(words) for _ in range(rng.randint(8, 20))]
+        if rng.random() < 0.3:
+            sentence.insert(rng.randrange(len(sentence)), rng.choice(_NOISE))
+        sentences.append(' '.join(sentence).capitalize() + '.')
+    return ' '.join(sentences)
+
+
+def generate_abstract(rng: random.Random) -> str:
+    """ Generate one synthetic abstract, mixing Indonesian and English sections like harvested OAI data """
+    parts = []
+    if rng.random() < 0.5:
+        parts.append(rng.choice(['Abstrak', 'ABSTRAK']))
+    parts.append(_sentences(rng, _ID_WORDS, rng.randint(3, 10)))
+    if rng.random() < 0.6:
+        parts.append('Kata kunci: ' + ', '.join(rng.sample(_ID_KEYWORDS, 3)))
+    if rng.random() < 0.4:
+        parts.append(rng.choice(['Abstract', 'ABSTRACT']))
+        parts.append(_sentences(rng, _EN_WORDS, rng.randint(3, 10)))
+        if rng.random() < 0.6:
+            parts.append('Keywords: ' + ', '.join(rng.sample(_EN_KEYWORDS, 3)))
+    text = '\n'.join(parts)
+    if rng.random() < 0.5:
+        text = '<p>' + text + '</p>'
+    return text
+
+
+def generate_abstracts(n: int, seed: int = 0) -> List[str]:
+    """ Generate n synthetic abstracts, reproducible for a given seed """
+    rng = random.Random(seed)
+    return [generate_abstract(rng) for _ in range(n)]
+
+
+def generate_labelled_texts(n: int, seed: int = 0) -> List[Dict[str, str]]:
+    """
+    Rows in the dataset_raw_deteksi_bahasa format (title, abstract, title_lang, abstract_lang).
+    Abstracts with both sections are labelled with the language of the first one.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        title_lang = rng.choice(['id', 'en'])
+        title_words = _ID_WORDS if title_lang == 'id' else _EN_WORDS
+        title = ' '.join(rng.choice(title_words) for _ in range(rng.randint(4, 14))).title()
+        if rng.random() < 0.7:
+            abstract, abstract_lang = generate_abstract(rng), 'id'
+        else:
+            abstract, abstract_lang = _sentences(rng, _EN_WORDS, rng.randint(3, 10)), 'en'
+        rows.append({'title': title, 'abstract': abstract, 'title_lang': title_lang, 'abstract_lang': abstract_lang})
+    return rows
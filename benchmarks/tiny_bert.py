@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+import torch
+
+from transformers import BertConfig, BertForSequenceClassification, BertModel, BertTokenizerFast
+
+from benchmarks.synthetic_corpus import _ID_WORDS, _EN_WORDS
+
+_SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+_CHARACTERS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def _build_tokenizer() -> BertTokenizerFast:
+    # 'a' is both a word and a character, duplicates would shift the token ids past vocab_size
+    vocab = list(dict.fromkeys(_SPECIAL_TOKENS + sorted(set(_ID_WORDS + _EN_WORDS)) + list(_CHARACTERS)
+                               + ['##' + c for c in _CHARACTERS]))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vocab_file = os.path.join(tmp_dir, 'vocab.txt')
+        with open(vocab_file, 'w') as file:
+            file.write('\n'.join(vocab))
+        return BertTokenizerFast(vocab_file=vocab_file, do_lower_case=True, model_max_length=512)
+
+
+def _tiny_config(tokenizer: BertTokenizerFast, hidden_size: int, num_hidden_layers: int,
+                 num_attention_heads: int, **kwargs) -> BertConfig:
+    return BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=hidden_size, num_hidden_layers=num_hidden_layers,
+                      num_attention_heads=num_attention_heads, intermediate_size=hidden_size * 4, **kwargs)
+
+
+def build_tiny_encoder(hidden_size: int = 128, num_hidden_layers: int = 2, num_attention_heads: int = 2,
+                       seed: int = 0):
+    """ Randomly initialized BERT with a vocabulary of the synthetic corpus words, runs offline on CPU """
+    tokenizer = _build_tokenizer()
+    torch.manual_seed(seed)
+    model = BertModel(_tiny_config(tokenizer, hidden_size, num_hidden_layers, num_attention_heads))
+    model.eval()
+    return tokenizer, model
+
+
+def build_tiny_classifier(num_labels: int, hidden_size: int = 128, num_hidden_layers: int = 2,
+                          num_attention_heads: int = 2, seed: int = 0):
+    """ Randomly initialized sequence classifier, same cost profile as a text-classification BERT, random labels """
+    tokenizer = _build_tokenizer()
+    torch.manual_seed(seed)
+    model = BertForSequenceClassification(_tiny_config(tokenizer, hidden_size, num_hidden_layers,
+                                                       num_attention_heads, num_labels=num_labels))
+    model.eval()
+    return tokenizer, model
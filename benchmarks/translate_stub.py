@@ -0,0 +1,28 @@
+import time
+import threading
+
+
+class StubTranslationBackend:
+    """
+    Local stand-in for a translation service: sleeps latency seconds per request, fails every
+    fail_every-th request and rejects chunks over max_chars, like the real backend would.
+    """
+    name = 'stub'
+
+    def __init__(self, latency: float = 0.05, fail_every: int = 0, max_chars: int = 4500):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.max_chars = max_chars
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def translate(self, text: str, source: str, target: str) -> str:
+        with self._lock:
+            self.requests += 1
+            n = self.requests
+        time.sleep(self.latency)
+        if len(text) > self.max_chars:
+            raise ValueError(f'{len(text)} characters is over the {self.max_chars} limit')
+        if self.fail_every and n % self.fail_every == 0:
+            raise ConnectionError('stub failure')
+        return f'[{source}>{target}] {text}'
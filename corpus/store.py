@@ -0,0 +1,210 @@
+import os
+import re
+import glob
+import json
+import zlib
+import argparse
+import logging
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from journal_crawler.dc_records import DCRecord
+from text_handling.text_processing import preprocess_articles
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+CORPUS_PATH = 'corpus_store'
+OAI_STOREPATH = 'oai_sickle_response'
+CROSSREF_STOREPATH = 'journal_crawler/scopus_repsonse'
+
+SCHEMA = pa.schema([
+    ('jid', pa.int64()),
+    ('record_id', pa.string()),
+    ('title', pa.string()),
+    ('abstract', pa.string()),
+    ('language', pa.string()),
+    ('cleaned_text', pa.string()),
+    ('embedding_text', pa.string()),
+    ('word_count', pa.int32()),
+])
+PARTITIONING = ds.partitioning(pa.schema([('jid', pa.int64())]), flavor='hive')
+
+
+def _first_text(value) -> Optional[str]:
+    """ First text of an xmltodict value: a string, {'#text': ...} (e.g. with xml:lang) or a list of those """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('#text')
+    return value.strip() if isinstance(value, str) else None
+
+
+def normalize_dc_record(record: DCRecord, jid: int) -> Optional[dict]:
+    """ Flatten one DCRecord, None for deleted records """
+    if record.deleted:
+        return None
+    return {
+        'jid': jid,
+        'record_id': record.record_id,
+        'title': record.first('title'),
+        'abstract': record.first('description'),
+        'language': record.first('language'),
+    }
+
+
+def normalize_oai_record(record: dict, jid: int) -> Optional[dict]:
+    """
+    Flatten one dumped OAI record, a DCRecord.as_dict() line or an xmltodict record of older
+    dumps and the notebook, None for deleted records without metadata
+    """
+    if 'record_id' in record:
+        return normalize_dc_record(DCRecord.from_dict(record), jid)
+    record = record.get('record', record)
+    metadata = record.get('metadata') or {}
+    dc = metadata.get('oai_dc:dc')
+    if not dc:
+        return None
+    return {
+        'jid': jid,
+        'record_id': _first_text(record.get('header', {}).get('identifier')),
+        'title': _first_text(dc.get('dc:title')),
+        'abstract': _first_text(dc.get('dc:description')),
+        'language': _first_text(dc.get('dc:language')),
+    }
+
+
+def normalize_crossref_record(record: dict, jid: int) -> dict:
+    """ Flatten one Crossref works item """
+    return {
+        'jid': jid,
+        'record_id': record.get('DOI'),
+        'title': _first_text(record.get('title')),
+        'abstract': record.get('abstract'),
+        'language': record.get('language'),
+    }
+
+
+def crossref_jid(journal: str) -> int:
+    """ Stable negative id for a Crossref journal without a jid, kept apart from the positive OAI jids """
+    return -(zlib.crc32(journal.encode('utf-8')) + 1)
+
+
+def read_oai_dump(path: str) -> Iterator[dict]:
+    """ Records of a harvest dump: .jsonl from the journal_crawler modules or a .json list from the notebooks """
+    with open(path) as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                yield json.loads(line)
+        else:
+            yield from json.load(file)
+
+
+def _to_table(rows: List[dict], n_jobs: int = 1) -> pa.Table:
+    """
+    Add the cleaned abstract with its word count and the embedded text of title + cleaned abstract
+    (preprocess_articles), as a table in SCHEMA order
+    """
+    cleaned, texts = preprocess_articles([row['title'] for row in rows], [row['abstract'] for row in rows],
+                                         n_jobs=n_jobs)
+    columns = {name: [row[name] for row in rows] for name in ('jid', 'record_id', 'title', 'abstract', 'language')}
+    columns['cleaned_text'] = cleaned
+    columns['embedding_text'] = texts
+    columns['word_count'] = [len(text.split()) for text in cleaned]
+    return pa.table(columns, schema=SCHEMA)
+
+
+def write_partition(corpus_path: str, jid: int, source: str, rows: List[dict], n_jobs: int = 1) -> str:
+    """ Write (or replace) the part file of one source in the jid partition, atomically """
+    partition_path = os.path.join(corpus_path, f'jid={jid}')
+    os.makedirs(partition_path, exist_ok=True)
+    path = os.path.join(partition_path, f'{source}.parquet')
+    table = _to_table(rows, n_jobs=n_jobs).drop(['jid'])
+    # Dataset discovery skips names starting with '.', a file left by a crashed write is never read
+    tmp_path = os.path.join(partition_path, f'.{source}.parquet.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def ingest_oai(corpus_path: str = CORPUS_PATH, store_path: str = OAI_STOREPATH, n_jobs: int = 1) -> int:
+    """ Normalize every finished OAI harvest dump into the store, returns the number of records written """
+    n_records = 0
+    for path in sorted(glob.glob(os.path.join(store_path, 'jid*_len*_oaisickle.json*'))):
+        jid = int(os.path.basename(path)[3:].split('_')[0])
+        rows = [row for row in (normalize_oai_record(record, jid) for record in read_oai_dump(path)) if row]
+        write_partition(corpus_path, jid, 'oai', rows, n_jobs=n_jobs)
+        n_records += len(rows)
+        LOGGER.info(f'jid {jid}: {len(rows)} records from {path}')
+    return n_records
+
+
+def ingest_crossref(corpus_path: str = CORPUS_PATH, store_path: str = CROSSREF_STOREPATH,
+                    journal_jids: Optional[Dict[str, int]] = None, n_jobs: int = 1) -> int:
+    """
+    Normalize Crossref {journal}_raw.json dumps of the notebook and {journal}_raw.jsonl dumps of
+    journal_crawler.crossref_crawler into the store, journal names map to jids via journal_jids
+    """
+    journal_jids = journal_jids or {}
+    n_records = 0
+    for path in sorted(glob.glob(os.path.join(store_path, '*_raw.json*'))):
+        journal = ' '.join(re.sub(r'_raw\.jsonl?$', '', os.path.basename(path)).split('_'))
+        jid = journal_jids.get(journal, crossref_jid(journal))
+        rows = [normalize_crossref_record(record, jid) for record in read_oai_dump(path)]
+        write_partition(corpus_path, jid, 'crossref', rows, n_jobs=n_jobs)
+        n_records += len(rows)
+        LOGGER.info(f'{journal} (jid {jid}): {len(rows)} records from {path}')
+    return n_records
+
+
+def corpus_dataset(corpus_path: str = CORPUS_PATH) -> ds.Dataset:
+    return ds.dataset(corpus_path, format='parquet', partitioning=PARTITIONING, schema=SCHEMA)
+
+
+def read_corpus(corpus_path: str = CORPUS_PATH, columns: Optional[List[str]] = None,
+                jids: Optional[Iterable[int]] = None, filter: Optional[ds.Expression] = None):
+    """
+    Read the corpus as a DataFrame. Only the requested columns are read, jids prunes whole
+    partitions and filter (e.g. (ds.field('word_count') > 50) & (ds.field('word_count') < 300))
+    is pushed down to the parquet row groups.
+    """
+    expression = filter
+    if jids is not None:
+        jid_filter = ds.field('jid').isin(list(jids))
+        expression = jid_filter if expression is None else expression & jid_filter
+    return corpus_dataset(corpus_path).to_table(columns=columns, filter=expression).to_pandas()
+
+
+def iter_corpus_batches(corpus_path: str = CORPUS_PATH, columns: Optional[List[str]] = None,
+                        filter: Optional[ds.Expression] = None, batch_size: int = 10_000) -> Iterator[pa.RecordBatch]:
+    """ Stream the corpus in record batches instead of materializing it """
+    yield from corpus_dataset(corpus_path).to_batches(columns=columns, filter=filter, batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize OAI and Crossref dumps into the jid-partitioned parquet corpus')
+    parser.add_argument('--corpus-path', default=CORPUS_PATH)
+    parser.add_argument('--oai-path', default=OAI_STOREPATH)
+    parser.add_argument('--crossref-path', default=CROSSREF_STOREPATH)
+    parser.add_argument('--crossref-jids', default=None, help='csv with journal and jid columns for Crossref dumps')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    journal_jids = None
+    if args.crossref_jids:
+        import pandas as pd
+        df = pd.read_csv(args.crossref_jids)
+        journal_jids = dict(zip(df['journal'], df['jid'].astype(int)))
+
+    n_oai = ingest_oai(args.corpus_path, args.oai_path, n_jobs=args.n_jobs)
+    n_crossref = ingest_crossref(args.corpus_path, args.crossref_path, journal_jids, n_jobs=args.n_jobs)
+    print(f'{n_oai} OAI and {n_crossref} Crossref records written to {args.corpus_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+from typing import Callable, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+VECTORS_FILENAME = 'vectors.bin'
+INDEX_FILENAME = 'index.json'
+
+
+def cache_key(model_name: str, max_length: int, pooling: str, text: str) -> str:
+    """ Content address of an embedding: hash of everything the vector depends on """
+    content = '\0'.join([model_name, str(max_length), pooling, text])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store. Vectors live in a memory-mapped float file written row after row,
+    the index (key -> row, last access tick) is a small JSON file next to it.
+    When more than max_entries are stored the least recently used ones are evicted, and the
+    vector file is compacted once evicted rows outnumber live ones.
+    """
+    def __init__(self, path: str, dim: int, max_entries: int = 100_000, dtype: str = 'float32'):
+        self.path = path
+        self.dim = dim
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self._vectors_path = os.path.join(path, VECTORS_FILENAME)
+        self._index_path = os.path.join(path, INDEX_FILENAME)
+        self._vectors = None
+        os.makedirs(path, exist_ok=True)
+
+        self.rows = 0
+        self.tick = 0
+        self.entries = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as file:
+                index = json.load(file)
+            if index['dim'] != dim or index['dtype'] != self.dtype.name:
+                raise ValueError(f'Cache at {path} holds {index["dtype"]} vectors of dim {index["dim"]}, '
+                                 f'requested {self.dtype.name} of dim {dim}')
+            self.rows = index['rows']
+            self.tick = index['tick']
+            self.entries = {key: tuple(entry) for key, entry in index['entries'].items()}
+        elif os.path.exists(self._vectors_path):
+            # Vectors without an index can not be addressed, start over
+            os.remove(self._vectors_path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def _memmap(self) -> np.memmap:
+        if self._vectors is None or self._vectors.shape[0] != self.rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode='r', shape=(self.rows, self.dim))
+        return self._vectors
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """ Look up keys, returning the vectors (zero rows for misses) and the positions of the misses """
+        vectors = np.zeros((len(keys), self.dim), dtype=self.dtype)
+        missing = []
+        hits, rows = [], []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is None:
+                missing.append(i)
+                continue
+            self.tick += 1
+            self.entries[key] = (entry[0], self.tick)
+            hits.append(i)
+            rows.append(entry[0])
+        if hits:
+            vectors[hits] = self._memmap()[rows]
+        return vectors, missing
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        """ Append vectors for keys not stored yet, evicting least recently used entries over the bound """
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(len(keys), self.dim)
+        new_keys, new_rows = {}, []
+        for key, vector in zip(keys, vectors):
+            if key in self.entries or key in new_keys:
+                continue
+            new_keys[key] = None
+            new_rows.append(vector)
+        if not new_keys:
+            return
+
+        # Written at the row the index expects, not appended: rows past it are orphans of a put that
+        # died before its flush, and vectors appended after them would be read under the wrong keys
+        mode = 'r+b' if os.path.exists(self._vectors_path) else 'wb'
+        with open(self._vectors_path, mode) as file:
+            file.seek(self.rows * self.dim * self.dtype.itemsize)
+            file.write(np.stack(new_rows).tobytes())
+            file.truncate()
+        for key in new_keys:
+            self.tick += 1
+            self.entries[key] = (self.rows, self.tick)
+            self.rows += 1
+
+        if len(self.entries) > self.max_entries:
+            self._evict(len(self.entries) - self.max_entries)
+        self.flush()
+
+    def _evict(self, n: int):
+        by_last_access = sorted(self.entries, key=lambda key: self.entries[key][1])
+        for key in by_last_access[:n]:
+            del self.entries[key]
+        LOGGER.info(f'Evicted {n} embeddings from {self.path}')
+        if self.rows - len(self.entries) > len(self.entries):
+            self._compact()
+
+    def _compact(self):
+        """ Rewrite the vector file with live rows only """
+        keys = sorted(self.entries, key=lambda key: self.entries[key][0])
+        live_rows = [self.entries[key][0] for key in keys]
+        compacted_path = self._vectors_path + '.tmp'
+        with open(compacted_path, 'wb') as file:
+            file.write(np.ascontiguousarray(self._memmap()[live_rows]).tobytes())
+        self._vectors = None
+        os.replace(compacted_path, self._vectors_path)
+        self.entries = {key: (row, self.entries[key][1]) for row, key in enumerate(keys)}
+        self.rows = len(keys)
+
+    def flush(self):
+        """ Write the index atomically """
+        index = {
+            'dim': self.dim,
+            'dtype': self.dtype.name,
+            'rows': self.rows,
+            'tick': self.tick,
+            'entries': self.entries,
+        }
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self._index_path)
+
+
+def embed_texts_cached(texts: List[str], tokenizer, model, cache: EmbeddingCache,
+                       model_name: str, max_length: int = 128, pooling: str = 'mean',
+                       embed_fn: Optional[Callable] = None, **embed_kwargs) -> np.ndarray:
+    """
+    Embed preprocessed texts, running the model only on texts missing from the cache.
+    embed_fn defaults to embedding.encoder.embed_texts and gets tokenizer, model, max_length,
+    pooling and embed_kwargs.
+    """
+    if embed_fn is None:
+        from embedding.encoder import embed_texts as embed_fn
+
+    keys = [cache_key(model_name, max_length, pooling, text) for text in texts]
+    vectors, missing = cache.get_many(keys)
+    if missing:
+        # Identical texts in one call are embedded once
+        missing_keys = list(dict.fromkeys(keys[i] for i in missing))
+        text_by_key = {keys[i]: texts[i] for i in missing}
+        new_vectors = embed_fn([text_by_key[key] for key in missing_keys], tokenizer, model,
+                               max_length=max_length, pooling=pooling, **embed_kwargs)
+        cache.put_many(missing_keys, new_vectors)
+        row_by_key = {key: row for row, key in enumerate(missing_keys)}
+        for i in missing:
+            vectors[i] = new_vectors[row_by_key[keys[i]]]
+    LOGGER.info(f'Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses')
+    return vectors
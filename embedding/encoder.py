@@ -0,0 +1,162 @@
+import logging
+
+import numpy as np
+import torch
+
+from typing import List, Optional, Tuple
+from transformers import BertTokenizerFast, AutoModel
+
+from profiling import profiler
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MODEL_NAME = 'bert-base-multilingual-cased'
+MAX_LENGTH = 128
+BATCH_SIZE = 32
+# 'flatten' keeps every token's hidden state (max_length * hidden_size floats), as the
+# first journal models did; the other modes give one hidden_size vector per document
+POOLING_MODES = ('cls', 'mean', 'max', 'flatten')
+DEFAULT_POOLING = 'mean'
+# 'eager' runs the fp32 model as loaded; 'int8' dynamically quantizes its Linear layers (CPU only),
+# weights are stored as int8 and activations quantized per batch, the attention and
+# feed-forward matmuls that dominate BERT inference then run on int8 kernels
+ENCODER_BACKENDS = ('eager', 'int8')
+DEFAULT_BACKEND = 'eager'
+
+
+def apply_backend(model, backend: str = DEFAULT_BACKEND, device: str = 'cpu'):
+    """ The model prepared for the inference backend, called the same way as the eager model """
+    if backend == 'eager':
+        return model
+    if backend == 'int8':
+        if device != 'cpu':
+            raise ValueError(f'The int8 backend only runs on cpu, not {device}')
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        quantized.eval()
+        return quantized
+    raise ValueError(f'Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}')
+
+
+def load_encoder(model_name: str = MODEL_NAME, device: str = 'cpu',
+                 backend: str = DEFAULT_BACKEND) -> Tuple[BertTokenizerFast, AutoModel]:
+    """ Load the pre-trained (fast) tokenizer and model, ready for inference on device with the given backend """
+    tokenizer = BertTokenizerFast.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.to(device)
+    # Set model ke mode evaluasi (non-training)
+    model.eval()
+    return tokenizer, apply_backend(model, backend, device)
+
+
+@profiler.instrument()
+def tokenize_data(texts: List[str], tokenizer, max_length: int = MAX_LENGTH) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Tokenize texts one by one, padded to max_length """
+    input_ids = []
+    attention_masks = []
+
+    for text in texts:
+        encoded_dict = tokenizer.encode_plus(
+                            text,
+                            add_special_tokens=True,
+                            max_length=max_length,
+                            padding='max_length',
+                            truncation=True,
+                            return_attention_mask=True,
+                            return_tensors='pt'
+                       )
+        input_ids.append(encoded_dict['input_ids'])
+        attention_masks.append(encoded_dict['attention_mask'])
+
+    input_ids = torch.cat(input_ids, dim=0)
+    attention_masks = torch.cat(attention_masks, dim=0)
+
+    return input_ids, attention_masks
+
+
+@profiler.instrument()
+def tokenize_unpadded(texts: List[str], tokenizer, max_length: int = MAX_LENGTH) -> List[List[int]]:
+    """ Tokenize all texts in one batched tokenizer call, truncated to max_length but not padded """
+    if len(texts) == 0:
+        return []
+    return tokenizer(list(texts), add_special_tokens=True, max_length=max_length, truncation=True,
+                     padding=False, return_attention_mask=False)['input_ids']
+
+
+def pad_batch(batch_input_ids: List[List[int]], pad_token_id: int, width: Optional[int] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Pad token id lists to width (default: the longest in the batch), returning input ids and attention mask """
+    if width is None:
+        width = max(len(ids) for ids in batch_input_ids)
+    input_ids = np.full((len(batch_input_ids), width), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(batch_input_ids), width), dtype=np.int64)
+    for row, ids in enumerate(batch_input_ids):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return torch.from_numpy(input_ids), torch.from_numpy(attention_mask)
+
+
+def pool_hidden_states(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor,
+                       pooling: str = DEFAULT_POOLING) -> torch.Tensor:
+    """ Reduce token hidden states (batch, seq, hidden) to one vector per document, ignoring padding tokens """
+    if pooling == 'cls':
+        return last_hidden_state[:, 0]
+    if pooling == 'mean':
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        return (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    if pooling == 'max':
+        padding = attention_mask.unsqueeze(-1) == 0
+        return last_hidden_state.masked_fill(padding, float('-inf')).max(dim=1).values
+    if pooling == 'flatten':
+        # Mengubah array embeddings menjadi matriks dua dimensi
+        return last_hidden_state.reshape(last_hidden_state.shape[0], -1)
+    raise ValueError(f'Unknown pooling {pooling!r}, expected one of {POOLING_MODES}')
+
+
+def embed_token_ids(encodings: List[List[int]], model, pad_token_id: int, max_length: int = MAX_LENGTH,
+                    batch_size: int = BATCH_SIZE, device: str = 'cpu', pooling: str = DEFAULT_POOLING,
+                    sort_by_length: bool = True) -> np.ndarray:
+    """ Embed already tokenized texts (tokenize_unpadded output), one pooled float32 row per text, in input order """
+    if sort_by_length:
+        order = np.argsort([len(ids) for ids in encodings], kind='stable')
+    else:
+        order = np.arange(len(encodings))
+    width = max_length if pooling == 'flatten' else None
+
+    embeddings = None
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch_index = order[start:start + batch_size]
+            input_ids, attention_mask = pad_batch([encodings[i] for i in batch_index], pad_token_id, width)
+            attention_mask = attention_mask.to(device)
+            with profiler.span('model_forward', count=len(batch_index)) as forward_span:
+                outputs = model(input_ids.to(device), attention_mask=attention_mask)
+                forward_span.add(bytes_in=input_ids.nelement() * input_ids.element_size(),
+                                 bytes_out=outputs.last_hidden_state.nelement() * outputs.last_hidden_state.element_size())
+            with profiler.span('pooling', count=len(batch_index)):
+                pooled = pool_hidden_states(outputs.last_hidden_state, attention_mask, pooling).float().cpu().numpy()
+            if embeddings is None:
+                embeddings = np.empty((len(order), pooled.shape[1]), dtype=np.float32)
+            # Write back to the original positions
+            embeddings[batch_index] = pooled
+
+    if embeddings is None:
+        hidden_size = model.config.hidden_size
+        embeddings = np.empty((0, hidden_size * max_length if pooling == 'flatten' else hidden_size), dtype=np.float32)
+    return embeddings
+
+
+def embed_texts(texts: List[str], tokenizer, model, max_length: int = MAX_LENGTH,
+                batch_size: int = BATCH_SIZE, device: str = 'cpu', pooling: str = DEFAULT_POOLING,
+                num_threads: Optional[int] = None, sort_by_length: bool = True) -> np.ndarray:
+    """
+    Embed texts with the model, one pooled float32 row per text, in input order.
+    Texts are sorted by token length and each batch is padded only to its own longest text,
+    so short abstracts do not pay for max_length attention. 'flatten' pooling needs the fixed
+    max_length width and keeps full padding.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    encodings = tokenize_unpadded(texts, tokenizer, max_length=max_length)
+    return embed_token_ids(encodings, model, tokenizer.pad_token_id, max_length=max_length, batch_size=batch_size,
+                           device=device, pooling=pooling, sort_by_length=sort_by_length)
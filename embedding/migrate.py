@@ -0,0 +1,92 @@
+import os
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+import torch
+
+from typing import List, Optional
+from transformers import BertTokenizer
+
+from embedding.encoder import MODEL_NAME, MAX_LENGTH, POOLING_MODES, pool_hidden_states, tokenize_data
+from embedding.storage import STORAGE_FORMATS, vectors_path, save_vectors
+from text_handling.text_processing import training_preprocessing
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+HIDDEN_SIZE = 768
+CHUNK_SIZE = 256
+
+
+def pool_flattened(flattened: np.ndarray, pooling: str, hidden_size: int = HIDDEN_SIZE,
+                   attention_mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Pool a legacy flattened (n, max_length * hidden_size) matrix without running the model again.
+    CLS pooling only needs the first token; mean and max need the attention mask of the original
+    texts, which the tokenizer alone gives back.
+    """
+    if attention_mask is None and pooling != 'cls':
+        raise ValueError(f'{pooling} pooling needs the attention mask of the original texts')
+    pooled = []
+    for start in range(0, len(flattened), CHUNK_SIZE):
+        chunk = np.asarray(flattened[start:start + CHUNK_SIZE], dtype=np.float32)
+        hidden_states = torch.from_numpy(chunk.reshape(len(chunk), -1, hidden_size))
+        if attention_mask is None:
+            mask = torch.ones(hidden_states.shape[:2], dtype=torch.long)
+        else:
+            mask = torch.as_tensor(attention_mask[start:start + CHUNK_SIZE])
+        pooled.append(pool_hidden_states(hidden_states, mask, pooling).numpy())
+    return np.concatenate(pooled, axis=0)
+
+
+def journal_texts(dataset_path: str, jid: int) -> List[str]:
+    """ Rebuild the texts a journal model was trained on, in training order """
+    df = pd.read_csv(dataset_path)
+    df['data'] = df['title'] + df['abstrac_clean']
+    return df[df['jid'] == jid]['data'].astype(str).apply(training_preprocessing).tolist()
+
+
+def migrate_journal(jid: int, src_dir: str = 'src', pooling: str = 'cls', storage: str = 'float32',
+                    texts: Optional[List[str]] = None, tokenizer=None, max_length: int = MAX_LENGTH,
+                    hidden_size: int = HIDDEN_SIZE) -> str:
+    """ Write src/{jid}_bert_{pooling}.npy|npz from src/{jid}_bert_data.npy, the legacy file is left in place """
+    flattened = np.load(os.path.join(src_dir, f'{jid}_bert_data.npy'), mmap_mode='r')
+    attention_mask = None
+    if pooling != 'cls':
+        if texts is None or tokenizer is None:
+            raise ValueError(f'{pooling} pooling needs the training texts and tokenizer of journal {jid}')
+        if len(texts) != len(flattened):
+            raise ValueError(f'Journal {jid} has {len(flattened)} stored vectors but {len(texts)} texts')
+        _, attention_mask = tokenize_data(texts, tokenizer, max_length=max_length)
+        attention_mask = attention_mask.numpy()
+
+    pooled = pool_flattened(flattened, pooling, hidden_size=hidden_size, attention_mask=attention_mask)
+    path = vectors_path(src_dir, jid, pooling, storage)
+    save_vectors(path, pooled, storage)
+    LOGGER.info(f'Journal {jid}: {flattened.shape} -> {pooled.shape} {storage}, saved to {path}')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pool legacy flattened BERT artifacts into document vectors')
+    parser.add_argument('jids', type=int, nargs='+')
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--pooling', choices=[mode for mode in POOLING_MODES if mode != 'flatten'], default='cls')
+    parser.add_argument('--storage', choices=STORAGE_FORMATS, default='float32')
+    parser.add_argument('--dataset', default='data/dataset_jurnal_indo_5k.csv',
+                        help='training csv, only read for mean and max pooling')
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    tokenizer = BertTokenizer.from_pretrained(MODEL_NAME) if args.pooling != 'cls' else None
+    for jid in args.jids:
+        texts = journal_texts(args.dataset, jid) if tokenizer is not None else None
+        migrate_journal(jid, args.src_dir, args.pooling, args.storage, texts, tokenizer, args.max_length)
+    print('The journal models (kmeans, threshold, PCA) were fit on the flattened vectors, re-fit them on the new ones.')
+
+
+if __name__ == '__main__':
+    main()
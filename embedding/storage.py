@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from typing import Tuple
+
+STORAGE_FORMATS = ('float32', 'float16', 'int8')
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Symmetric per-row int8 quantization, returns the int8 codes and one float32 scale per row """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scale = np.abs(vectors).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scale[:, None]), -127, 127).astype(np.int8)
+    return codes, scale.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """ Inverse of quantize_int8 """
+    return codes.astype(np.float32) * scale[:, None]
+
+
+def vectors_path(src_dir: str, jid: int, pooling: str, storage: str = 'float32') -> str:
+    """ Artifact path of the pooled document vectors of a journal, int8 vectors are stored with their scales in a .npz """
+    extension = 'npz' if storage == 'int8' else 'npy'
+    return os.path.join(src_dir, f'{jid}_bert_{pooling}.{extension}')
+
+
+def save_vectors(path: str, vectors: np.ndarray, storage: str = 'float32'):
+    """ Save document vectors as float32, float16 or int8 with per-row scales """
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f'Unknown storage {storage!r}, expected one of {STORAGE_FORMATS}')
+    if storage == 'int8':
+        codes, scale = quantize_int8(vectors)
+        with open(path, 'wb') as file:
+            np.savez(file, codes=codes, scale=scale)
+    else:
+        np.save(path, np.asarray(vectors, dtype=storage))
+
+
+def load_vectors(path: str, mmap_mode: str = None) -> np.ndarray:
+    """ Load document vectors saved by save_vectors (or a legacy .npy matrix) as float32 """
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            return dequantize_int8(data['codes'], data['scale'])
+    vectors = np.load(path, mmap_mode=mmap_mode)
+    if vectors.dtype != np.float32:
+        vectors = vectors.astype(np.float32)
+    return vectors
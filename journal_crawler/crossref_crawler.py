@@ -0,0 +1,306 @@
+import os
+import re
+import glob
+import json
+import asyncio
+import argparse
+import logging
+
+import aiohttp
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+
+from typing import Dict, Optional
+
+from journal_crawler.oai_harvester import HarvestStats, JournalHarvest
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+CROSSREF_API = 'https://api.crossref.org'
+STOREPATH = 'journal_crawler/scopus_repsonse'
+ISSN_JOURNALS = {
+    'Cell Metabolism': '1550-4131',
+    'Engineering Geology': '0013-7952',
+}
+SELECT = ('abstract', 'title', 'DOI', 'created', 'score', 'URL')
+ROWS = 1000
+CONCURRENCY = 4
+# Requests per second over all journals, lowered to the X-Rate-Limit-* headers Crossref answers with
+RATE_LIMIT = 10.0
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2.0
+REQUEST_TIMEOUT = 120
+
+WORKS_SCHEMA = pa.schema([
+    ('DOI', pa.string()),
+    ('title', pa.list_(pa.string())),
+    ('abstract', pa.string()),
+    ('created', pa.struct([('date-time', pa.string())])),
+    ('score', pa.float64()),
+    ('URL', pa.string()),
+])
+# Columns of the notebook's data_scopus_raw.csv
+FLAT_SCHEMA = pa.schema([
+    ('journal', pa.string()),
+    ('abstract', pa.string()),
+    ('title', pa.string()),
+    ('DOI', pa.string()),
+    ('created', pa.string()),
+    ('score', pa.float64()),
+    ('URL', pa.string()),
+])
+
+
+class RateLimiter:
+    """ Spaces requests of all tasks evenly to at most rate per second """
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, headers) -> None:
+        """ Lower the rate to the server's X-Rate-Limit-Limit per X-Rate-Limit-Interval (e.g. '50', '1s') """
+        try:
+            limit = int(headers['X-Rate-Limit-Limit'])
+            interval = int(re.match(r'\d+', headers['X-Rate-Limit-Interval']).group())
+        except (KeyError, ValueError, AttributeError):
+            return
+        if limit > 0 and interval > 0 and limit / interval < self.rate:
+            LOGGER.info(f'Rate limit lowered to {limit}/{interval}s by the server')
+            self.rate = limit / interval
+
+
+def dump_name(journal: str) -> str:
+    return '_'.join(journal.split())
+
+
+def done_journals(store_path: str) -> set:
+    """ Journal file names with a finished dump, from this crawler (.jsonl) or the notebook (.json) """
+    return {re.sub(r'_raw\.jsonl?$', '', os.path.basename(path))
+            for path in glob.glob(os.path.join(store_path, '*_raw.json*'))}
+
+
+class JournalCrawl(JournalHarvest):
+    """
+    Files of one journal: works are appended to {journal}.partial.jsonl page by page and the
+    next deep-paging cursor is checkpointed, as the resumption token, with the file size after every page.
+    """
+    def __init__(self, store_path: str, journal: str):
+        self.store_path = store_path
+        self.name = dump_name(journal)
+        self.records_path = os.path.join(store_path, f'{self.name}.partial.jsonl')
+        self.checkpoint_path = os.path.join(store_path, f'{self.name}.checkpoint.json')
+
+    def finish(self, n_records: int) -> str:
+        final_path = os.path.join(self.store_path, f'{self.name}_raw.jsonl')
+        os.replace(self.records_path, final_path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return final_path
+
+
+class CrossrefCrawler:
+    """
+    Asyncio crawler of the works with an abstract of every journal ISSN, through Crossref deep-paging
+    cursors. Journals are crawled concurrently, all requests share one RateLimiter.
+    """
+    def __init__(self, store_path: str = STOREPATH, api_url: str = CROSSREF_API, mailto: Optional[str] = None,
+                 concurrency: int = CONCURRENCY, rate_limit: float = RATE_LIMIT, rows: int = ROWS,
+                 max_retries: int = MAX_RETRIES, backoff_seconds: float = BACKOFF_SECONDS):
+        self.store_path = store_path
+        self.api_url = api_url.rstrip('/')
+        self.mailto = mailto
+        self.concurrency = concurrency
+        self.rows = rows
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.limiter = RateLimiter(rate_limit)
+        self.stats = HarvestStats()
+        os.makedirs(store_path, exist_ok=True)
+
+    def _headers(self) -> dict:
+        # With a mailto Crossref routes the requests to its polite pool
+        return {'User-Agent': f'journal_clustering_bertopic (mailto:{self.mailto})'} if self.mailto else {}
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, params: dict) -> dict:
+        """ GET the works message with retries and exponential backoff on connection errors, 5xx and 429 """
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.wait()
+            try:
+                async with session.get(url, params=params, headers=self._headers()) as response:
+                    self.limiter.update(response.headers)
+                    if response.status == 429 or response.status >= 500:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, headers=response.headers)
+                    response.raise_for_status()
+                    return (await response.json())['message']
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, 'status', None)
+                if attempt == self.max_retries or (status is not None and status < 500 and status != 429):
+                    raise
+                delay = self.backoff_seconds * 2 ** attempt
+                if status == 429 and e.headers and e.headers.get('Retry-After', '').isdigit():
+                    delay = max(delay, float(e.headers['Retry-After']))
+                reason = f'HTTP {status}' if status is not None else repr(e)
+                LOGGER.warning(f'{url} failed ({reason}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def crawl_journal(self, session: aiohttp.ClientSession, journal: str, issn: str) -> int:
+        """ Crawl one journal to disk, resuming from its checkpointed cursor, returns the number of works """
+        crawl = JournalCrawl(self.store_path, journal)
+        cursor, offset, n_records = crawl.load_checkpoint()
+        resumed = cursor is not None
+        if resumed:
+            LOGGER.info(f'{journal}: resuming after {n_records} works')
+
+        url = f'{self.api_url}/journals/{issn}/works'
+        params = {'filter': 'has-abstract:true', 'select': ','.join(SELECT), 'rows': self.rows}
+        if self.mailto:
+            params['mailto'] = self.mailto
+        with open(crawl.records_path, 'ab') as file:
+            while True:
+                try:
+                    message = await self.fetch(session, url, {**params, 'cursor': cursor or '*'})
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 400 and resumed:
+                        # Cursors expire after a few minutes unused, the journal has to be crawled again
+                        LOGGER.warning(f'{journal}: cursor expired, restarting')
+                        file.truncate(0)
+                        file.seek(0)
+                        cursor, n_records, resumed = None, 0, False
+                        continue
+                    raise
+
+                items = message.get('items', [])
+                if items:
+                    file.write(''.join(json.dumps(item) + '\n' for item in items).encode('utf-8'))
+                    file.flush()
+                    os.fsync(file.fileno())
+                n_records += len(items)
+                self.stats.records += len(items)
+                self.stats.pages += 1
+                cursor = message.get('next-cursor')
+                if not items or cursor is None or n_records >= message.get('total-results', float('inf')):
+                    break
+                crawl.save_checkpoint(cursor, file.tell(), n_records)
+
+        crawl.finish(n_records)
+        return n_records
+
+    async def _worker(self, session: aiohttp.ClientSession, work: asyncio.Queue):
+        while True:
+            journal, issn = await work.get()
+            try:
+                n_records = await self.crawl_journal(session, journal, issn)
+                self.stats.journals_done += 1
+                LOGGER.info(f'{journal}: {n_records} works')
+            except Exception as e:
+                self.stats.journals_failed += 1
+                LOGGER.error(f'{journal}: {e!r}, checkpoint kept for the next run')
+            finally:
+                work.task_done()
+
+    async def _report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            LOGGER.info(self.stats.summary())
+
+    async def crawl(self, journals: Dict[str, str], report_interval: float = 10.0) -> HarvestStats:
+        """ Crawl every journal name -> ISSN not finished yet in store_path """
+        finished = done_journals(self.store_path)
+        work = asyncio.Queue()
+        for journal, issn in journals.items():
+            if dump_name(journal) not in finished:
+                work.put_nowait((journal, issn))
+        LOGGER.info(f'{work.qsize()} journals to crawl, {len(finished)} already done')
+
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            workers = [asyncio.create_task(self._worker(session, work)) for _ in range(self.concurrency)]
+            reporter = asyncio.create_task(self._report(report_interval))
+            await work.join()
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+        LOGGER.info(self.stats.summary())
+        return self.stats
+
+
+def _first_or_null(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    """ First element of every list, null for null or empty lists """
+    empty = pc.equal(pc.list_value_length(values), 0)
+    values = pc.if_else(empty, pa.scalar(None, values.type), values)
+    return pc.list_element(values, 0)
+
+
+def flatten_dump(path: str, journal: Optional[str] = None) -> pa.Table:
+    """ FLAT_SCHEMA columns of a works dump, parsed and flattened column-wise by pyarrow instead of per record """
+    if path.endswith('.jsonl'):
+        table = pj.read_json(path, parse_options=pj.ParseOptions(explicit_schema=WORKS_SCHEMA,
+                                                                 unexpected_field_behavior='ignore'))
+    else:
+        with open(path) as file:
+            table = pa.Table.from_pylist(json.load(file), schema=WORKS_SCHEMA)
+    journal = journal or ' '.join(re.sub(r'_raw\.jsonl?$', '', os.path.basename(path)).split('_'))
+    return pa.table({
+        'journal': pa.array([journal] * len(table), pa.string()),
+        'abstract': table['abstract'],
+        'title': _first_or_null(table['title']),
+        'DOI': table['DOI'],
+        'created': pc.struct_field(table['created'], 'date-time'),
+        'score': table['score'],
+        'URL': table['URL'],
+    }, schema=FLAT_SCHEMA)
+
+
+def flatten_dumps(store_path: str = STOREPATH) -> pa.Table:
+    """ Every finished dump in store_path as one table """
+    paths = sorted(glob.glob(os.path.join(store_path, '*_raw.json*')))
+    if not paths:
+        return FLAT_SCHEMA.empty_table()
+    return pa.concat_tables([flatten_dump(path) for path in paths])
+
+
+def read_journals(path: str) -> Dict[str, str]:
+    """ journal -> ISSN from a csv with journal and issn columns """
+    import pandas as pd
+    df = pd.read_csv(path, usecols=['journal', 'issn'])
+    return dict(zip(df['journal'], df['issn']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl Crossref works with an abstract of every journal ISSN')
+    parser.add_argument('--journals', default=None, help='csv with journal and issn columns, '
+                                                         'the ISSN_JOURNALS list otherwise')
+    parser.add_argument('--store-path', default=STOREPATH)
+    parser.add_argument('--api-url', default=CROSSREF_API)
+    parser.add_argument('--mailto', default=None, help='contact address for the Crossref polite pool')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT, help='requests per second')
+    parser.add_argument('--rows', type=int, default=ROWS)
+    parser.add_argument('--csv', default=None, help='also write the flattened works of every dump here')
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    journals = read_journals(args.journals) if args.journals else ISSN_JOURNALS
+    crawler = CrossrefCrawler(args.store_path, args.api_url, args.mailto, args.concurrency, args.rate_limit,
+                              args.rows)
+    stats = asyncio.run(crawler.crawl(journals))
+    print(stats.summary())
+    if args.csv:
+        import pyarrow.csv as pcsv
+        pcsv.write_csv(flatten_dumps(args.store_path), args.csv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import xml.etree.ElementTree as ET
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+OAI_NS = 'http://www.openarchives.org/OAI/2.0/'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+DC_ELEMENTS = ('title', 'creator', 'subject', 'description', 'publisher', 'contributor', 'date', 'type',
+               'format', 'identifier', 'source', 'language', 'relation', 'coverage', 'rights')
+# Elements extracted by default, the ones later steps use; any other element is skipped while parsing
+DC_FIELDS = ('title', 'description', 'language', 'identifier', 'date')
+# Elements kept as (xml:lang, text) pairs, journals repeat them once per language
+LANG_TAGGED = frozenset(('title', 'description'))
+# Bytes fed to the parser at once, elements of a chunk are built before the records are read and cleared
+CHUNK_SIZE = 64 * 1024
+
+_RECORD = f'{{{OAI_NS}}}record'
+_HEADER = f'{{{OAI_NS}}}header'
+_IDENTIFIER = f'{{{OAI_NS}}}identifier'
+_DATESTAMP = f'{{{OAI_NS}}}datestamp'
+_TOKEN = f'{{{OAI_NS}}}resumptionToken'
+_ERROR = f'{{{OAI_NS}}}error'
+
+
+class OAIError(Exception):
+    def __init__(self, code: str, message: str = ''):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+
+
+class DCRecord:
+    """
+    One OAI record reduced to its header and Dublin Core elements. An element is a tuple of its
+    values in document order, (xml:lang, text) pairs for LANG_TAGGED ones, and None when it
+    was not extracted.
+    """
+    __slots__ = ('record_id', 'datestamp', 'deleted') + DC_ELEMENTS
+
+    def __init__(self, record_id: Optional[str] = None, datestamp: Optional[str] = None, deleted: bool = False,
+                 **values: tuple):
+        self.record_id = record_id
+        self.datestamp = datestamp
+        self.deleted = deleted
+        for element in DC_ELEMENTS:
+            setattr(self, element, values.get(element))
+
+    def __repr__(self):
+        return f'DCRecord({self.as_dict()!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, DCRecord) and self.as_dict() == other.as_dict()
+
+    def first(self, element: str, languages: Iterable[str] = ()) -> Optional[str]:
+        """ Text of the first value, for LANG_TAGGED elements of the first of languages (prefixes, e.g. 'en') present """
+        values = getattr(self, element)
+        if not values:
+            return None
+        if element not in LANG_TAGGED:
+            return values[0]
+        for language in languages:
+            for lang, text in values:
+                if lang and lang.startswith(language):
+                    return text
+        return values[0][1]
+
+    def as_dict(self) -> dict:
+        """ JSON-ready record with the extracted elements only """
+        record = {'record_id': self.record_id, 'datestamp': self.datestamp}
+        if self.deleted:
+            record['deleted'] = True
+        for element in DC_ELEMENTS:
+            values = getattr(self, element)
+            if values is not None:
+                record[element] = values
+        return record
+
+    @classmethod
+    def from_dict(cls, record: dict) -> 'DCRecord':
+        values = {element: tuple(tuple(value) for value in record[element]) if element in LANG_TAGGED
+                  else tuple(record[element]) for element in DC_ELEMENTS if element in record}
+        return cls(record.get('record_id'), record.get('datestamp'), record.get('deleted', False), **values)
+
+
+class ListRecordsReader:
+    """
+    Incremental parser of one ListRecords page: feed() the response bytes in chunks of any size
+    and take the records completed so far, resumption_token is set once the page is read.
+    Only the header and the selected dc elements are kept, every record is cleared once read,
+    so no tree of the page is held. Raises OAIError on an OAI-PMH error response.
+    """
+    def __init__(self, fields: Iterable[str] = DC_FIELDS):
+        unknown = set(fields) - set(DC_ELEMENTS)
+        if unknown:
+            raise ValueError(f'Not Dublin Core elements: {sorted(unknown)}')
+        self.fields = {f'{{{DC_NS}}}{field}': field for field in fields}
+        self.resumption_token: Optional[str] = None
+        self._parser = ET.XMLPullParser(events=('end',))
+        self._header: List[Optional[str]] = [None, None]
+        self._deleted = False
+        self._values: Dict[str, list] = {}
+
+    def feed(self, chunk: bytes) -> List[DCRecord]:
+        self._parser.feed(chunk)
+        return self._read_events()
+
+    def close(self) -> List[DCRecord]:
+        self._parser.close()
+        return self._read_events()
+
+    def iter_records(self, page: bytes, chunk_size: int = CHUNK_SIZE) -> Iterator[DCRecord]:
+        """ Records of a whole page, parsed chunk_size bytes at a time """
+        for start in range(0, len(page), chunk_size):
+            yield from self.feed(page[start:start + chunk_size])
+        yield from self.close()
+
+    def _read_events(self) -> List[DCRecord]:
+        records = []
+        fields = self.fields
+        for _, elem in self._parser.read_events():
+            tag = elem.tag
+            field = fields.get(tag)
+            if field is not None:
+                text = elem.text.strip() if elem.text else ''
+                if text:
+                    value = (elem.get(XML_LANG), text) if field in LANG_TAGGED else text
+                    self._values.setdefault(field, []).append(value)
+            elif tag == _IDENTIFIER:
+                self._header[0] = elem.text.strip() if elem.text else None
+            elif tag == _DATESTAMP:
+                self._header[1] = elem.text.strip() if elem.text else None
+            elif tag == _HEADER:
+                self._deleted = elem.get('status') == 'deleted'
+            elif tag == _RECORD:
+                values = {field: tuple(self._values.get(field, ())) for field in fields.values()}
+                records.append(DCRecord(self._header[0], self._header[1], self._deleted, **values))
+                self._header = [None, None]
+                self._deleted = False
+                self._values = {}
+                elem.clear()
+            elif tag == _TOKEN:
+                self.resumption_token = elem.text.strip() if elem.text and elem.text.strip() else None
+            elif tag == _ERROR:
+                raise OAIError(elem.get('code', ''), (elem.text or '').strip())
+        return records
+
+
+def parse_list_records(page: bytes, fields: Iterable[str] = DC_FIELDS) -> Tuple[List[DCRecord], Optional[str]]:
+    """ Records of a ListRecords page, and the resumptionToken (None on the last page) """
+    reader = ListRecordsReader(fields)
+    records = list(reader.iter_records(page))
+    return records, reader.resumption_token
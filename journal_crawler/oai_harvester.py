@@ -0,0 +1,250 @@
+import os
+import re
+import glob
+import json
+import time
+import asyncio
+import argparse
+import logging
+
+import aiohttp
+import pandas as pd
+import xml.etree.ElementTree as ET
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from journal_crawler.dc_records import DC_FIELDS, ListRecordsReader, OAIError
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+STOREPATH = 'oai_sickle_response'
+JOURNALS_CSV = 'journal_crawler/testing.csv'
+CONCURRENCY = 32
+PER_HOST_CONCURRENCY = 2
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2.0
+REQUEST_TIMEOUT = 120
+
+class HarvestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.records = 0
+        self.pages = 0
+        self.journals_done = 0
+        self.journals_failed = 0
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.records / elapsed if elapsed else 0.0
+
+    def summary(self) -> str:
+        return (f'journals done: {self.journals_done}, failed: {self.journals_failed}, pages: {self.pages}, '
+                f'records: {self.records}, {self.rate():.1f} records/s')
+
+
+def done_jids(store_path: str) -> set:
+    """ Journals with a finished dump, from this harvester (.jsonl) or the threaded notebook (.json) """
+    return {int(re.match(r'jid(\d+)_len', os.path.basename(path)).group(1))
+            for path in glob.glob(os.path.join(store_path, 'jid*_len*_oaisickle.json*'))}
+
+
+class JournalHarvest:
+    """
+    Files of one journal: records (DCRecord.as_dict() lines) are appended to jid{jid}.partial.jsonl page by page, and after
+    every page jid{jid}.checkpoint.json stores the resumptionToken with the record file size,
+    so an interrupted harvest resumes from the last written page.
+    """
+    def __init__(self, store_path: str, jid: int):
+        self.jid = jid
+        self.records_path = os.path.join(store_path, f'jid{jid}.partial.jsonl')
+        self.checkpoint_path = os.path.join(store_path, f'jid{jid}.checkpoint.json')
+        self.store_path = store_path
+
+    def load_checkpoint(self) -> Tuple[Optional[str], int, int]:
+        """ (resumptionToken, record file offset, records written) to resume from, truncating any unfinished page """
+        token, offset, n_records = None, 0, 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as file:
+                checkpoint = json.load(file)
+            token, offset, n_records = checkpoint['resumption_token'], checkpoint['offset'], checkpoint['records']
+        with open(self.records_path, 'ab') as file:
+            file.truncate(offset)
+        return token, offset, n_records
+
+    def save_checkpoint(self, token: str, offset: int, n_records: int):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'resumption_token': token, 'offset': offset, 'records': n_records}, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def finish(self, n_records: int) -> str:
+        final_path = os.path.join(self.store_path, f'jid{self.jid}_len{n_records}_oaisickle.jsonl')
+        os.replace(self.records_path, final_path)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return final_path
+
+
+class OAIHarvester:
+    """ Asyncio ListRecords harvester with a global and a per-host concurrency limit """
+    def __init__(self, store_path: str = STOREPATH, concurrency: int = CONCURRENCY,
+                 per_host_concurrency: int = PER_HOST_CONCURRENCY, max_retries: int = MAX_RETRIES,
+                 backoff_seconds: float = BACKOFF_SECONDS, metadata_prefix: str = 'oai_dc',
+                 fields: Iterable[str] = DC_FIELDS):
+        self.store_path = store_path
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.metadata_prefix = metadata_prefix
+        self.fields = tuple(fields)
+        self.stats = HarvestStats()
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        os.makedirs(store_path, exist_ok=True)
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_limits[host]
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, params: dict) -> bytes:
+        """ GET with retries and exponential backoff on connection errors, 5xx and 429; other HTTP errors raise """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._host_limit(url):
+                    async with session.get(url, params=params) as response:
+                        if response.status == 429 or response.status >= 500:
+                            raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                              status=response.status)
+                        response.raise_for_status()
+                        return await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = getattr(e, 'status', None)
+                # Other client errors (404, 403, ...) will not go away by asking again
+                if attempt == self.max_retries or (status is not None and status < 500 and status != 429):
+                    raise
+                delay = self.backoff_seconds * 2 ** attempt
+                reason = f'HTTP {status}' if status is not None else repr(e)
+                LOGGER.warning(f'{url} failed ({reason}), retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def harvest_journal(self, session: aiohttp.ClientSession, jid: int, url: str) -> int:
+        """ Harvest one journal to disk, resuming from its checkpoint, returns the number of records """
+        journal = JournalHarvest(self.store_path, jid)
+        token, offset, n_records = journal.load_checkpoint()
+        resumed = token is not None
+        if resumed:
+            LOGGER.info(f'jid {jid}: resuming after {n_records} records')
+
+        with open(journal.records_path, 'ab') as file:
+            while True:
+                if token is None:
+                    params = {'verb': 'ListRecords', 'metadataPrefix': self.metadata_prefix}
+                else:
+                    params = {'verb': 'ListRecords', 'resumptionToken': token}
+                page = await self.fetch(session, url, params)
+                reader = ListRecordsReader(self.fields)
+                n_page_records = 0
+                page_start = file.tell()
+                try:
+                    # Records go to the file as they are parsed, an error response comes before any record
+                    for record in reader.iter_records(page):
+                        file.write((json.dumps(record.as_dict()) + '\n').encode('utf-8'))
+                        n_page_records += 1
+                    token = reader.resumption_token
+                except OAIError as e:
+                    if e.code == 'noRecordsMatch':
+                        token = None
+                    elif e.code == 'badResumptionToken' and resumed:
+                        # Expired token from an old checkpoint, the list has to be harvested again
+                        LOGGER.warning(f'jid {jid}: resumption token expired, restarting')
+                        file.truncate(0)
+                        file.seek(0)
+                        token, n_records, resumed = None, 0, False
+                        continue
+                    else:
+                        raise
+                except ET.ParseError as e:
+                    # Drop the records of the malformed page written so far, the checkpoint of the last good page stays
+                    file.truncate(page_start)
+                    raise OAIError('malformedXML', f'page after {n_records} records: {e}') from e
+
+                if n_page_records:
+                    file.flush()
+                    os.fsync(file.fileno())
+                n_records += n_page_records
+                self.stats.records += n_page_records
+                self.stats.pages += 1
+                if token is None:
+                    break
+                journal.save_checkpoint(token, file.tell(), n_records)
+
+        journal.finish(n_records)
+        return n_records
+
+    async def _worker(self, session: aiohttp.ClientSession, work: asyncio.Queue):
+        while True:
+            jid, url = await work.get()
+            try:
+                n_records = await self.harvest_journal(session, jid, url)
+                self.stats.journals_done += 1
+                LOGGER.info(f'jid {jid}: {n_records} records')
+            except Exception as e:
+                self.stats.journals_failed += 1
+                LOGGER.error(f'jid {jid}: {e!r}, checkpoint kept for the next run')
+            finally:
+                work.task_done()
+
+    async def _report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            LOGGER.info(self.stats.summary())
+
+    async def harvest(self, journals: List[Tuple[int, str]], report_interval: float = 10.0) -> HarvestStats:
+        """ Harvest every (jid, oai url) not finished yet in store_path """
+        finished = done_jids(self.store_path)
+        work = asyncio.Queue()
+        for jid, url in journals:
+            if jid not in finished:
+                work.put_nowait((jid, url))
+        LOGGER.info(f'{work.qsize()} journals to harvest, {len(finished)} already done')
+
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            workers = [asyncio.create_task(self._worker(session, work)) for _ in range(self.concurrency)]
+            reporter = asyncio.create_task(self._report(report_interval))
+            await work.join()
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+        LOGGER.info(self.stats.summary())
+        return self.stats
+
+
+def read_journals(path: str = JOURNALS_CSV) -> List[Tuple[int, str]]:
+    df = pd.read_csv(path, usecols=['jid', 'oai'])
+    return list(zip(df['jid'].astype(int), df['oai']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Harvest OAI-PMH ListRecords of every journal in a csv')
+    parser.add_argument('--journals', default=JOURNALS_CSV, help='csv with jid and oai columns')
+    parser.add_argument('--store-path', default=STOREPATH)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--per-host', type=int, default=PER_HOST_CONCURRENCY)
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES)
+    parser.add_argument('--fields', nargs='+', default=list(DC_FIELDS), help='Dublin Core elements to keep')
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    harvester = OAIHarvester(args.store_path, args.concurrency, args.per_host, args.max_retries,
+                             fields=args.fields)
+    stats = asyncio.run(harvester.harvest(read_journals(args.journals)))
+    print(stats.summary())
+
+
+if __name__ == '__main__':
+    main()
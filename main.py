@@ -1,3 +1,146 @@
-from text_processing.text_processing import *
+import sys
+import argparse
+import logging
 
-print(to_lower(['sadf', 'dasf']))
\ No newline at end of file
+from typing import Iterable, List
+
+# Only the standard library is imported here: every command imports what it needs when it runs,
+# so `clean` does not pay for torch, transformers or sklearn (see benchmarks/check_import_time.py)
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def _read_texts(path: str, column: str = None) -> List[str]:
+    """ One text per line, or one column of a csv; '-' reads stdin """
+    file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if column is None:
+            return [line.rstrip('\n') for line in file]
+        import csv
+        return [row[column] or '' for row in csv.DictReader(file)]
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def _write_lines(path: str, lines: Iterable[str]):
+    file = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+    try:
+        for line in lines:
+            file.write(f'{line}\n')
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+def clean(args):
+    from text_handling.text_processing import preprocess_texts
+    _write_lines(args.output, preprocess_texts(_read_texts(args.input, args.column), n_jobs=args.n_jobs))
+
+
+def detect_lang(args):
+    from text_handling.check_lang import LanguageDetector, load_bert_pipeline
+    detector = LanguageDetector(bert_pipe=load_bert_pipeline() if args.bert else None, n_jobs=args.n_jobs)
+    _write_lines(args.output, (code or '' for code in detector.detect(_read_texts(args.input, args.column))))
+
+
+def embed(args):
+    import numpy as np
+    from embedding.encoder import embed_texts, load_encoder
+    from text_handling.text_processing import comprehensive_preprocessing
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    texts = [comprehensive_preprocessing(text) for text in _read_texts(args.input, args.column)]
+    embeddings = embed_texts(texts, tokenizer, model, max_length=args.max_length, batch_size=args.batch_size,
+                             pooling=args.pooling)
+    np.save(args.output, embeddings)
+    print(f'{embeddings.shape} embeddings written to {args.output}')
+
+
+def train(args):
+    from embedding.encoder import load_encoder
+    from pipeline.scheduler import TrainConfig, train_journals
+    config = TrainConfig(args.model, backend=args.backend, pooling=args.pooling, max_length=args.max_length,
+                         languages=tuple(args.languages))
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    counts = train_journals(args.corpus_path, args.src_dir, tokenizer, model, config, jids=args.jids,
+                            n_jobs=args.n_jobs, batch_size=args.batch_size, force=args.force)
+    print(', '.join(f'{status}: {n}' for status, n in counts.items()))
+
+
+def score(args):
+    import csv
+    from embedding.encoder import load_encoder
+    from scoop.journal_model import JournalModel
+    from scoop.predict import predict_scoop_batch
+    with open(args.input, newline='', encoding='utf-8') as file:
+        articles = [(row.get('title') or '', row.get('abstract') or '') for row in csv.DictReader(file)]
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    journal_model = JournalModel.load(args.jid, args.src_dir)
+    results = predict_scoop_batch(articles, tokenizer, model, journal_model, max_length=args.max_length,
+                                  pooling=args.pooling)
+    _write_lines(args.output, (label for label, _ in results))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # Defaults are literals so building the parser imports nothing; they match embedding.encoder
+    # (MODEL_NAME, MAX_LENGTH, BATCH_SIZE, DEFAULT_POOLING, ENCODER_BACKENDS)
+    parser = argparse.ArgumentParser(description='Journal scope clustering: clean, detect-lang, embed, train, score')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def text_command(name: str, func, help: str) -> argparse.ArgumentParser:
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(func=func)
+        command.add_argument('input', help="one text per line, or a csv with --column; '-' for stdin")
+        command.add_argument('-o', '--output', default='-')
+        command.add_argument('--column', default=None)
+        return command
+
+    def model_options(command: argparse.ArgumentParser):
+        command.add_argument('--model', default='bert-base-multilingual-cased')
+        command.add_argument('--backend', choices=['eager', 'int8'], default='eager')
+        command.add_argument('--pooling', default='mean')
+        command.add_argument('--max-length', type=int, default=128)
+        command.add_argument('--batch-size', type=int, default=32)
+
+    command = text_command('clean', clean, 'preprocess texts as preprocess_texts does')
+    command.add_argument('--n-jobs', type=int, default=1)
+
+    command = text_command('detect-lang', detect_lang, 'language code of every text')
+    command.add_argument('--bert', action='store_true', help='resolve ambiguous texts with the BERT classifier')
+    command.add_argument('--n-jobs', type=int, default=1)
+
+    command = text_command('embed', embed, 'embed texts to a .npy matrix')
+    command.set_defaults(output='embeddings.npy')
+    model_options(command)
+
+    command = commands.add_parser('train', help='train every stale journal of the corpus store')
+    command.set_defaults(func=train)
+    command.add_argument('--corpus-path', default='corpus_store')
+    command.add_argument('--src-dir', default='src')
+    command.add_argument('--jids', type=int, nargs='*', default=None)
+    command.add_argument('--languages', nargs='*', default=['id', 'en'])
+    command.add_argument('--n-jobs', type=int, default=None)
+    command.add_argument('--force', action='store_true')
+    model_options(command)
+
+    command = commands.add_parser('score', help='label articles "in scoop"/"out scoop" for a journal')
+    command.set_defaults(func=score)
+    command.add_argument('jid', type=int)
+    command.add_argument('input', help='csv with title and abstract columns')
+    command.add_argument('-o', '--output', default='-')
+    command.add_argument('--src-dir', default='src')
+    model_options(command)
+    # The journal's own pooling and max_length, saved with its projection
+    command.set_defaults(pooling=None, max_length=None)
+    return parser
+
+
+def main(argv: List[str] = None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+import time
+import queue
+import argparse
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from corpus.store import CORPUS_PATH, iter_corpus_batches
+from embedding.encoder import (MODEL_NAME, MAX_LENGTH, BATCH_SIZE, DEFAULT_POOLING, ENCODER_BACKENDS, DEFAULT_BACKEND,
+                               embed_token_ids, tokenize_unpadded)
+from scoop.incremental import IncrementalJournalModel
+from text_handling.check_lang import LanguageDetector
+from text_handling.text_processing import preprocess_articles
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+CHUNK_SIZE = 256
+QUEUE_SIZE = 2
+MEMORY_LIMIT_MB = 1024
+MIN_WORDS = 50
+MAX_WORDS = 300
+LANGUAGES = ('id', 'en')
+# Rows buffered per journal before its model is first fitted, later chunks update it incrementally
+MIN_FIT_ROWS = 256
+# Fewest rows a journal model can be fitted on
+MIN_ROWS = 2
+
+_SENTINEL = object()
+
+
+class MemoryBudget:
+    """
+    Bytes of chunk data allowed in flight. The source waits for budget before reading a chunk and
+    the sink gives it back once the chunk is absorbed, so a slow stage stalls reading instead of
+    letting chunks pile up. Embeddings the sink holds back for later fits are held on the budget
+    too. A chunk larger than what is left is let through alone.
+    """
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.used = 0
+        self.held = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, n_bytes: int):
+        with self._condition:
+            self._condition.wait_for(lambda: self.used == self.held or self.used + n_bytes <= self.limit)
+            self.used += n_bytes
+            self.peak = max(self.peak, self.used)
+
+    def hold(self, n_bytes: int):
+        """ Count data the sink keeps past its chunk, without waiting: it is in memory already """
+        with self._condition:
+            self.used += n_bytes
+            self.held += n_bytes
+            self.peak = max(self.peak, self.used)
+
+    def release(self, n_bytes: int, held: bool = False):
+        with self._condition:
+            self.used -= n_bytes
+            if held:
+                self.held -= n_bytes
+            self._condition.notify_all()
+
+
+class Chunk:
+    """ Records of one chunk moving through the stages, with the embeddings once computed """
+    def __init__(self, records: pd.DataFrame, cost: int):
+        self.records = records
+        self.cost = cost
+        self.input_ids: Optional[List[List[int]]] = None
+        self.embeddings: Optional[np.ndarray] = None
+
+
+class PipelineStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.rows = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def record(self, stage: str, rows: int, seconds: float):
+        with self.lock:
+            self.rows[stage] += rows
+            self.seconds[stage] += seconds
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        stages = ', '.join(f'{stage}: {self.rows[stage]} rows {self.seconds[stage]:.1f}s' for stage in self.rows)
+        return f'{elapsed:.1f}s, {stages}'
+
+
+def buffered(chunks: Iterable, maxsize: int = QUEUE_SIZE) -> Iterator:
+    """
+    Run the upstream generator in its own thread, handing chunks over through a bounded queue:
+    the stages overlap (tokenizers and torch release the GIL) and a full queue blocks the producer.
+    """
+    handoff = queue.Queue(maxsize=maxsize)
+
+    def produce():
+        try:
+            for chunk in chunks:
+                handoff.put(chunk)
+        except BaseException as e:
+            handoff.put(e)
+        handoff.put(_SENTINEL)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = handoff.get()
+        if item is _SENTINEL:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def _timed(stats: PipelineStats, stage: str, chunks: Iterable[Chunk], func: Callable[[Chunk], Chunk]) -> Iterator[Chunk]:
+    for chunk in chunks:
+        start = time.perf_counter()
+        chunk = func(chunk)
+        stats.record(stage, len(chunk.records), time.perf_counter() - start)
+        yield chunk
+
+
+def read_chunks(corpus_path: str, budget: MemoryBudget, jids: Optional[List[int]] = None,
+                chunk_size: int = CHUNK_SIZE, max_length: int = MAX_LENGTH, hidden_size: int = 768) -> Iterator[Chunk]:
+    """ Stream records from the corpus store, reserving each chunk's estimated footprint from the budget """
+    expression = ds.field('jid').isin(jids) if jids else None
+    for batch in iter_corpus_batches(corpus_path, columns=['jid', 'record_id', 'title', 'abstract'],
+                                     filter=expression, batch_size=chunk_size):
+        records = batch.to_pandas()
+        # Raw and cleaned text, token ids and the pooled vector of every record
+        text_bytes = int(records['title'].str.len().fillna(0).sum() + records['abstract'].str.len().fillna(0).sum())
+        cost = 2 * text_bytes + len(records) * (max_length * 8 + hidden_size * 4)
+        budget.acquire(cost)
+        yield Chunk(records, cost)
+
+
+def clean(chunk: Chunk) -> Chunk:
+    """ Embedded text of title + cleaned abstract as at scoring, words counted on the cleaned abstract """
+    cleaned_abstracts, texts = preprocess_articles(chunk.records['title'], chunk.records['abstract'], n_jobs=1)
+    chunk.records = chunk.records.assign(text=texts)
+    chunk.records['word_count'] = [len(abstract.split()) for abstract in cleaned_abstracts]
+    return chunk
+
+
+def filter_language(chunk: Chunk, detector: LanguageDetector, languages: Iterable[str]) -> Chunk:
+    languages = set(languages)
+    chunk.records = chunk.records[[language in languages for language in detector.detect(chunk.records['text'].tolist())]]
+    return chunk
+
+
+def filter_length(chunk: Chunk, min_words: int = MIN_WORDS, max_words: int = MAX_WORDS) -> Chunk:
+    """ wc > min_words and wc < max_words, as in main.ipynb """
+    word_count = chunk.records['word_count']
+    chunk.records = chunk.records[(word_count > min_words) & (word_count < max_words)]
+    return chunk
+
+
+class JournalAccumulator:
+    """
+    Per-journal incremental models fed chunk by chunk: rows are buffered until a journal has
+    MIN_FIT_ROWS for its first fit, afterwards every chunk is absorbed with partial_fit. Buffered
+    rows are held on the budget; past max_pending_bytes the journals with the most buffered rows
+    are fitted early on what they have, so many small journals can not grow memory without bound.
+    """
+    def __init__(self, min_fit_rows: int = MIN_FIT_ROWS, budget: Optional[MemoryBudget] = None,
+                 max_pending_bytes: Optional[int] = None):
+        self.min_fit_rows = min_fit_rows
+        self.budget = budget
+        if max_pending_bytes is None:
+            max_pending_bytes = budget.limit // 2 if budget is not None else None
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.models: Dict[int, IncrementalJournalModel] = {}
+        self._pending: Dict[int, list] = defaultdict(list)
+
+    def add(self, jid: int, embeddings: np.ndarray, record_ids: List[str]):
+        if jid in self.models:
+            self.models[jid].partial_fit(embeddings, record_ids)
+            return
+        self._pending[jid].append((embeddings, record_ids))
+        self._hold(embeddings.nbytes)
+        if self._pending_rows(jid) >= self.min_fit_rows:
+            self._fit(jid)
+        elif self.max_pending_bytes is not None and self.pending_bytes > self.max_pending_bytes:
+            self._fit_largest()
+
+    def _pending_rows(self, jid: int) -> int:
+        return sum(len(ids) for _, ids in self._pending[jid])
+
+    def _hold(self, n_bytes: int):
+        self.pending_bytes += n_bytes
+        if self.budget is not None:
+            self.budget.hold(n_bytes)
+
+    def _fit_largest(self):
+        """ Fit journals early, most buffered rows first, until the buffer is down to half its limit """
+        for jid in sorted(self._pending, key=self._pending_rows, reverse=True):
+            if self.pending_bytes <= self.max_pending_bytes // 2 or self._pending_rows(jid) < MIN_ROWS:
+                break
+            self._fit(jid)
+
+    def _fit(self, jid: int):
+        pending = self._pending.pop(jid)
+        X = np.concatenate([embeddings for embeddings, _ in pending])
+        self.models[jid] = IncrementalJournalModel.fit(jid, X, [i for _, ids in pending for i in ids])
+        self._release(sum(embeddings.nbytes for embeddings, _ in pending))
+
+    def _release(self, n_bytes: int):
+        self.pending_bytes -= n_bytes
+        if self.budget is not None:
+            self.budget.release(n_bytes, held=True)
+
+    def finish(self) -> Dict[int, IncrementalJournalModel]:
+        """ Fit journals that never reached min_fit_rows on what they have """
+        for jid in list(self._pending):
+            if self._pending_rows(jid) >= MIN_ROWS:
+                self._fit(jid)
+            else:
+                LOGGER.warning(f'Journal {jid}: too few records to fit a model')
+                self._release(sum(embeddings.nbytes for embeddings, _ in self._pending.pop(jid)))
+        return self.models
+
+
+def run_pipeline(corpus_path: str, tokenizer, model, jids: Optional[List[int]] = None,
+                 chunk_size: int = CHUNK_SIZE, queue_size: int = QUEUE_SIZE, memory_limit_mb: int = MEMORY_LIMIT_MB,
+                 languages: Optional[Iterable[str]] = LANGUAGES, min_words: int = MIN_WORDS, max_words: int = MAX_WORDS,
+                 max_length: int = MAX_LENGTH, batch_size: int = BATCH_SIZE, pooling: str = DEFAULT_POOLING,
+                 device: str = 'cpu', min_fit_rows: int = MIN_FIT_ROWS) -> Dict[int, IncrementalJournalModel]:
+    """
+    Stream the corpus store through cleaning, language and length filtering, tokenization and
+    embedding into per-journal models. Every stage runs in its own thread behind a bounded queue
+    and the chunks in flight never exceed memory_limit_mb, so the corpus does not have to fit in RAM.
+    """
+    budget = MemoryBudget(memory_limit_mb * 2 ** 20)
+    stats = PipelineStats()
+    detector = LanguageDetector(n_jobs=1)
+    accumulator = JournalAccumulator(min_fit_rows, budget)
+
+    def tokenize(chunk: Chunk) -> Chunk:
+        chunk.input_ids = tokenize_unpadded(chunk.records['text'].tolist(), tokenizer, max_length=max_length)
+        return chunk
+
+    def embed(chunk: Chunk) -> Chunk:
+        chunk.embeddings = embed_token_ids(chunk.input_ids, model, tokenizer.pad_token_id, max_length=max_length,
+                                           batch_size=batch_size, device=device, pooling=pooling)
+        chunk.input_ids = None
+        return chunk
+
+    hidden_size = model.config.hidden_size
+    chunks = buffered(read_chunks(corpus_path, budget, jids, chunk_size, max_length, hidden_size), queue_size)
+    chunks = buffered(_timed(stats, 'clean', chunks, clean), queue_size)
+    if languages:
+        chunks = buffered(_timed(stats, 'language', chunks,
+                                 lambda chunk: filter_language(chunk, detector, languages)), queue_size)
+    chunks = _timed(stats, 'length', chunks, lambda chunk: filter_length(chunk, min_words, max_words))
+    chunks = buffered(_timed(stats, 'tokenize', chunks, tokenize), queue_size)
+    chunks = buffered(_timed(stats, 'embed', chunks, embed), queue_size)
+
+    for chunk in chunks:
+        start = time.perf_counter()
+        records = chunk.records.reset_index(drop=True)
+        for jid, rows in records.groupby('jid').indices.items():
+            accumulator.add(int(jid), chunk.embeddings[rows], records['record_id'].iloc[rows].tolist())
+        stats.record('accumulate', len(records), time.perf_counter() - start)
+        budget.release(chunk.cost)
+
+    models = accumulator.finish()
+    LOGGER.info(f'{stats.summary()}, peak in flight {budget.peak / 2 ** 20:.1f} MB of {memory_limit_mb} MB')
+    return models
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream the corpus store into per-journal scope models')
+    parser.add_argument('--corpus-path', default=CORPUS_PATH)
+    parser.add_argument('--jids', type=int, nargs='*', default=None, help='default every journal in the store')
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--pooling', default=DEFAULT_POOLING)
+    parser.add_argument('--backend', choices=ENCODER_BACKENDS, default=DEFAULT_BACKEND)
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--memory-limit-mb', type=int, default=MEMORY_LIMIT_MB)
+    parser.add_argument('--languages', nargs='*', default=list(LANGUAGES), help='empty to keep every language')
+    parser.add_argument('--min-words', type=int, default=MIN_WORDS)
+    parser.add_argument('--max-words', type=int, default=MAX_WORDS)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    from embedding.encoder import load_encoder
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    models = run_pipeline(args.corpus_path, tokenizer, model, jids=args.jids, chunk_size=args.chunk_size,
+                          queue_size=args.queue_size, memory_limit_mb=args.memory_limit_mb, languages=args.languages,
+                          min_words=args.min_words, max_words=args.max_words, max_length=args.max_length,
+                          batch_size=args.batch_size, pooling=args.pooling)
+    for journal in models.values():
+        journal.save(args.src_dir, args.pooling, args.max_length)
+    print(f'{len(models)} journal models written to {args.src_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+import multiprocessing
+
+import numpy as np
+import pyarrow.dataset as ds
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from corpus.store import CORPUS_PATH, read_corpus
+from embedding.storage import STORAGE_FORMATS, save_vectors, vectors_path
+from scoop.journal_model import N_COMPONENTS, NUM_CLUSTERS, artifact_path, fit_journal_model, save_journal_model
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+# Bumped when the training procedure changes in a way the config does not capture
+CONFIG_VERSION = 2
+# Records embedded together: journals are packed until a pack holds this many, so many small
+# journals share length-sorted batches instead of each padding its own few batches
+PACK_DOCS = 20_000
+MIN_WORDS = 50
+MAX_WORDS = 300
+LANGUAGES = ('id', 'en')
+MANIFEST = 'train.json'
+ARTIFACTS = ('kmeans.pkl', 'threshold.npy', 'pca_data.npy', 'projection.npz')
+
+_PARTITION_PATTERN = re.compile(r'jid=(-?\d+)$')
+
+
+class TrainConfig:
+    """ Everything a journal model depends on besides its records; its hash marks which artifacts are current """
+    def __init__(self, model_name: str, backend: str = 'eager', pooling: str = 'mean', max_length: int = 128,
+                 n_components: int = N_COMPONENTS, num_clusters: int = NUM_CLUSTERS, min_words: int = MIN_WORDS,
+                 max_words: int = MAX_WORDS, languages: Tuple[str, ...] = LANGUAGES, storage: str = 'float32'):
+        self.model_name = model_name
+        self.backend = backend
+        self.pooling = pooling
+        self.max_length = max_length
+        self.n_components = n_components
+        self.num_clusters = num_clusters
+        self.min_words = min_words
+        self.max_words = max_words
+        self.languages = tuple(sorted(languages)) if languages else ()
+        self.storage = storage
+
+    def as_dict(self) -> dict:
+        return dict(vars(self), languages=list(self.languages), version=CONFIG_VERSION)
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha1(json.dumps(self.as_dict(), sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def min_docs(self) -> int:
+        return max(self.n_components, self.num_clusters) + 1
+
+
+def list_jids(corpus_path: str = CORPUS_PATH) -> List[int]:
+    """ Journals in the store, from the partition directory names alone """
+    jids = []
+    for path in glob.glob(os.path.join(corpus_path, 'jid=*')):
+        match = _PARTITION_PATTERN.search(path)
+        if match:
+            jids.append(int(match.group(1)))
+    return sorted(jids)
+
+
+def input_mtime(corpus_path: str, jid: int) -> float:
+    """ Newest modification time of the journal's partition files """
+    paths = glob.glob(os.path.join(corpus_path, f'jid={jid}', '*.parquet'))
+    return max((os.path.getmtime(path) for path in paths), default=0.0)
+
+
+def read_manifest(src_dir: str, jid: int) -> Optional[dict]:
+    try:
+        with open(artifact_path(src_dir, jid, MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(src_dir: str, corpus_path: str, jid: int, config: TrainConfig) -> bool:
+    """
+    The manifest is written last, after every artifact is in place: a journal is current when its
+    manifest has the config hash and is newer than the journal's partition files. Failed journals are never current.
+    """
+    manifest = read_manifest(src_dir, jid)
+    if manifest is None or manifest.get('config_hash') != config.hash:
+        return False
+    if os.path.getmtime(artifact_path(src_dir, jid, MANIFEST)) < input_mtime(corpus_path, jid):
+        return False
+    if manifest.get('status') == 'failed':
+        return False
+    if manifest.get('status') != 'trained':
+        return True
+    return all(os.path.exists(artifact_path(src_dir, jid, name)) for name in ARTIFACTS)
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def fit_and_save(jid: int, X: np.ndarray, config: dict, src_dir: str) -> Tuple[int, int, str]:
+    """
+    Fit and write one journal in a pool worker. The artifacts are written to a scratch directory,
+    the old manifest is removed, the artifacts are moved into src_dir one by one with os.replace and
+    the new manifest is written last; an interrupted run leaves no manifest, and the journal is
+    trained again on resume.
+    """
+    started = time.time()
+    manifest = {'jid': jid, 'config_hash': config['hash'], 'config': config['values'], 'n_docs': len(X)}
+    manifest_path = artifact_path(src_dir, jid, MANIFEST)
+    if len(X) < config['min_docs']:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        # A model of earlier, larger records would still be picked up by the scorer
+        values = config['values']
+        for path in [artifact_path(src_dir, jid, name) for name in ARTIFACTS] + \
+                [vectors_path(src_dir, jid, values['pooling'], values['storage'])]:
+            if os.path.exists(path):
+                os.remove(path)
+        _write_json_atomic(manifest_path, dict(manifest, status='too_few_docs'))
+        return jid, len(X), 'too_few_docs'
+
+    scratch = os.path.join(src_dir, f'.tmp_{jid}')
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    values = config['values']
+    pca, kmeans, threshold, X_pca = fit_journal_model(X, n_components=values['n_components'],
+                                                      num_clusters=values['num_clusters'])
+    save_journal_model(jid, pca, kmeans, threshold, X_pca, src_dir=scratch, pooling=values['pooling'],
+                       max_length=values['max_length'])
+    save_vectors(vectors_path(scratch, jid, values['pooling'], values['storage']), X, values['storage'])
+    # Until the new manifest is written the artifacts in src_dir may mix two runs
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for name in os.listdir(scratch):
+        os.replace(os.path.join(scratch, name), os.path.join(src_dir, name))
+    os.rmdir(scratch)
+    _write_json_atomic(manifest_path, dict(manifest, status='trained', threshold=threshold,
+                                           seconds=time.time() - started))
+    return jid, len(X), 'trained'
+
+
+class Progress:
+    """ Journals and documents done, with an ETA from the document rate so far """
+    def __init__(self, total_journals: int, total_docs: int):
+        self.total_journals = total_journals
+        self.total_docs = total_docs
+        self.journals = 0
+        self.docs = 0
+        self.started = time.perf_counter()
+
+    def update(self, docs: int) -> str:
+        self.journals += 1
+        self.docs += docs
+        elapsed = time.perf_counter() - self.started
+        rate = self.docs / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total_docs - self.docs) / rate if rate > 0 else float('inf')
+        return (f'{self.journals}/{self.total_journals} journals, {self.docs}/{self.total_docs} docs, '
+                f'{rate:.0f} docs/s, elapsed {_format_seconds(elapsed)}, ETA {_format_seconds(remaining)}')
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds == float('inf'):
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def _length_filter(config: TrainConfig) -> ds.Expression:
+    """ wc > min_words and wc < max_words, as in main.ipynb, pushed down to the parquet reader """
+    return (ds.field('word_count') > config.min_words) & (ds.field('word_count') < config.max_words)
+
+
+def journal_sizes(corpus_path: str, jids: List[int], config: TrainConfig) -> Dict[int, int]:
+    """ Records per journal passing the length filter, read from the jid and word_count columns only """
+    if not jids:
+        return {}
+    counts = read_corpus(corpus_path, columns=['jid'], jids=jids, filter=_length_filter(config))['jid'].value_counts()
+    return {jid: int(counts.get(jid, 0)) for jid in jids}
+
+
+def pack_journals(sizes: Dict[int, int], pack_docs: int = PACK_DOCS) -> List[List[int]]:
+    """ Group journals in order into packs of about pack_docs records; a larger journal is a pack of its own """
+    packs, pack, pack_size = [], [], 0
+    for jid, size in sizes.items():
+        if pack and pack_size + size > pack_docs:
+            packs.append(pack)
+            pack, pack_size = [], 0
+        pack.append(jid)
+        pack_size += size
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def select_records(corpus_path: str, jids: List[int], config: TrainConfig, detector=None):
+    """
+    Records of the journals a model is trained on, in the row order of the stored document vectors:
+    length filtered on the cleaned abstract and, with a LanguageDetector, restricted to config.languages.
+    embedding_text is the text scoring embeds too, comprehensive_preprocessing(title + cleaned abstract).
+    """
+    records = read_corpus(corpus_path, columns=['jid', 'cleaned_text', 'embedding_text'], jids=jids,
+                          filter=_length_filter(config))
+    if records['embedding_text'].isna().any():
+        raise ValueError(f'Journals {jids} were stored without embedding_text, ingest them again with corpus.store')
+    records['cleaned_text'] = records['cleaned_text'].fillna('')
+    if detector is not None and config.languages:
+        languages = detector.detect(records['embedding_text'].tolist())
+        records = records[np.array([language in config.languages for language in languages], dtype=bool)]
+    return records.reset_index(drop=True)
+
+
+def _embedded_packs(corpus_path: str, packs: List[List[int]], tokenizer, model, config: TrainConfig,
+                    batch_size: int) -> Iterator[Dict[int, np.ndarray]]:
+    """ Read, language filter and embed one pack at a time, yields the document vectors per journal """
+    from embedding.encoder import embed_token_ids, tokenize_unpadded
+    from text_handling.check_lang import LanguageDetector
+    detector = LanguageDetector(n_jobs=1) if config.languages else None
+
+    for pack in packs:
+        records = select_records(corpus_path, pack, config, detector)
+        texts = records['embedding_text'].tolist()
+        # One length sort over the whole pack, batches mix journals
+        encodings = tokenize_unpadded(texts, tokenizer, max_length=config.max_length)
+        X = embed_token_ids(encodings, model, tokenizer.pad_token_id, max_length=config.max_length,
+                            batch_size=batch_size, pooling=config.pooling)
+        rows_by_jid = records.groupby('jid').indices
+        yield {jid: X[rows_by_jid[jid]] if jid in rows_by_jid else X[:0] for jid in pack}
+
+
+def train_journals(corpus_path: str, src_dir: str, tokenizer, model, config: TrainConfig,
+                   jids: Optional[List[int]] = None, n_jobs: Optional[int] = None, pack_docs: int = PACK_DOCS,
+                   batch_size: int = 32, force: bool = False) -> Dict[str, int]:
+    """
+    Train every journal whose artifacts are missing, older than its records or built with another
+    config. Embedding runs in this process over packs of journals while the PCA, KMeans and
+    threshold fits of the previous packs run in a process pool.
+    """
+    os.makedirs(src_dir, exist_ok=True)
+    jids = list_jids(corpus_path) if jids is None else list(jids)
+    stale = [jid for jid in jids if force or not is_up_to_date(src_dir, corpus_path, jid, config)]
+    LOGGER.info(f'{len(jids) - len(stale)} of {len(jids)} journals up to date, config {config.hash}')
+    counts = {'up_to_date': len(jids) - len(stale), 'trained': 0, 'too_few_docs': 0, 'failed': 0}
+    if not stale:
+        return counts
+
+    sizes = journal_sizes(corpus_path, stale, config)
+    packs = pack_journals(sizes, pack_docs)
+    progress = Progress(len(stale), sum(sizes.values()))
+    n_jobs = n_jobs or os.cpu_count() or 1
+    worker_config = {'hash': config.hash, 'values': config.as_dict(), 'min_docs': config.min_docs}
+    # Bounds the embedded vectors waiting for a worker when the fits fall behind
+    max_pending = 4 * n_jobs
+
+    def collect(futures: dict, block_until: int):
+        while len(futures) > block_until:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                jid, n_docs = futures.pop(future)
+                try:
+                    _, _, status = future.result()
+                except Exception as e:
+                    # A failing journal (e.g. degenerate KMeans input) does not stop the others, next run retries it
+                    status = 'failed'
+                    LOGGER.exception(f'Journal {jid}: fit failed')
+                    _write_json_atomic(artifact_path(src_dir, jid, MANIFEST),
+                                       {'jid': jid, 'config_hash': config.hash, 'config': config.as_dict(),
+                                        'n_docs': n_docs, 'status': status, 'error': repr(e)})
+                counts[status] += 1
+                LOGGER.info(f'Journal {jid}: {status} on {n_docs} docs; {progress.update(n_docs)}')
+
+    # spawn: the pool workers only need numpy and sklearn, not a forked copy of the torch runtime
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {}
+        for vectors in _embedded_packs(corpus_path, packs, tokenizer, model, config, batch_size):
+            for jid, X in vectors.items():
+                collect(futures, max_pending - 1)
+                futures[pool.submit(fit_and_save, jid, X, worker_config, src_dir)] = (jid, len(X))
+        collect(futures, 0)
+    return counts
+
+
+def main():
+    from embedding.encoder import (MODEL_NAME, MAX_LENGTH, BATCH_SIZE, DEFAULT_POOLING, ENCODER_BACKENDS,
+                                   DEFAULT_BACKEND, load_encoder)
+
+    parser = argparse.ArgumentParser(description='Train the scope models of every journal in the corpus store, '
+                                                 'skipping journals whose artifacts are up to date')
+    parser.add_argument('--corpus-path', default=CORPUS_PATH)
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--jids', type=int, nargs='*', default=None, help='default every journal in the store')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--backend', choices=ENCODER_BACKENDS, default=DEFAULT_BACKEND)
+    parser.add_argument('--pooling', default=DEFAULT_POOLING)
+    parser.add_argument('--max-length', type=int, default=MAX_LENGTH)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--n-components', type=int, default=N_COMPONENTS)
+    parser.add_argument('--num-clusters', type=int, default=NUM_CLUSTERS)
+    parser.add_argument('--min-words', type=int, default=MIN_WORDS)
+    parser.add_argument('--max-words', type=int, default=MAX_WORDS)
+    parser.add_argument('--languages', nargs='*', default=list(LANGUAGES), help='empty to keep every language')
+    parser.add_argument('--storage', choices=STORAGE_FORMATS, default='float32')
+    parser.add_argument('--pack-docs', type=int, default=PACK_DOCS)
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='retrain journals that are up to date')
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    config = TrainConfig(args.model, backend=args.backend, pooling=args.pooling, max_length=args.max_length,
+                         n_components=args.n_components, num_clusters=args.num_clusters, min_words=args.min_words,
+                         max_words=args.max_words, languages=tuple(args.languages), storage=args.storage)
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    counts = train_journals(args.corpus_path, args.src_dir, tokenizer, model, config, jids=args.jids,
+                            n_jobs=args.n_jobs, pack_docs=args.pack_docs, batch_size=args.batch_size, force=args.force)
+    print(', '.join(f'{status}: {n}' for status, n in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
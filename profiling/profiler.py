@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import atexit
+import random
+import logging
+import threading
+import multiprocessing
+
+from collections import defaultdict
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+# JOURNAL_PROFILE=<dir> enables profiling for the whole run and writes report.json, trace.json
+# and stacks.folded to <dir> at exit
+PROFILE_ENV = 'JOURNAL_PROFILE'
+MAX_SAMPLES = 10_000
+MAX_TRACE_EVENTS = 1_000_000
+
+_enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class StepStats:
+    """ Counters of one instrumented step, latencies kept as a bounded reservoir sample """
+    def __init__(self):
+        self.count = 0
+        self.calls = 0
+        self.total = 0.0
+        self.samples: List[float] = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chars_removed = 0
+
+    def add(self, seconds: float, count: int = 1):
+        self.calls += 1
+        self.count += count
+        self.total += seconds
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.calls)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = seconds
+
+    def merge(self, other: 'StepStats'):
+        """ Add the counters of the same step measured elsewhere, e.g. in a pool worker """
+        self.calls += other.calls
+        self.count += other.count
+        self.total += other.total
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.chars_removed += other.chars_removed
+        self.samples.extend(other.samples)
+        if len(self.samples) > MAX_SAMPLES:
+            self.samples = random.sample(self.samples, MAX_SAMPLES)
+
+    def as_dict(self) -> dict:
+        # Only needed for the report, text_processing imports this module on the cheap clean path
+        import numpy as np
+        samples = np.array(self.samples) * 1000 if self.samples else np.zeros(1)
+        return {
+            'count': self.count,
+            'calls': self.calls,
+            'total_s': self.total,
+            'mean_ms': self.total * 1000 / self.calls if self.calls else 0.0,
+            'p50_ms': float(np.percentile(samples, 50)),
+            'p90_ms': float(np.percentile(samples, 90)),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'chars_removed': self.chars_removed,
+        }
+
+
+class Profiler:
+    """
+    Collects step statistics and a trace of nested spans per thread. Spans measure wall time;
+    work done in pool processes is not seen, only the call that waits for it, unless the worker
+    sends its collect() back and the parent merge()s it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, StepStats] = defaultdict(StepStats)
+        self.events: List[dict] = []
+        self.folded: Dict[str, float] = defaultdict(float)
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.events.clear()
+            self.folded.clear()
+            self.origin = time.perf_counter()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, name: str, start: float, seconds: float, count: int = 1, stack_path: Optional[str] = None,
+               self_seconds: Optional[float] = None, bytes_in: int = 0, bytes_out: int = 0, chars_removed: int = 0):
+        with self.lock:
+            stats = self.stats[name]
+            stats.add(seconds, count)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.chars_removed += chars_removed
+            if len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append({'name': name, 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                                    'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {'count': count}})
+            self.folded[stack_path or name] += seconds if self_seconds is None else self_seconds
+
+    def collect(self) -> dict:
+        """ Take out everything recorded so far, picklable, for merge() into the profiler of another process """
+        with self.lock:
+            # Trace timestamps made absolute: perf_counter is the same monotonic clock in every process
+            payload = {'stats': dict(self.stats), 'folded': dict(self.folded),
+                       'events': [dict(event, ts=event['ts'] + self.origin * 1e6) for event in self.events]}
+        self.reset()
+        return payload
+
+    def merge(self, payload: dict):
+        with self.lock:
+            for name, stats in payload['stats'].items():
+                self.stats[name].merge(stats)
+            for stack, seconds in payload['folded'].items():
+                self.folded[stack] += seconds
+            room = max(MAX_TRACE_EVENTS - len(self.events), 0)
+            self.events.extend(dict(event, ts=event['ts'] - self.origin * 1e6) for event in payload['events'][:room])
+
+    def report(self) -> dict:
+        with self.lock:
+            return {name: stats.as_dict() for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total)}
+
+    def export_report(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def export_trace(self, path: str):
+        """ Chrome trace event format, opens in chrome://tracing, Perfetto or speedscope """
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def export_folded(self, path: str):
+        """ Folded stacks with self time in microseconds, the input of flamegraph.pl and speedscope """
+        with self.lock:
+            lines = [f'{stack} {int(seconds * 1e6)}' for stack, seconds in self.folded.items() if seconds > 0]
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    def export(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.export_report(os.path.join(directory, 'report.json'))
+        self.export_trace(os.path.join(directory, 'trace.json'))
+        self.export_folded(os.path.join(directory, 'stacks.folded'))
+        LOGGER.info(f'Profile written to {directory}')
+
+
+PROFILER = Profiler()
+
+
+class Span:
+    """ Timed region; counters such as bytes_in can be added before it closes """
+    __slots__ = ('name', 'count', 'start', 'child_seconds', 'bytes_in', 'bytes_out', 'chars_removed')
+
+    def __init__(self, name: str, count: int = 1):
+        self.name = name
+        self.count = count
+        self.child_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chars_removed = 0
+
+    def add(self, count: Optional[int] = None, bytes_in: int = 0, bytes_out: int = 0, chars_removed: int = 0):
+        if count is not None:
+            self.count = count
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.chars_removed += chars_removed
+
+    def __enter__(self):
+        PROFILER._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        stack = PROFILER._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += seconds
+        stack_path = ';'.join([span.name for span in stack] + [self.name])
+        PROFILER.record(self.name, self.start, seconds, self.count, stack_path, seconds - self.child_seconds,
+                        self.bytes_in, self.bytes_out, self.chars_removed)
+        return False
+
+
+class _NullSpan:
+    """ Shared do-nothing span returned while profiling is disabled """
+    __slots__ = ()
+
+    def add(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, count: int = 1):
+    """ with span('model_forward', count=len(batch)): ... ; a shared no-op while disabled """
+    return Span(name, count) if _enabled else _NULL_SPAN
+
+
+def instrument(name: Optional[str] = None) -> Callable:
+    """ Time every call of the decorated function under name (default the function name) """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def text_bytes(texts) -> int:
+    return sum(len(text.encode('utf-8')) for text in texts if isinstance(text, str))
+
+
+def _export_at_exit(directory: str):
+    # Pool workers inherit the environment, only the main process writes the profile
+    if multiprocessing.parent_process() is None:
+        PROFILER.export(directory)
+
+
+if os.environ.get(PROFILE_ENV):
+    enable()
+    atexit.register(_export_at_exit, os.environ[PROFILE_ENV])
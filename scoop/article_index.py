@@ -0,0 +1,290 @@
+import os
+import re
+import glob
+import argparse
+import logging
+
+import numpy as np
+
+from typing import Iterable, List, Optional, Tuple
+
+from embedding.storage import load_vectors
+from scoop.scope_index import _read_arrays, _write_arrays
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+INDEX_FILENAME = 'article_index.bin'
+NPROBE = 8
+# Inserted vectors are scanned exhaustively until they are merged into the inverted lists
+MAX_PENDING = 50_000
+# Coarse centroids are fitted on a sample, like faiss (which warns below 39 points per list)
+TRAIN_SAMPLES_PER_LIST = 32
+TRAIN_ITERATIONS = 10
+
+Neighbor = Tuple[int, int, float]
+
+
+def default_nlist(n_vectors: int) -> int:
+    """ About 4 * sqrt(n) inverted lists, the usual IVF rule of thumb """
+    return int(np.clip(4 * np.sqrt(max(n_vectors, 1)), 1, 65_536))
+
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """ Positions of the k highest scores, best first """
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int = 10) -> np.ndarray:
+    """ (n_queries, k) positions of the most cosine-similar rows of vectors, brute force """
+    scores = normalize_rows(queries) @ normalize_rows(vectors).T
+    return np.stack([_top_k(row, k) for row in scores])
+
+
+class ArticleIndex:
+    """
+    Inverted-file (IVF) index of article embeddings under cosine similarity. Vectors are assigned
+    to the closest of nlist coarse centroids and stored grouped by list, so a query only scans the
+    nprobe lists closest to it. Every vector is identified by (jid, row), row being its position
+    in the journal's stored {jid}_bert_{pooling} matrix.
+
+    Inserts go to a pending buffer scanned exhaustively and merged into the lists by compact();
+    deletes only set a tombstone. A saved index is memory-mapped, queries read the lists they probe.
+    """
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, jids: np.ndarray, rows: np.ndarray,
+                 offsets: np.ndarray, deleted: np.ndarray):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.jids = jids
+        self.rows = rows
+        self.offsets = offsets
+        self.deleted = deleted
+        self._clear_pending()
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self):
+        """ Live vectors, inserted and not deleted """
+        return int((~np.asarray(self.deleted)).sum() + (~self.pending_deleted).sum())
+
+    def _clear_pending(self):
+        self.pending_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.pending_jids = np.zeros(0, dtype=np.int64)
+        self.pending_rows = np.zeros(0, dtype=np.int64)
+        self.pending_deleted = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, nlist: int, seed: int = 0) -> 'ArticleIndex':
+        """ Empty index with coarse centroids fitted on a sample of the vectors """
+        from sklearn.cluster import KMeans
+        sample = normalize_rows(sample)
+        nlist = min(nlist, len(sample))
+        # k-means++ seeding costs more than the iterations themselves at thousands of lists
+        kmeans = KMeans(n_clusters=nlist, init='random', n_init=1, max_iter=TRAIN_ITERATIONS,
+                        random_state=seed).fit(sample)
+        centroids = normalize_rows(kmeans.cluster_centers_)
+        dim = sample.shape[1]
+        return cls(centroids, np.zeros((0, dim), dtype=np.float32), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.int64), np.zeros(nlist + 1, dtype=np.int64), np.zeros(0, dtype=bool))
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, jids: np.ndarray, rows: np.ndarray,
+                     nlist: Optional[int] = None, seed: int = 0) -> 'ArticleIndex':
+        nlist = nlist or default_nlist(len(vectors))
+        rng = np.random.RandomState(seed)
+        sample_size = min(len(vectors), nlist * TRAIN_SAMPLES_PER_LIST)
+        index = cls.train(vectors[rng.choice(len(vectors), sample_size, replace=False)], nlist, seed)
+        index.add(vectors, jids, rows)
+        index.compact()
+        return index
+
+    @classmethod
+    def build(cls, src_dir: str = 'src', pooling: str = 'mean', jids: Optional[List[int]] = None,
+              nlist: Optional[int] = None) -> 'ArticleIndex':
+        """ Index the pooled {jid}_bert_{pooling}.npy/.npz vectors of every journal in src_dir (or the given jids) """
+        paths = {}
+        for path in glob.glob(os.path.join(src_dir, f'*_bert_{pooling}.np[yz]')):
+            jid = int(re.match(r'(-?\d+)_bert_', os.path.basename(path)).group(1))
+            if jids is None or jid in jids:
+                paths[jid] = path
+        if not paths:
+            raise FileNotFoundError(f'No {pooling} pooled vectors in {src_dir}')
+        matrices = {jid: load_vectors(path) for jid, path in sorted(paths.items())}
+        vectors = np.concatenate(list(matrices.values()))
+        journal_ids = np.concatenate([np.full(len(X), jid, dtype=np.int64) for jid, X in matrices.items()])
+        rows = np.concatenate([np.arange(len(X), dtype=np.int64) for X in matrices.values()])
+        LOGGER.info(f'Indexing {len(vectors)} vectors of {len(matrices)} journals from {src_dir}')
+        return cls.from_vectors(vectors, journal_ids, rows, nlist)
+
+    def assign(self, X: np.ndarray) -> np.ndarray:
+        """ Inverted list of every (normalized) vector """
+        return np.argmax(X @ self.centroids.T, axis=1)
+
+    def add(self, vectors: np.ndarray, jids: Iterable[int], rows: Iterable[int]):
+        """ Insert vectors, searchable at once; (jid, row) pairs are expected to be new """
+        X = normalize_rows(vectors)
+        jids = np.asarray(list(jids), dtype=np.int64)
+        rows = np.asarray(list(rows), dtype=np.int64)
+        if X.shape[1] != self.dim or not (len(X) == len(jids) == len(rows)):
+            raise ValueError(f'Expected {len(X)} vectors of size {self.dim} with as many jids and rows')
+        self.pending_vectors = np.concatenate([self.pending_vectors, X])
+        self.pending_jids = np.concatenate([self.pending_jids, jids])
+        self.pending_rows = np.concatenate([self.pending_rows, rows])
+        self.pending_deleted = np.concatenate([self.pending_deleted, np.zeros(len(X), dtype=bool)])
+        if len(self.pending_vectors) >= MAX_PENDING:
+            self.compact()
+
+    def delete(self, jid: int, rows: Optional[Iterable[int]] = None) -> int:
+        """ Tombstone the given rows of a journal, or the whole journal; returns how many were live """
+        if not self.deleted.flags.writeable:
+            # A loaded index is memory-mapped read-only, tombstones live in memory until the next save
+            self.deleted = np.array(self.deleted)
+        rows = np.asarray(list(rows), dtype=np.int64) if rows is not None else None
+        n_deleted = 0
+        for deleted, index_jids, index_rows in ((self.deleted, self.jids, self.rows),
+                                                (self.pending_deleted, self.pending_jids, self.pending_rows)):
+            match = np.asarray(index_jids) == jid
+            if rows is not None:
+                match &= np.isin(index_rows, rows)
+            n_deleted += int((match & ~deleted).sum())
+            deleted |= match
+        return n_deleted
+
+    def compact(self):
+        """ Merge pending vectors into the inverted lists and drop deleted ones """
+        X, jids, rows = self.pending_vectors, self.pending_jids, self.pending_rows
+        live = ~np.asarray(self.deleted)
+        keep = ~self.pending_deleted
+        vectors = np.concatenate([np.asarray(self.vectors)[live], X[keep]])
+        all_jids = np.concatenate([np.asarray(self.jids)[live], jids[keep]])
+        all_rows = np.concatenate([np.asarray(self.rows)[live], rows[keep]])
+        existing_lists = np.repeat(np.arange(self.nlist), np.diff(np.asarray(self.offsets)))[live]
+        lists = np.concatenate([existing_lists, self.assign(X[keep]) if keep.any() else np.zeros(0, np.int64)])
+
+        order = np.argsort(lists, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.jids = all_jids[order]
+        self.rows = all_rows[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))]).astype(np.int64)
+        self.deleted = np.zeros(len(order), dtype=bool)
+        self._clear_pending()
+
+    def _filter(self, jids: np.ndarray, include: Optional[np.ndarray], exclude: Optional[np.ndarray]) -> np.ndarray:
+        mask = np.ones(len(jids), dtype=bool)
+        if include is not None:
+            mask &= np.isin(jids, include)
+        if exclude is not None:
+            mask &= ~np.isin(jids, exclude)
+        return mask
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = NPROBE, jids: Optional[Iterable[int]] = None,
+               exclude_jids: Optional[Iterable[int]] = None) -> List[List[Neighbor]]:
+        """
+        The k most similar articles of every query as (jid, row, cosine similarity), best first.
+        jids restricts the results to those journals, exclude_jids leaves journals out (e.g. the
+        submission's own journal when looking for cross-journal overlap). Filters apply inside the
+        probed lists, a small journal may need a larger nprobe to fill k results.
+        """
+        Q = normalize_rows(queries)
+        include = np.asarray(list(jids), dtype=np.int64) if jids is not None else None
+        exclude = np.asarray(list(exclude_jids), dtype=np.int64) if exclude_jids is not None else None
+        probes = np.argsort(-(Q @ self.centroids.T), axis=1)[:, :min(nprobe, self.nlist)]
+        offsets = np.asarray(self.offsets)
+        pending_live = ~self.pending_deleted & self._filter(self.pending_jids, include, exclude)
+        pending_X = self.pending_vectors[pending_live]
+        pending_jids, pending_rows = self.pending_jids[pending_live], self.pending_rows[pending_live]
+
+        results = []
+        for q, lists in zip(Q, probes):
+            candidates = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in lists])
+            candidate_jids = np.asarray(self.jids[candidates])
+            live = ~np.asarray(self.deleted[candidates]) & self._filter(candidate_jids, include, exclude)
+            candidates = candidates[live]
+            scores = np.asarray(self.vectors[candidates]) @ q
+            found_jids, found_rows = candidate_jids[live], np.asarray(self.rows[candidates])
+            if len(pending_X):
+                scores = np.concatenate([scores, pending_X @ q])
+                found_jids = np.concatenate([found_jids, pending_jids])
+                found_rows = np.concatenate([found_rows, pending_rows])
+            best = _top_k(scores, k)
+            results.append([(int(found_jids[i]), int(found_rows[i]), float(scores[i])) for i in best])
+        return results
+
+    def overlaps(self, jid: int, k: int = 5, min_similarity: float = 0.9,
+                 nprobe: int = NPROBE) -> List[Tuple[int, Neighbor]]:
+        """ (row, neighbor) for articles of jid with a close article in another journal """
+        members = np.flatnonzero((np.asarray(self.jids) == jid) & ~np.asarray(self.deleted))
+        pending_members = np.flatnonzero((self.pending_jids == jid) & ~self.pending_deleted)
+        queries = np.concatenate([np.asarray(self.vectors[members]), self.pending_vectors[pending_members]])
+        query_rows = np.concatenate([np.asarray(self.rows[members]), self.pending_rows[pending_members]])
+        pairs = []
+        for row, neighbors in zip(query_rows, self.search(queries, k, nprobe, exclude_jids=[jid])):
+            pairs.extend((int(row), neighbor) for neighbor in neighbors if neighbor[2] >= min_similarity)
+        return pairs
+
+    def save(self, path: str):
+        """ Compact and write the index in one memory-mappable file """
+        self.compact()
+        _write_arrays(path, {
+            'centroids': np.asarray(self.centroids, dtype=np.float32),
+            'vectors': np.asarray(self.vectors, dtype=np.float32),
+            'jids': np.asarray(self.jids),
+            'rows': np.asarray(self.rows),
+            'offsets': np.asarray(self.offsets),
+            'deleted': np.asarray(self.deleted),
+        }, meta={'n_vectors': len(self.vectors), 'nlist': self.nlist, 'metric': 'cosine'})
+
+    @classmethod
+    def load(cls, path: str) -> 'ArticleIndex':
+        """ Memory-map a saved index, lists are read from disk as queries probe them """
+        arrays, _ = _read_arrays(path)
+        return cls(**arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the article similarity index from the stored journal '
+                                                 'vectors, or list cross-journal overlaps of a journal')
+    parser.add_argument('command', choices=['build', 'overlaps'])
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--index', default=None, help=f'default {{src-dir}}/{INDEX_FILENAME}')
+    parser.add_argument('--pooling', default='mean')
+    parser.add_argument('--jids', type=int, nargs='*', default=None, help='build: default every journal')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--jid', type=int, default=None, help='overlaps: the journal to check')
+    parser.add_argument('--min-similarity', type=float, default=0.9)
+    parser.add_argument('--nprobe', type=int, default=NPROBE)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    path = args.index or os.path.join(args.src_dir, INDEX_FILENAME)
+    if args.command == 'build':
+        index = ArticleIndex.build(args.src_dir, args.pooling, args.jids, args.nlist)
+        index.save(path)
+        print(f'{len(index)} articles in {index.nlist} lists written to {path}')
+    else:
+        index = ArticleIndex.load(path)
+        for row, (other_jid, other_row, similarity) in index.overlaps(args.jid, min_similarity=args.min_similarity,
+                                                                       nprobe=args.nprobe):
+            print(f'{args.jid}:{row}\t{other_jid}:{other_row}\t{similarity:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import os
+import argparse
+import logging
+
+import joblib
+import numpy as np
+
+from typing import Iterable, List, Optional
+from sklearn.cluster import KMeans
+from sklearn.decomposition import IncrementalPCA
+from scipy.optimize import linear_sum_assignment
+
+from profiling import profiler
+from scoop.journal_model import (N_COMPONENTS, NUM_CLUSTERS, JournalModel, Projection, artifact_path,
+                                 centroid_distances, fit_journal_model)
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+BATCH_SIZE = 1024
+TOLERANCE = 0.05
+
+
+def closest_centroid(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """ Index of the closest centroid of every row of X """
+    return ((X[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+
+
+class RunningStats:
+    """ Count, mean and M2 of a stream (Welford), merged batch by batch """
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        count = self.count + len(values)
+        delta = batch_mean - self.mean
+        self.mean += delta * len(values) / count
+        self.m2 += batch_m2 + delta ** 2 * self.count * len(values) / count
+        self.count = count
+
+    @property
+    def std(self) -> float:
+        """ Population std, as np.std in scoop_threshold """
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+
+
+class IncrementalJournalModel:
+    """
+    Journal scope model that absorbs new articles without a full refit: the projection is an
+    IncrementalPCA, centroids are running means of their assigned embeddings (online k-means,
+    kept in embedding space so they stay valid when the projection moves) and the
+    mean + 2 std threshold comes from running statistics of the distances seen at update time.
+    """
+    def __init__(self, jid: int, ipca: IncrementalPCA, kmeans: KMeans, centroids: np.ndarray,
+                 counts: np.ndarray, stats: RunningStats, record_ids: Optional[set] = None,
+                 pending: Optional[np.ndarray] = None):
+        self.jid = jid
+        self.ipca = ipca
+        self.kmeans = kmeans
+        self.centroids = centroids
+        self.counts = counts
+        self.stats = stats
+        self.record_ids = record_ids if record_ids is not None else set()
+        self.pending = pending
+
+    @classmethod
+    def fit(cls, jid: int, X: np.ndarray, record_ids: Optional[Iterable[str]] = None,
+            n_components: int = N_COMPONENTS, num_clusters: int = NUM_CLUSTERS,
+            batch_size: int = BATCH_SIZE) -> 'IncrementalJournalModel':
+        """ Initial fit on a journal's document vectors, read in batches """
+        ipca = IncrementalPCA(n_components=n_components)
+        starts = list(range(0, len(X), batch_size))
+        for i, start in enumerate(starts):
+            # The last batch may be smaller than n_components, fold it into the one before
+            if i + 2 == len(starts) and len(X) - starts[-1] < n_components:
+                ipca.partial_fit(X[start:])
+                break
+            ipca.partial_fit(X[start:start + batch_size])
+
+        X_proj = Projection.from_pca(ipca).transform(X)
+        kmeans = KMeans(n_clusters=num_clusters, random_state=42).fit(X_proj)
+        counts = np.bincount(kmeans.labels_, minlength=num_clusters)
+        centroids = np.zeros((num_clusters, X.shape[1]), dtype=np.float64)
+        np.add.at(centroids, kmeans.labels_, np.asarray(X, dtype=np.float64))
+        centroids /= np.maximum(counts, 1)[:, None]
+
+        model = cls(jid, ipca, kmeans, centroids, counts, RunningStats(),
+                    set(record_ids) if record_ids is not None else None)
+        model.stats.update(centroid_distances(X_proj, model.projected_centroids()))
+        return model
+
+    @property
+    def projection(self) -> Projection:
+        return Projection.from_pca(self.ipca)
+
+    @property
+    def threshold(self) -> float:
+        return self.stats.mean + 2 * self.stats.std
+
+    def projected_centroids(self, projection: Optional[Projection] = None) -> np.ndarray:
+        return (projection or self.projection).transform(self.centroids)
+
+    def new_records(self, record_ids: List[str]) -> List[int]:
+        """ Positions of the records not absorbed yet """
+        return [i for i, record_id in enumerate(record_ids) if record_id not in self.record_ids]
+
+    def partial_fit(self, X: np.ndarray, record_ids: Optional[List[str]] = None) -> int:
+        """ Absorb new document vectors, returns how many were absorbed (short batches wait in pending) """
+        X = np.asarray(X, dtype=np.float32)
+        if record_ids is not None:
+            keep = self.new_records(record_ids)
+            X = X[keep]
+            self.record_ids.update(record_ids[i] for i in keep)
+        if self.pending is not None:
+            X = np.concatenate([self.pending, X], axis=0)
+            self.pending = None
+        if len(X) < self.ipca.n_components:
+            # IncrementalPCA needs at least n_components rows per batch
+            self.pending = X if len(X) else None
+            return 0
+
+        with profiler.span('ipca_partial_fit', count=len(X)):
+            self.ipca.partial_fit(X)
+        projection = self.projection
+        X_proj = projection.transform(X)
+        with profiler.span('online_kmeans', count=len(X)):
+            labels = closest_centroid(X_proj, self.projected_centroids(projection))
+            for cluster in np.unique(labels):
+                members = X[labels == cluster]
+                self.counts[cluster] += len(members)
+                self.centroids[cluster] += (members.sum(axis=0) - len(members) * self.centroids[cluster]) / self.counts[cluster]
+
+        self.stats.update(centroid_distances(X_proj, self.projected_centroids(projection)))
+        return len(X)
+
+    def journal_model(self) -> JournalModel:
+        """ Current state as the JournalModel used for scoring """
+        projection = self.projection
+        self.kmeans.cluster_centers_ = self.projected_centroids(projection).astype(self.kmeans.cluster_centers_.dtype)
+        return JournalModel(self.jid, self.kmeans, self.threshold, projection)
+
+    def save(self, src_dir: str = 'src', pooling: Optional[str] = None, max_length: Optional[int] = None):
+        """
+        Write the scoring artifacts ({jid}_kmeans.pkl, threshold, projection with the pooling and
+        max_length of the embeddings) and the incremental state
+        """
+        os.makedirs(src_dir, exist_ok=True)
+        journal_model = self.journal_model()
+        joblib.dump(self.kmeans, artifact_path(src_dir, self.jid, 'kmeans.pkl'))
+        np.save(artifact_path(src_dir, self.jid, 'threshold.npy'), journal_model.threshold)
+        projection = journal_model.projection
+        projection.pooling, projection.max_length = pooling, max_length
+        projection.save(artifact_path(src_dir, self.jid, 'projection.npz'))
+        joblib.dump(self, artifact_path(src_dir, self.jid, 'incremental.pkl'))
+        LOGGER.info(f'Journal {self.jid} incremental model saved to {src_dir} '
+                    f'({self.stats.count} documents, threshold {self.threshold:.4f})')
+
+    @classmethod
+    def load(cls, jid: int, src_dir: str = 'src') -> 'IncrementalJournalModel':
+        return joblib.load(artifact_path(src_dir, jid, 'incremental.pkl'))
+
+
+def check_against_refit(model: IncrementalJournalModel, X: np.ndarray, tolerance: float = TOLERANCE) -> dict:
+    """
+    Compare an incrementally updated model with a full refit on all of the journal's vectors X.
+    Distances are compared in embedding space so the sign and order of PCA components do not matter.
+    """
+    pca, kmeans, threshold, _ = fit_journal_model(X, n_components=model.ipca.n_components,
+                                                  num_clusters=len(model.centroids))
+    refit = JournalModel(model.jid, kmeans, threshold, Projection.from_pca(pca))
+    incremental = model.journal_model()
+
+    refit_centroids = kmeans.cluster_centers_ @ pca.components_ + pca.mean_
+    incremental_centroids = model.centroids
+    cost = np.sqrt(((refit_centroids[:, None] - incremental_centroids[None]) ** 2).sum(axis=-1))
+    rows, cols = linear_sum_assignment(cost)
+
+    report = {
+        'threshold_incremental': incremental.threshold,
+        'threshold_refit': refit.threshold,
+        'threshold_rel_diff': abs(incremental.threshold - refit.threshold) / refit.threshold,
+        # Centroid shift relative to the journal's own scale
+        'centroid_shift': float(cost[rows, cols].max() / refit.threshold),
+        'label_agreement': float((incremental.in_scoop(X) == refit.in_scoop(X)).mean()),
+    }
+    report['within_tolerance'] = bool(report['threshold_rel_diff'] <= tolerance
+                                      and report['label_agreement'] >= 1 - tolerance)
+    if not report['within_tolerance']:
+        LOGGER.warning(f'Journal {model.jid} drifted from a full refit: {report}, consider retraining')
+    return report
+
+
+def _journal_records(corpus_path: str, jid: int):
+    from corpus.store import read_corpus
+    from text_handling.text_processing import preprocess_articles
+
+    df = read_corpus(corpus_path, columns=['record_id', 'title', 'abstract'], jids=[jid])
+    _, texts = preprocess_articles(df['title'], df['abstract'])
+    return df['record_id'].tolist(), texts
+
+
+def main():
+    from embedding.encoder import (MODEL_NAME, MAX_LENGTH, DEFAULT_POOLING, ENCODER_BACKENDS, DEFAULT_BACKEND, load_encoder,
+                                   embed_texts)
+
+    parser = argparse.ArgumentParser(description='Fit or update journal scope models incrementally from the corpus store')
+    parser.add_argument('command', choices=['init', 'update', 'check'])
+    parser.add_argument('jids', type=int, nargs='+')
+    parser.add_argument('--corpus-path', default='corpus_store')
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--model', default=None)
+    parser.add_argument('--pooling', default=None)
+    parser.add_argument('--backend', choices=ENCODER_BACKENDS, default=DEFAULT_BACKEND)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    tokenizer, model = load_encoder(args.model or MODEL_NAME, backend=args.backend)
+    pooling = args.pooling or DEFAULT_POOLING
+
+    for jid in args.jids:
+        record_ids, texts = _journal_records(args.corpus_path, jid)
+        if args.command == 'init':
+            X = embed_texts(texts, tokenizer, model, pooling=pooling)
+            IncrementalJournalModel.fit(jid, X, record_ids).save(args.src_dir, pooling, MAX_LENGTH)
+        elif args.command == 'update':
+            journal = IncrementalJournalModel.load(jid, args.src_dir)
+            new = journal.new_records(record_ids)
+            if not new:
+                LOGGER.info(f'Journal {jid}: no new records')
+                continue
+            X = embed_texts([texts[i] for i in new], tokenizer, model, pooling=pooling)
+            absorbed = journal.partial_fit(X, [record_ids[i] for i in new])
+            LOGGER.info(f'Journal {jid}: {absorbed} new records absorbed')
+            journal.save(args.src_dir, pooling, MAX_LENGTH)
+        else:
+            journal = IncrementalJournalModel.load(jid, args.src_dir)
+            X = embed_texts(texts, tokenizer, model, pooling=pooling)
+            print(jid, check_against_refit(journal, X, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
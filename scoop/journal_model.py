@@ -0,0 +1,180 @@
+import os
+import logging
+
+import joblib
+import numpy as np
+
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from profiling import profiler
+
+if TYPE_CHECKING:
+    # sklearn is imported where a model is fitted, scoring with a saved projection does not need it
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+N_COMPONENTS = 2
+NUM_CLUSTERS = 1
+
+
+class Projection:
+    """
+    Fitted PCA reduced to its arrays, applied to new data as a single matrix multiply. Keeps the
+    pooling and max_length of the embeddings it was fitted on, when known, so scoring embeds alike.
+    """
+    def __init__(self, components: np.ndarray, mean: np.ndarray, explained_variance: np.ndarray,
+                 whiten: bool = False, pooling: Optional[str] = None, max_length: Optional[int] = None):
+        self.components = np.asarray(components, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.explained_variance = np.asarray(explained_variance, dtype=np.float32)
+        self.whiten = whiten
+        self.pooling = pooling
+        self.max_length = max_length
+        # (X - mean) @ W == X @ W - mean @ W, with W the (optionally whitened) transposed components
+        weights = self.components.T
+        if whiten:
+            weights = weights / np.sqrt(self.explained_variance)
+        self.weights = np.ascontiguousarray(weights)
+        self.bias = self.mean @ self.weights
+
+    @classmethod
+    def from_pca(cls, pca: 'PCA', pooling: Optional[str] = None, max_length: Optional[int] = None) -> 'Projection':
+        return cls(pca.components_, pca.mean_, pca.explained_variance_, pca.whiten, pooling, max_length)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[1]
+
+    @profiler.instrument('projection')
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """ Project rows of X, same result as PCA.transform """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.dim:
+            trained_with = f', {self.pooling} pooling' if self.pooling else ''
+            raise ValueError(f'Embeddings of dimension {X.shape[1]} do not match the projection, fitted on '
+                             f'{self.dim}-d embeddings{trained_with}: embed with the pooling and max_length '
+                             f'the journal was trained with')
+        return X @ self.weights - self.bias
+
+    def save(self, path: str):
+        settings = {}
+        if self.pooling is not None:
+            settings['pooling'] = self.pooling
+        if self.max_length is not None:
+            settings['max_length'] = self.max_length
+        with open(path, 'wb') as file:
+            np.savez(file, components=self.components, mean=self.mean,
+                     explained_variance=self.explained_variance, whiten=self.whiten, **settings)
+
+    @classmethod
+    def load(cls, path: str) -> 'Projection':
+        with np.load(path) as data:
+            pooling = str(data['pooling']) if 'pooling' in data.files else None
+            max_length = int(data['max_length']) if 'max_length' in data.files else None
+            return cls(data['components'], data['mean'], data['explained_variance'], bool(data['whiten']),
+                       pooling, max_length)
+
+
+def artifact_path(src_dir: str, jid: int, name: str) -> str:
+    """ Path of a journal artifact, e.g. src/{jid}_kmeans.pkl """
+    return os.path.join(src_dir, f'{jid}_{name}')
+
+
+@profiler.instrument()
+def centroid_distances(X: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """ Euclidean distance of every row of X to its closest centroid """
+    distances = np.sqrt(((X[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=-1))
+    return distances.min(axis=1)
+
+
+def scoop_threshold(distances: np.ndarray) -> float:
+    """ Data further than mean + 2 std from the centroid is "outscoop" """
+    return float(np.mean(distances) + 2 * np.std(distances))
+
+
+def fit_journal_model(X: np.ndarray, n_components: int = N_COMPONENTS,
+                      num_clusters: int = NUM_CLUSTERS) -> Tuple['PCA', 'KMeans', float, np.ndarray]:
+    """ Fit PCA, KMeans and the outscoop threshold on a journal's document vectors """
+    from sklearn.cluster import KMeans
+    from sklearn.decomposition import PCA
+
+    pca = PCA(n_components=n_components, random_state=0)
+    with profiler.span('pca_fit', count=len(X)):
+        X_pca = pca.fit_transform(X)
+
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42)
+    with profiler.span('kmeans_fit', count=len(X_pca)):
+        kmeans.fit(X_pca)
+
+    threshold = scoop_threshold(centroid_distances(X_pca, kmeans.cluster_centers_))
+    return pca, kmeans, threshold, X_pca
+
+
+def save_journal_model(jid: int, pca: 'PCA', kmeans: 'KMeans', threshold: float, X_pca: np.ndarray,
+                       X_bert: Optional[np.ndarray] = None, src_dir: str = 'src', pooling: Optional[str] = None,
+                       max_length: Optional[int] = None):
+    """
+    Save the journal artifacts, including the fitted projection next to the kmeans model with the
+    pooling and max_length of the embeddings
+    """
+    os.makedirs(src_dir, exist_ok=True)
+    joblib.dump(kmeans, artifact_path(src_dir, jid, 'kmeans.pkl'))
+    np.save(artifact_path(src_dir, jid, 'threshold.npy'), threshold)
+    np.save(artifact_path(src_dir, jid, 'pca_data.npy'), X_pca)
+    Projection.from_pca(pca, pooling, max_length).save(artifact_path(src_dir, jid, 'projection.npz'))
+    if X_bert is not None:
+        np.save(artifact_path(src_dir, jid, 'bert_data.npy'), X_bert)
+    LOGGER.info(f'Journal {jid} model saved to {src_dir}')
+
+
+class JournalModel:
+    """ Everything needed to score articles against one journal, loaded once """
+    def __init__(self, jid: int, kmeans: 'KMeans', threshold: float, projection: Projection):
+        self.jid = jid
+        self.kmeans = kmeans
+        self.centroids = np.asarray(kmeans.cluster_centers_, dtype=np.float32)
+        self.threshold = float(threshold)
+        self.projection = projection
+
+    @classmethod
+    def load(cls, jid: int, src_dir: str = 'src') -> 'JournalModel':
+        """
+        Load a journal's artifacts. Models trained before the projection was persisted get it
+        fitted once from {jid}_bert_data.npy and saved, instead of on every prediction.
+        """
+        kmeans = joblib.load(artifact_path(src_dir, jid, 'kmeans.pkl'))
+        threshold = np.load(artifact_path(src_dir, jid, 'threshold.npy'))
+        projection_path = artifact_path(src_dir, jid, 'projection.npz')
+        if not os.path.exists(projection_path):
+            from sklearn.decomposition import PCA
+            LOGGER.info(f'Journal {jid} has no saved projection, fitting it from the stored BERT data')
+            X_pca = np.load(artifact_path(src_dir, jid, 'pca_data.npy'), mmap_mode='r')
+            X_bert = np.load(artifact_path(src_dir, jid, 'bert_data.npy'))
+            pca = PCA(n_components=X_pca.shape[1], random_state=0).fit(X_bert)
+            Projection.from_pca(pca).save(projection_path)
+        return cls(jid, kmeans, threshold, Projection.load(projection_path))
+
+    def embedding_settings(self, hidden_size: int) -> Tuple[Optional[str], Optional[int]]:
+        """
+        (pooling, max_length) the journal was trained with, as saved with its projection. Older
+        artifacts fitted on vectors a multiple of hidden_size wide are the notebooks' flattened
+        hidden states; (None, None) when nothing tells.
+        """
+        if self.projection.pooling is not None:
+            return self.projection.pooling, self.projection.max_length
+        dim = self.projection.dim
+        if dim != hidden_size and dim % hidden_size == 0:
+            return 'flatten', dim // hidden_size
+        return None, self.projection.max_length
+
+    def distance(self, embeddings: np.ndarray) -> np.ndarray:
+        """ Distance of document embeddings to the closest journal centroid in the projected space """
+        return centroid_distances(self.projection.transform(embeddings), self.centroids)
+
+    def in_scoop(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.distance(embeddings) <= self.threshold
@@ -0,0 +1,62 @@
+import logging
+
+import numpy as np
+
+from typing import List, Optional, Tuple
+
+from profiling import profiler
+from embedding.encoder import MAX_LENGTH, DEFAULT_POOLING, embed_texts
+from scoop.journal_model import JournalModel, centroid_distances
+from text_handling.text_processing import preprocess_articles
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+@profiler.instrument()
+def scoop_labels(embeddings: np.ndarray, journal_model: JournalModel) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """ Label embeddings "in scoop"/"out scoop" for a journal, also returns their projection and centroid distance """
+    new_data_pca = journal_model.projection.transform(embeddings)
+
+    # Calculate distance to centroid
+    distance_to_centroid = centroid_distances(new_data_pca, journal_model.centroids)
+
+    # Determine if new data is in scoop or outscoop
+    labels = ["in scoop" if distance <= journal_model.threshold else "out scoop" for distance in distance_to_centroid]
+    return labels, new_data_pca, distance_to_centroid
+
+
+def embedding_settings(journal_model: JournalModel, model, max_length: Optional[int] = None,
+                       pooling: Optional[str] = None) -> Tuple[int, str]:
+    """ max_length and pooling to embed with: the given ones, else the journal's own, else the defaults """
+    trained_pooling, trained_max_length = journal_model.embedding_settings(model.config.hidden_size)
+    return (max_length or trained_max_length or MAX_LENGTH), (pooling or trained_pooling or DEFAULT_POOLING)
+
+
+@profiler.instrument()
+def predict_scoop_batch(articles: List[Tuple[str, str]], tokenizer, model, journal_model: JournalModel,
+                        max_length: Optional[int] = None, pooling: Optional[str] = None,
+                        device: str = 'cpu') -> List[Tuple[str, np.ndarray]]:
+    """ predict_scoop for many (title, abstract) pairs with one embedding pass """
+    max_length, pooling = embedding_settings(journal_model, model, max_length, pooling)
+    # Preprocess title and abstract the way the journal models were trained
+    _, processed_texts = preprocess_articles([title for title, _ in articles], [abstract for _, abstract in articles],
+                                             n_jobs=1)
+
+    new_embeddings = embed_texts(processed_texts, tokenizer, model, max_length=max_length,
+                                 pooling=pooling, device=device)
+    labels, new_data_pca, distances = scoop_labels(new_embeddings, journal_model)
+    LOGGER.info(f'Journal {journal_model.jid}: distances {distances}, threshold {journal_model.threshold}')
+    return [(label, new_data_pca[i:i + 1]) for i, label in enumerate(labels)]
+
+
+@profiler.instrument()
+def predict_scoop(title: str, abstract: str, tokenizer, model, journal_model: JournalModel,
+                  max_length: Optional[int] = None, pooling: Optional[str] = None,
+                  device: str = 'cpu') -> Tuple[str, np.ndarray]:
+    """
+    Predict whether a new article is in the scoop of a journal, returns the label and its projected vector.
+    max_length and pooling default to the ones saved with the journal model (flatten for the notebooks' models).
+    """
+    return predict_scoop_batch([(title, abstract)], tokenizer, model, journal_model,
+                               max_length=max_length, pooling=pooling, device=device)[0]
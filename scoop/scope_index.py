@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import glob
+import argparse
+import logging
+
+import numpy as np
+
+from typing import List, Optional, Tuple
+
+from scoop.journal_model import JournalModel
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MAGIC = b'SCOPEIDX'
+ALIGNMENT = 64
+INDEX_FILENAME = 'scope_index.bin'
+# Floor of the thresholds divided by: a journal whose training documents all sit on their centroids has
+# threshold 0, a distance of 0 is then in scope (as in scoop_labels) and any other one far out of it
+MIN_THRESHOLD = 1e-6
+
+
+def _write_arrays(path: str, arrays: dict, meta: dict):
+    """ Write arrays into one file: magic, header length, JSON header, then aligned raw arrays """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'arrays': layout, 'meta': meta}).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_arrays(path: str) -> Tuple[dict, dict]:
+    """ Memory-map the arrays written by _write_arrays """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a scope index')
+        header_length = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(header_length))
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        shape = tuple(spec['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            continue
+        arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r', offset=data_start + spec['offset'], shape=shape)
+    return arrays, header['meta']
+
+
+class ScopeIndex:
+    """
+    Every journal's projection, centroids and threshold packed into contiguous arrays, so an
+    embedding is scored against all journals with one matrix multiply.
+    Journals with fewer components or clusters than the widest one are zero padded; padded
+    components add nothing to the distance and padded centroids are masked out.
+    """
+    def __init__(self, jids: np.ndarray, weights: np.ndarray, bias: np.ndarray, centroids: np.ndarray,
+                 centroid_mask: np.ndarray, thresholds: np.ndarray):
+        self.jids = jids
+        self.weights = weights
+        self.bias = bias
+        self.centroids = centroids
+        self.centroid_mask = centroid_mask
+        self.thresholds = thresholds
+
+    def __len__(self):
+        return len(self.jids)
+
+    @classmethod
+    def from_journal_models(cls, journal_models: List[JournalModel]) -> 'ScopeIndex':
+        dims = {model.projection.weights.shape[0] for model in journal_models}
+        if len(dims) > 1:
+            raise ValueError(f'Journal models were trained on vectors of different sizes {sorted(dims)}')
+        dim = dims.pop() if dims else 0
+        n_journals = len(journal_models)
+        max_components = max((model.projection.weights.shape[1] for model in journal_models), default=0)
+        max_clusters = max((len(model.centroids) for model in journal_models), default=0)
+
+        weights = np.zeros((dim, n_journals, max_components), dtype=np.float32)
+        bias = np.zeros((n_journals, max_components), dtype=np.float32)
+        centroids = np.zeros((n_journals, max_clusters, max_components), dtype=np.float32)
+        centroid_mask = np.zeros((n_journals, max_clusters), dtype=bool)
+        for j, model in enumerate(journal_models):
+            n_components = model.projection.weights.shape[1]
+            weights[:, j, :n_components] = model.projection.weights
+            bias[j, :n_components] = model.projection.bias
+            centroids[j, :len(model.centroids), :n_components] = model.centroids
+            centroid_mask[j, :len(model.centroids)] = True
+            if model.threshold <= 0:
+                LOGGER.warning(f'Journal {model.jid} has threshold {model.threshold}, only its centroids are in scope')
+
+        return cls(np.array([model.jid for model in journal_models], dtype=np.int64),
+                   weights.reshape(dim, -1), bias.reshape(-1), centroids, centroid_mask,
+                   np.array([model.threshold for model in journal_models], dtype=np.float32))
+
+    @classmethod
+    def build(cls, src_dir: str = 'src', jids: Optional[List[int]] = None) -> 'ScopeIndex':
+        """ Load every journal model found in src_dir (or the given jids) and pack them """
+        if jids is None:
+            jids = sorted(int(re.match(r'(\d+)_kmeans\.pkl$', os.path.basename(path)).group(1))
+                          for path in glob.glob(os.path.join(src_dir, '*_kmeans.pkl')))
+        journal_models = [JournalModel.load(jid, src_dir) for jid in jids]
+        LOGGER.info(f'Packed {len(journal_models)} journal models from {src_dir}')
+        return cls.from_journal_models(journal_models)
+
+    def save(self, path: str):
+        _write_arrays(path, {
+            'jids': self.jids,
+            'weights': self.weights,
+            'bias': self.bias,
+            'centroids': self.centroids,
+            'centroid_mask': self.centroid_mask,
+            'thresholds': self.thresholds,
+        }, meta={'n_journals': len(self.jids)})
+
+    @classmethod
+    def load(cls, path: str) -> 'ScopeIndex':
+        """ Memory-map a saved index, nothing is read until it is queried """
+        arrays, _ = _read_arrays(path)
+        return cls(**arrays)
+
+    def normalized_distances(self, embeddings: np.ndarray) -> np.ndarray:
+        """ (n_embeddings, n_journals) distance to each journal's closest centroid divided by its threshold """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        n_journals, max_clusters, max_components = self.centroids.shape
+        projected = (embeddings @ self.weights - self.bias).reshape(len(embeddings), n_journals, 1, max_components)
+        distances = np.sqrt(((projected - self.centroids[None]) ** 2).sum(axis=-1))
+        distances = np.where(self.centroid_mask[None], distances, np.inf).min(axis=-1)
+        return distances / np.maximum(self.thresholds, MIN_THRESHOLD)
+
+    def query(self, embeddings: np.ndarray, top_k: Optional[int] = None,
+              in_scope_only: bool = True) -> List[List[Tuple[int, float]]]:
+        """ For each embedding, (jid, normalized distance) ranked from the closest journal; in scope means <= 1 """
+        normalized = self.normalized_distances(embeddings)
+        results = []
+        for row in normalized:
+            order = np.argsort(row, kind='stable')
+            if in_scope_only:
+                order = order[row[order] <= 1.0]
+            if top_k is not None:
+                order = order[:top_k]
+            results.append([(int(self.jids[j]), float(row[j])) for j in order])
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack every journal model in src into one scope index file')
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--output', default=None, help=f'default {{src-dir}}/{INDEX_FILENAME}')
+    parser.add_argument('--jids', type=int, nargs='*', default=None)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    index = ScopeIndex.build(args.src_dir, args.jids)
+    output = args.output or os.path.join(args.src_dir, INDEX_FILENAME)
+    index.save(output)
+    print(f'{len(index)} journals packed into {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import json
+import time
+import queue
+import argparse
+import logging
+import threading
+
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from embedding.encoder import (MODEL_NAME, MAX_LENGTH, DEFAULT_POOLING, ENCODER_BACKENDS, DEFAULT_BACKEND, load_encoder,
+                               embed_texts)
+from scoop.journal_model import JournalModel
+from scoop.predict import embedding_settings, scoop_labels
+from text_handling.text_processing import preprocess_articles
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MAX_BATCH_SIZE = 32
+MAX_WAIT_MS = 10
+LATENCY_WINDOW = 10_000
+
+
+class ServerStats:
+    """ Request counters and a sliding window of latencies """
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=window)
+
+    def record_batch(self):
+        with self.lock:
+            self.batches += 1
+
+    def record(self, latency: float, error: bool = False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.perf_counter() - self.started
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'throughput_rps': self.requests / uptime if uptime else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+                'uptime_s': uptime,
+            }
+
+
+class _Request:
+    def __init__(self, title: str, abstract: str, jid: int):
+        self.title = title
+        self.abstract = abstract
+        self.jid = jid
+        self.received = time.perf_counter()
+        self.future = Future()
+
+
+class ScoopScorer:
+    """
+    Keeps the encoder and journal models loaded and scores requests in micro-batches: a worker
+    thread waits up to max_wait_ms after the first queued request to collect up to
+    max_batch_size of them, then embeds them all in one forward pass. max_length and pooling
+    default to the ones saved with the journal models, which must then agree.
+    """
+    def __init__(self, tokenizer, model, journal_models: Dict[int, JournalModel],
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 max_length: Optional[int] = None, pooling: Optional[str] = None, device: str = 'cpu'):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.journal_models = journal_models
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        settings = {embedding_settings(journal_model, model, max_length, pooling)
+                    for journal_model in journal_models.values()}
+        if len(settings) > 1:
+            raise ValueError(f'The journals were trained with different (max_length, pooling) {sorted(settings)}, '
+                             f'serve them separately')
+        self.max_length, self.pooling = settings.pop() if settings else (max_length or MAX_LENGTH,
+                                                                         pooling or DEFAULT_POOLING)
+        self.device = device
+        self.stats = ServerStats()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, title: str, abstract: str, jid: int) -> Future:
+        """ Queue an article, the future resolves to the scoring result dict """
+        request = _Request(title, abstract, jid)
+        if jid not in self.journal_models:
+            request.future.set_exception(KeyError(f'Journal {jid} is not loaded'))
+            self.stats.record(0.0, error=True)
+        else:
+            self._queue.put(request)
+        return request.future
+
+    def score(self, title: str, abstract: str, jid: int) -> dict:
+        return self.submit(title, abstract, jid).result()
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._score_batch(batch)
+            except Exception as e:
+                LOGGER.exception('Scoring batch failed')
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                        self.stats.record(time.perf_counter() - request.received, error=True)
+
+    def _score_batch(self, batch: List[_Request]):
+        _, texts = preprocess_articles([request.title for request in batch], [request.abstract for request in batch],
+                                       n_jobs=1)
+        embeddings = embed_texts(texts, self.tokenizer, self.model, max_length=self.max_length,
+                                 pooling=self.pooling, device=self.device)
+        self.stats.record_batch()
+
+        for jid in {request.jid for request in batch}:
+            rows = [i for i, request in enumerate(batch) if request.jid == jid]
+            journal_model = self.journal_models[jid]
+            # A journal whose model fails (e.g. trained on another embedding size) only fails its own requests
+            try:
+                labels, _, distances = scoop_labels(embeddings[rows], journal_model)
+            except Exception as e:
+                LOGGER.exception(f'Scoring journal {jid} failed')
+                for row in rows:
+                    batch[row].future.set_exception(e)
+                    self.stats.record(time.perf_counter() - batch[row].received, error=True)
+                continue
+            for row, label, distance in zip(rows, labels, distances):
+                request = batch[row]
+                request.future.set_result({
+                    'jid': jid,
+                    'prediction': label,
+                    'distance': float(distance),
+                    'threshold': journal_model.threshold,
+                })
+                self.stats.record(time.perf_counter() - request.received)
+
+
+def _make_handler(scorer: ScoopScorer, default_jid: Optional[int]):
+    class ScoopHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, scorer.stats.snapshot())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if not isinstance(body, dict):
+                    raise ValueError('body must be a JSON object')
+                title, abstract = body.get('title', ''), body.get('abstract', '')
+                if not isinstance(title, str) or not isinstance(abstract, str):
+                    raise TypeError('title and abstract must be strings')
+                jid = int(body.get('jid', default_jid))
+            except (TypeError, ValueError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            try:
+                result = scorer.score(title, abstract, jid)
+            except KeyError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            LOGGER.debug(format, *args)
+
+    return ScoopHandler
+
+
+class _ScoopHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Concurrent clients would otherwise overflow the default listen backlog of 5
+    request_queue_size = 128
+
+
+def make_server(scorer: ScoopScorer, host: str = '127.0.0.1', port: int = 8000,
+                default_jid: Optional[int] = None) -> ThreadingHTTPServer:
+    """ HTTP server: POST /score {title, abstract, jid} and GET /stats """
+    return _ScoopHTTPServer((host, port), _make_handler(scorer, default_jid))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scoop scoring server with a warm model and micro-batching')
+    parser.add_argument('jids', type=int, nargs='+', help='journals to load, the first one is the default')
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--pooling', default=None, help='default the pooling saved with the journal models')
+    parser.add_argument('--backend', choices=ENCODER_BACKENDS, default=DEFAULT_BACKEND)
+    parser.add_argument('--max-length', type=int, default=None, help='default the one saved with the journal models')
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    tokenizer, model = load_encoder(args.model, backend=args.backend)
+    journal_models = {jid: JournalModel.load(jid, args.src_dir) for jid in args.jids}
+    scorer = ScoopScorer(tokenizer, model, journal_models, max_batch_size=args.max_batch_size,
+                         max_wait_ms=args.max_wait_ms, max_length=args.max_length, pooling=args.pooling)
+    server = make_server(scorer, args.host, args.port, default_jid=args.jids[0])
+    LOGGER.info(f'Serving {len(journal_models)} journals on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
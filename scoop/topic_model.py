@@ -0,0 +1,442 @@
+import os
+import glob
+import uuid
+import argparse
+import logging
+
+import joblib
+import numpy as np
+
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from embedding.storage import load_vectors, vectors_path
+from profiling import profiler
+from scoop.article_index import normalize_rows
+from scoop.journal_model import Projection, artifact_path
+
+if TYPE_CHECKING:
+    import scipy.sparse
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MODEL_FILENAME = 'topic_model.pkl'
+# Per-journal artifacts: topic of every document and the journal's share of the topic x term counts
+TOPICS = 'topics.npy'
+TOPIC_COUNTS = 'topic_counts.npz'
+N_TOPICS = 100
+N_COMPONENTS = 50
+REDUCERS = ('randomized', 'incremental')
+# Rows the randomized PCA is fitted on, a uniform reservoir sample of the whole corpus
+PROJECTION_SAMPLE = 100_000
+# Rows per IncrementalPCA partial_fit and per read of the stored vectors, bounds the memory of a pass
+CHUNK_DOCS = 20_000
+# Rows per MiniBatchKMeans step, the first chunk initializes the centroids (k-means++) in one call
+KMEANS_BATCH = 2048
+EPOCHS = 2
+MAX_FEATURES = 50_000
+MIN_DF = 5
+VOCABULARY_SAMPLE = 100_000
+TOP_N_WORDS = 10
+
+
+def rechunk(batches: Iterable[np.ndarray], chunk_docs: int = CHUNK_DOCS) -> Iterator[np.ndarray]:
+    """ Regroup row batches of any size (one per journal) into float32 chunks of chunk_docs rows, the last one shorter """
+    pending, n_pending = [], 0
+    for batch in batches:
+        start = 0
+        while start < len(batch):
+            take = min(chunk_docs - n_pending, len(batch) - start)
+            pending.append(np.asarray(batch[start:start + take], dtype=np.float32))
+            n_pending += take
+            start += take
+            if n_pending == chunk_docs:
+                yield np.concatenate(pending)
+                pending, n_pending = [], 0
+    if n_pending:
+        yield np.concatenate(pending)
+
+
+def reservoir_sample(batches: Iterable[np.ndarray], size: int, seed: int = 0) -> np.ndarray:
+    """ Uniform sample of size rows (all of them when fewer) from a stream of row batches, in one pass """
+    rng = np.random.RandomState(seed)
+    reservoir, seen = None, 0
+    for batch in batches:
+        batch = np.asarray(batch, dtype=np.float32)
+        if reservoir is None:
+            reservoir = np.empty((size, batch.shape[1]), dtype=np.float32)
+        fill = min(size - min(seen, size), len(batch))
+        reservoir[seen:seen + fill] = batch[:fill]
+        # Algorithm R, vectorized over the rest of the batch: row i replaces a random slot with probability size / (i + 1)
+        positions = np.arange(seen + fill, seen + len(batch))
+        slots = (rng.random_sample(len(positions)) * (positions + 1)).astype(np.int64)
+        replace = slots < size
+        reservoir[slots[replace]] = batch[fill:][replace]
+        seen += len(batch)
+    if reservoir is None:
+        raise ValueError('No vectors to sample')
+    return reservoir[:min(seen, size)]
+
+
+class TopicModel:
+    """
+    Corpus-wide topics of pooled document embeddings. Embeddings are L2 normalized and reduced
+    by a randomized PCA fitted on a reservoir sample, or by an IncrementalPCA over every chunk,
+    normalized again and clustered by MiniBatchKMeans, so a fit streams over the corpus in
+    chunks and never holds it. Topics are described by class-based TF-IDF (c-TF-IDF) over the
+    cleaned texts, from a sparse topic x term count matrix. New documents are assigned to the
+    closest topic and added to the counts; with learn=True they also move the centroids.
+    """
+    def __init__(self, n_topics: int = N_TOPICS, n_components: int = N_COMPONENTS, reducer: str = 'randomized',
+                 max_features: int = MAX_FEATURES, min_df: int = MIN_DF, stop_words: Optional[Iterable[str]] = None,
+                 seed: int = 0):
+        if reducer not in REDUCERS:
+            raise ValueError(f'Unknown reducer {reducer!r}, expected one of {REDUCERS}')
+        self.n_topics = n_topics
+        self.n_components = n_components
+        self.reducer = reducer
+        self.max_features = max_features
+        self.min_df = min_df
+        self.stop_words = sorted(stop_words) if stop_words is not None else None
+        self.seed = seed
+        self.projection: Optional[Projection] = None
+        self.kmeans = None
+        self.vectorizer = None
+        self.topic_term_counts: Optional['scipy.sparse.csr_matrix'] = None
+        self.topic_sizes = np.zeros(n_topics, dtype=np.int64)
+        # Journals whose documents are in the counts, a journal counted again is removed first
+        self.counted_jids = set()
+        # jid -> token of per-journal files written next to the artifacts, moved into place once the model is saved
+        self.staged: Dict[int, str] = {}
+
+    @property
+    def centroids(self) -> np.ndarray:
+        return self.kmeans.cluster_centers_
+
+    def reduce(self, X: np.ndarray) -> np.ndarray:
+        """ Normalized projection of normalized embeddings, the space the topics live in """
+        return normalize_rows(self.projection.transform(normalize_rows(X)))
+
+    @profiler.instrument('topic_projection_fit')
+    def fit_projection(self, batches: Iterable[np.ndarray], sample_size: int = PROJECTION_SAMPLE):
+        if self.reducer == 'randomized':
+            from sklearn.decomposition import PCA
+            sample = normalize_rows(reservoir_sample(batches, sample_size, self.seed))
+            pca = PCA(n_components=min(self.n_components, *sample.shape), svd_solver='randomized',
+                      random_state=self.seed).fit(sample)
+        else:
+            from sklearn.decomposition import IncrementalPCA
+            pca = IncrementalPCA(n_components=self.n_components)
+            for chunk in rechunk(batches):
+                # IncrementalPCA needs at least n_components rows per call, only a short last chunk can miss
+                if len(chunk) >= self.n_components:
+                    pca.partial_fit(normalize_rows(chunk))
+        self.projection = Projection.from_pca(pca)
+        return self
+
+    @profiler.instrument('topic_kmeans_epoch')
+    def fit_clusters(self, batches: Iterable[np.ndarray]):
+        """ One MiniBatchKMeans epoch over the batches, call again for more epochs """
+        if self.kmeans is None:
+            from sklearn.cluster import MiniBatchKMeans
+            self.kmeans = MiniBatchKMeans(n_clusters=self.n_topics, random_state=self.seed, n_init=1)
+        for chunk in rechunk(batches):
+            self._kmeans_steps(self.reduce(chunk))
+        return self
+
+    def _kmeans_steps(self, X: np.ndarray):
+        if not hasattr(self.kmeans, 'cluster_centers_'):
+            if len(X) < self.n_topics:
+                raise ValueError(f'{len(X)} documents are too few for {self.n_topics} topics')
+            self.kmeans.partial_fit(X)
+            return
+        for start in range(0, len(X), KMEANS_BATCH):
+            self.kmeans.partial_fit(X[start:start + KMEANS_BATCH])
+
+    @profiler.instrument('topic_vocabulary_fit')
+    def fit_vocabulary(self, texts: Iterable[str]):
+        """ Term vocabulary of the c-TF-IDF from a sample of cleaned texts """
+        from sklearn.feature_extraction.text import CountVectorizer
+        texts = list(texts)
+        self.vectorizer = CountVectorizer(max_features=self.max_features, min_df=min(self.min_df, len(texts)),
+                                          stop_words=self.stop_words, dtype=np.int64)
+        self.vectorizer.fit(texts)
+        self.topic_term_counts = None
+        self.topic_sizes = np.zeros(self.n_topics, dtype=np.int64)
+        self.counted_jids = set()
+        return self
+
+    def fit(self, vector_batches: Callable[[], Iterable[np.ndarray]], vocabulary_texts: Iterable[str],
+            epochs: int = EPOCHS, sample_size: int = PROJECTION_SAMPLE) -> 'TopicModel':
+        """
+        Fit the projection, epochs passes of clustering, each over a fresh vector_batches(), and the
+        vocabulary. Topic counts start empty, feed the documents with update().
+        """
+        self.fit_projection(vector_batches(), sample_size)
+        for epoch in range(epochs):
+            self.fit_clusters(vector_batches())
+            LOGGER.info(f'Topic clustering epoch {epoch + 1}/{epochs} done')
+        return self.fit_vocabulary(vocabulary_texts)
+
+    def assign(self, X: np.ndarray) -> np.ndarray:
+        """ Closest topic of every document embedding """
+        return np.argmax(self.reduce(X) @ self.centroids.T, axis=1)
+
+    @profiler.instrument('topic_update')
+    def update(self, X: np.ndarray, texts: List[str], learn: bool = False, return_counts: bool = False):
+        """
+        Assign documents to topics and add their term counts; learn also moves the centroids toward them.
+        Returns the topics, with return_counts also the topic x term counts added, for remove()
+        """
+        import scipy.sparse as sp
+        if len(X) != len(texts):
+            raise ValueError(f'{len(X)} vectors for {len(texts)} texts')
+        if learn and len(X):
+            self._kmeans_steps(self.reduce(X))
+        labels = self.assign(X) if len(X) else np.zeros(0, dtype=np.int64)
+        counts = self.vectorizer.transform(texts)
+        membership = sp.csr_matrix((np.ones(len(labels), dtype=np.int64), (labels, np.arange(len(labels)))),
+                                   shape=(self.n_topics, len(labels)))
+        topic_counts = (membership @ counts).tocsr()
+        self.topic_term_counts = (topic_counts if self.topic_term_counts is None
+                                  else (self.topic_term_counts + topic_counts).tocsr())
+        self.topic_sizes += np.bincount(labels, minlength=self.n_topics)
+        return (labels, topic_counts) if return_counts else labels
+
+    def remove(self, labels: np.ndarray, topic_counts: 'scipy.sparse.csr_matrix'):
+        """ Take documents added by update() out of the counts again, from their topics and the counts it returned """
+        self.topic_term_counts = (self.topic_term_counts - topic_counts).tocsr()
+        self.topic_term_counts.eliminate_zeros()
+        self.topic_sizes -= np.bincount(labels, minlength=self.n_topics)
+
+    def ctfidf(self) -> 'scipy.sparse.csr_matrix':
+        """ c-TF-IDF of every topic and term: L1 normalized topic term frequency * log(1 + A / f_t) """
+        import scipy.sparse as sp
+        from sklearn.preprocessing import normalize
+        counts = self.topic_term_counts.astype(np.float64)
+        term_frequency = np.asarray(counts.sum(axis=0)).ravel()
+        # A, the average number of words per topic
+        average_words = counts.sum() / max(int((self.topic_sizes > 0).sum()), 1)
+        idf = np.log1p(average_words / np.maximum(term_frequency, 1))
+        return (normalize(counts, norm='l1') @ sp.diags(idf)).tocsr()
+
+    def topic_words(self, top_n: int = TOP_N_WORDS) -> List[List[Tuple[str, float]]]:
+        """ The top_n (term, c-TF-IDF) of every topic, best first """
+        if self.topic_term_counts is None:
+            return [[] for _ in range(self.n_topics)]
+        scores = self.ctfidf()
+        terms = self.vectorizer.get_feature_names_out()
+        words = []
+        for topic in range(self.n_topics):
+            row = scores.getrow(topic)
+            best = np.argsort(-row.data, kind='stable')[:top_n]
+            words.append([(str(terms[row.indices[i]]), float(row.data[i])) for i in best])
+        return words
+
+    def save(self, path: str):
+        tmp_path = path + '.tmp'
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TopicModel':
+        return joblib.load(path)
+
+
+def trained_journal_vectors(src_dir: str, jids: Optional[List[int]] = None) -> Dict[int, Tuple[str, dict]]:
+    """ jid -> (stored vectors path, training config) of every trained journal in src_dir (or of the given jids) """
+    from pipeline.scheduler import MANIFEST, read_manifest
+    if jids is None:
+        suffix = f'_{MANIFEST}'
+        jids = sorted(int(name[:-len(suffix)]) for name in os.listdir(src_dir)
+                      if name.endswith(suffix) and name[:-len(suffix)].lstrip('-').isdigit())
+    journals = {}
+    for jid in jids:
+        manifest = read_manifest(src_dir, jid)
+        if manifest is None or manifest.get('status') != 'trained':
+            continue
+        config = manifest['config']
+        path = vectors_path(src_dir, jid, config['pooling'], config['storage'])
+        if os.path.exists(path):
+            journals[jid] = (path, config)
+    return journals
+
+
+def _journal_batches(journals: Dict[int, Tuple[str, dict]]) -> Iterator[np.ndarray]:
+    for path, _ in journals.values():
+        yield load_vectors(path, mmap_mode='r')
+
+
+def vocabulary_sample(corpus_path: str, jids: List[int], sample_size: int = VOCABULARY_SAMPLE,
+                      seed: int = 0) -> List[str]:
+    """ Cleaned texts of about sample_size random records of the journals, streamed from the store """
+    import pyarrow.dataset as ds
+    from corpus.store import corpus_dataset, iter_corpus_batches
+    jid_filter = ds.field('jid').isin(jids)
+    total = corpus_dataset(corpus_path).count_rows(filter=jid_filter)
+    rate = min(1.0, sample_size / max(total, 1))
+    rng = np.random.RandomState(seed)
+    texts = []
+    for batch in iter_corpus_batches(corpus_path, columns=['cleaned_text'], filter=jid_filter):
+        column = batch.column(0).to_pylist()
+        keep = np.flatnonzero(rng.random_sample(len(column)) < rate)
+        texts.extend(column[i] or '' for i in keep)
+    return texts
+
+
+def _staged_paths(src_dir: str, jid: int, token: str) -> Dict[str, str]:
+    """ Staged -> final path of a journal's per-journal topic files """
+    return {artifact_path(src_dir, jid, f'{name}.{token}'): artifact_path(src_dir, jid, name)
+            for name in (TOPICS, TOPIC_COUNTS)}
+
+
+def _apply_staged(model: TopicModel, src_dir: str):
+    """
+    Move the per-journal files staged for the saved model into place, and drop the ones of a run
+    interrupted before its model was saved: the files in place always match the saved counts
+    """
+    for jid, token in getattr(model, 'staged', {}).items():
+        for staged_path, path in _staged_paths(src_dir, jid, token).items():
+            if os.path.exists(staged_path):
+                os.replace(staged_path, path)
+    model.staged = {}
+    for name in (TOPICS, TOPIC_COUNTS):
+        for stale_path in glob.glob(os.path.join(glob.escape(src_dir), f'*_{name}.*')):
+            os.remove(stale_path)
+
+
+def _save_with_journals(model: TopicModel, model_path: str, src_dir: str):
+    model.save(model_path)
+    _apply_staged(model, src_dir)
+
+
+def _forget_journal(model: TopicModel, src_dir: str, jid: int):
+    """ Remove the documents a journal had in the counts, from its {jid}_topics.npy and {jid}_topic_counts.npz """
+    import scipy.sparse as sp
+    if jid not in model.counted_jids:
+        return
+    model.remove(np.load(artifact_path(src_dir, jid, TOPICS)), sp.load_npz(artifact_path(src_dir, jid, TOPIC_COUNTS)))
+    model.counted_jids.discard(jid)
+
+
+def _count_journal(model: TopicModel, corpus_path: str, src_dir: str, jid: int, path: str, config: dict,
+                   learn: bool, token: str) -> int:
+    """
+    Topics of a journal's stored vectors, staged for {jid}_topics.npy, with its texts added to the
+    counts. A journal counted before (retrained since) is removed from the counts first, its share
+    of the counts is kept in {jid}_topic_counts.npz for that. The staged files replace the journal's
+    ones only after the model is saved, see _save_with_journals.
+    """
+    import scipy.sparse as sp
+    from pipeline.scheduler import TrainConfig, select_records
+    from text_handling.check_lang import LanguageDetector
+    config = TrainConfig(**{key: value for key, value in config.items() if key != 'version'})
+    # A detector per journal, its memo of every text seen would otherwise grow with the corpus
+    records = select_records(corpus_path, [jid], config, LanguageDetector(n_jobs=1))
+    X = load_vectors(path, mmap_mode='r')
+    if len(records) != len(X):
+        LOGGER.warning(f'Journal {jid}: {len(records)} records for {len(X)} stored vectors, retrain it first')
+        return 0
+    _forget_journal(model, src_dir, jid)
+    labels = [np.zeros(0, dtype=np.int64)]
+    journal_counts = sp.csr_matrix((model.n_topics, len(model.vectorizer.vocabulary_)), dtype=np.int64)
+    for start in range(0, len(X), CHUNK_DOCS):
+        chunk_labels, chunk_counts = model.update(X[start:start + CHUNK_DOCS],
+                                                  records['cleaned_text'].iloc[start:start + CHUNK_DOCS].tolist(),
+                                                  learn, return_counts=True)
+        labels.append(chunk_labels)
+        journal_counts = journal_counts + chunk_counts
+    labels = np.concatenate(labels)
+    model.counted_jids.add(jid)
+    staged_topics, staged_counts = _staged_paths(src_dir, jid, token)
+    # File objects, np.save and save_npz would add their extension to the staged names
+    with open(staged_counts, 'wb') as file:
+        sp.save_npz(file, journal_counts.tocsr())
+    with open(staged_topics, 'wb') as file:
+        np.save(file, labels.astype(np.int32))
+    model.staged[jid] = token
+    return len(labels)
+
+
+def fit_corpus_topics(corpus_path: str, src_dir: str = 'src', jids: Optional[List[int]] = None,
+                      n_topics: int = N_TOPICS, n_components: int = N_COMPONENTS, reducer: str = 'randomized',
+                      epochs: int = EPOCHS, max_features: int = MAX_FEATURES,
+                      stop_words: Optional[Iterable[str]] = None) -> TopicModel:
+    """
+    Fit the topics of every trained journal's stored vectors, one chunk in memory at a time, then
+    write the topic of every document ({jid}_topics.npy) and the model ({src_dir}/topic_model.pkl)
+    """
+    journals = trained_journal_vectors(src_dir, jids)
+    if not journals:
+        raise FileNotFoundError(f'No trained journal vectors in {src_dir}')
+    LOGGER.info(f'Fitting {n_topics} topics on {len(journals)} journals')
+    model = TopicModel(n_topics, n_components, reducer, max_features, stop_words=stop_words)
+    model.fit(lambda: _journal_batches(journals), vocabulary_sample(corpus_path, list(journals)), epochs)
+    token = uuid.uuid4().hex
+    n_docs = sum(_count_journal(model, corpus_path, src_dir, jid, path, config, learn=False, token=token)
+                 for jid, (path, config) in journals.items())
+    _save_with_journals(model, os.path.join(src_dir, MODEL_FILENAME), src_dir)
+    LOGGER.info(f'{n_docs} documents in {n_topics} topics, model saved to {src_dir}')
+    return model
+
+
+def update_corpus_topics(corpus_path: str, src_dir: str = 'src', jids: Optional[List[int]] = None) -> int:
+    """
+    Assign the journals trained since the topics were fitted (no {jid}_topics.npy or an older one)
+    to the saved topics, learning from them, and save the model; returns the number of documents.
+    A retrained journal's documents from its previous assignment are taken out of the counts first.
+    """
+    from pipeline.scheduler import MANIFEST
+    model_path = os.path.join(src_dir, MODEL_FILENAME)
+    model = TopicModel.load(model_path)
+    # Finish or drop the file moves of an interrupted run before its files are read
+    _apply_staged(model, src_dir)
+    token = uuid.uuid4().hex
+    n_docs = 0
+    for jid, (path, config) in trained_journal_vectors(src_dir, jids).items():
+        topics_path = artifact_path(src_dir, jid, TOPICS)
+        if os.path.exists(topics_path) and \
+                os.path.getmtime(topics_path) >= os.path.getmtime(artifact_path(src_dir, jid, MANIFEST)):
+            continue
+        n_docs += _count_journal(model, corpus_path, src_dir, jid, path, config, learn=True, token=token)
+    _save_with_journals(model, model_path, src_dir)
+    return n_docs
+
+
+def main():
+    from corpus.store import CORPUS_PATH
+
+    parser = argparse.ArgumentParser(description='Corpus-wide topics of the stored journal vectors with '
+                                                 'c-TF-IDF keywords: fit them, fold in new journals or show them')
+    parser.add_argument('command', choices=['fit', 'update', 'show'])
+    parser.add_argument('--corpus-path', default=CORPUS_PATH)
+    parser.add_argument('--src-dir', default='src')
+    parser.add_argument('--jids', type=int, nargs='*', default=None, help='default every trained journal')
+    parser.add_argument('--n-topics', type=int, default=N_TOPICS)
+    parser.add_argument('--n-components', type=int, default=N_COMPONENTS)
+    parser.add_argument('--reducer', choices=REDUCERS, default='randomized')
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--max-features', type=int, default=MAX_FEATURES)
+    parser.add_argument('--remove-stopwords', action='store_true', help='leave Sastrawi stopwords out of keywords')
+    parser.add_argument('--top-n', type=int, default=TOP_N_WORDS)
+    args = parser.parse_args()
+    logging.basicConfig()
+
+    if args.command == 'fit':
+        stop_words = None
+        if args.remove_stopwords:
+            from text_handling.stemming import load_sastrawi_stopwords
+            stop_words = load_sastrawi_stopwords()
+        model = fit_corpus_topics(args.corpus_path, args.src_dir, args.jids, args.n_topics, args.n_components,
+                                  args.reducer, args.epochs, args.max_features, stop_words)
+    elif args.command == 'update':
+        print(f'{update_corpus_topics(args.corpus_path, args.src_dir, args.jids)} documents assigned')
+        model = TopicModel.load(os.path.join(args.src_dir, MODEL_FILENAME))
+    else:
+        model = TopicModel.load(os.path.join(args.src_dir, MODEL_FILENAME))
+    for topic, words in enumerate(model.topic_words(args.top_n)):
+        print(f'{topic}\t{model.topic_sizes[topic]}\t{" ".join(word for word, _ in words)}')
+
+
+if __name__ == '__main__':
+    main()
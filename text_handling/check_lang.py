@@ -1,16 +1,36 @@
-import pandas as pd
+import os
 import logging
 import re
-import pycld2 as cld2
+import hashlib
 
 # from transformers import pipeline
-from functools import wraps
-from langdetect import detect #981kb
-from deep_translator import GoogleTranslator
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial, wraps
+from typing import Callable, List, Optional, Tuple
+
+from profiling import profiler
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+LANG_LABELS = ['Arabic', 'Basque', 'Breton', 'Catalan', 'Chinese_China', 'Chinese_Hongkong', 'Chinese_Taiwan', 'Chuvash', 'Czech', 'Dhivehi', 'Dutch', 'English', 'Esperanto', 'Estonian', 'French', 'Frisian', 'Georgian', 'German', 'Greek', 'Hakha_Chin', 'Indonesian', 'Interlingua', 'Italian', 'Japanese', 'Kabyle', 'Kinyarwanda', 'Kyrgyz', 'Latvian', 'Maltese', 'Mongolian', 'Persian', 'Polish', 'Portuguese', 'Romanian', 'Romansh_Sursilvan', 'Russian', 'Sakha', 'Slovenian', 'Spanish', 'Swedish', 'Tamil', 'Tatar', 'Turkish', 'Ukranian', 'Welsh']
+LANG_LABEL_CODES = {
+    'Arabic': 'ar', 'Basque': 'eu', 'Breton': 'br', 'Catalan': 'ca', 'Chinese_China': 'zh',
+    'Chinese_Hongkong': 'zh', 'Chinese_Taiwan': 'zh', 'Chuvash': 'cv', 'Czech': 'cs', 'Dhivehi': 'dv',
+    'Dutch': 'nl', 'English': 'en', 'Esperanto': 'eo', 'Estonian': 'et', 'French': 'fr', 'Frisian': 'fy',
+    'Georgian': 'ka', 'German': 'de', 'Greek': 'el', 'Hakha_Chin': 'cnh', 'Indonesian': 'id',
+    'Interlingua': 'ia', 'Italian': 'it', 'Japanese': 'ja', 'Kabyle': 'kab', 'Kinyarwanda': 'rw',
+    'Kyrgyz': 'ky', 'Latvian': 'lv', 'Maltese': 'mt', 'Mongolian': 'mn', 'Persian': 'fa', 'Polish': 'pl',
+    'Portuguese': 'pt', 'Romanian': 'ro', 'Romansh_Sursilvan': 'rm', 'Russian': 'ru', 'Sakha': 'sah',
+    'Slovenian': 'sl', 'Spanish': 'es', 'Swedish': 'sv', 'Tamil': 'ta', 'Tatar': 'tt', 'Turkish': 'tr',
+    'Ukranian': 'uk', 'Welsh': 'cy',
+}
+BERT_LANG_MODEL = 'jb2k/bert-base-multilingual-cased-language-detection'
+CLD2_MIN_PERCENT = 90
+LANGDETECT_MIN_PROB = 0.9
+LANG_CACHE_SIZE = 500_000
+
 def _return_empty_string_for_invalid_input(func):
     """ Return empty string if the input is None or empty """
     @wraps(func)
@@ -32,41 +52,207 @@ def _return_empty_string_for_invalid_input(func):
 # pipe = pipeline("text-classification", model="jb2k/bert-base-multilingual-cased-language-detection")
 pipe = lambda x : x
 
+@profiler.instrument()
 @_return_empty_string_for_invalid_input
 def lang_checker_bert(text):
-    label = ['Arabic', 'Basque', 'Breton', 'Catalan', 'Chinese_China', 'Chinese_Hongkong', 'Chinese_Taiwan', 'Chuvash', 'Czech', 'Dhivehi', 'Dutch', 'English', 'Esperanto', 'Estonian', 'French', 'Frisian', 'Georgian', 'German', 'Greek', 'Hakha_Chin', 'Indonesian', 'Interlingua', 'Italian', 'Japanese', 'Kabyle', 'Kinyarwanda', 'Kyrgyz', 'Latvian', 'Maltese', 'Mongolian', 'Persian', 'Polish', 'Portuguese', 'Romanian', 'Romansh_Sursilvan', 'Russian', 'Sakha', 'Slovenian', 'Spanish', 'Swedish', 'Tamil', 'Tatar', 'Turkish', 'Ukranian', 'Welsh']
     lang = pipe(text, truncation=True)
-    output = label[int(lang['label'].split('_')[-1])]
+    output = LANG_LABELS[int(lang['label'].split('_')[-1])]
     return output
 
+@profiler.instrument()
 @_return_empty_string_for_invalid_input
 def lang_checker_langdetect(text):
+    from langdetect import detect
     try:
         detected_language = detect(text)
     except Exception as e:
         print("An error occurred:", e, 'text : ', text[:15] )
         return None
-    # end = time.time()
-    # time_exec = end - start
     return detected_language
 
+@profiler.instrument()
 @_return_empty_string_for_invalid_input
 def lang_checker_pycld2(text):
+    import pycld2 as cld2
     try:
         detected_language = cld2.detect(text)
     except Exception as e:
         print("An error occurred:", e)
         return None
-    # end = time.time()
-    # time_exec = end - start
     return detected_language
 
+@lru_cache(maxsize=None)
+def _google_translator(target_lang):
+    from deep_translator import GoogleTranslator
+    return GoogleTranslator(source='auto', target=target_lang)
+
+@profiler.instrument()
 @_return_empty_string_for_invalid_input
 def en_to_id(text, target_lang='id'):
-    translate_text = GoogleTranslator(source='auto', target='id').translate(text)
+    """ Single text translation, use text_handling.translation.Translator for many texts """
+    translate_text = _google_translator(target_lang).translate(text)
     return translate_text 
 
 
 @_return_empty_string_for_invalid_input
 def multi_lang_abs_checker(text):
     return re.search('([^a-zA-Z0-9_])+(Abstract|Abstrak)([^a-zA-Z0-9_])*', text) != None
+
+
+def normalize_lang_code(code: Optional[str]) -> Optional[str]:
+    """ 'zh-cn', 'zh-Hant' -> 'zh', so codes of the three detectors compare equal """
+    return code.split('-')[0].lower() if code else code
+
+
+def bert_label_code(label: str) -> str:
+    """ Language code of a classifier label, either 'LABEL_11' or the label name itself """
+    if label not in LANG_LABEL_CODES:
+        label = LANG_LABELS[int(label.split('_')[-1])]
+    return LANG_LABEL_CODES[label]
+
+
+def _cld2_stage(texts: List[str], min_percent: int = CLD2_MIN_PERCENT) -> List[Tuple[Optional[str], bool]]:
+    """ (language, confident) from pycld2; mixed-language, unreliable or low percent texts are not confident """
+    import pycld2 as cld2
+    results = []
+    for text in texts:
+        try:
+            is_reliable, _, details, vectors = cld2.detect(text, returnVectors=True)
+        except Exception:
+            results.append((None, False))
+            continue
+        code = details[0][1]
+        if code == 'un':
+            results.append((None, False))
+            continue
+        mixed = len({vector[3] for vector in vectors}) > 1
+        results.append((normalize_lang_code(code), is_reliable and details[0][2] >= min_percent and not mixed))
+    return results
+
+
+def _langdetect_stage(texts: List[str], min_prob: float = LANGDETECT_MIN_PROB) -> List[Tuple[Optional[str], bool]]:
+    """ (language, confident) from langdetect's top probability """
+    from langdetect import detect_langs, DetectorFactory
+    # Same text, same answer: langdetect is randomized unless seeded
+    DetectorFactory.seed = 0
+    results = []
+    for text in texts:
+        try:
+            best = detect_langs(text)[0]
+        except Exception:
+            results.append((None, False))
+            continue
+        results.append((normalize_lang_code(best.lang), best.prob >= min_prob))
+    return results
+
+
+def _map_chunks(func: Callable, texts: List[str], n_jobs: int, chunk_size: int) -> list:
+    """ Apply func to chunks of texts across a process pool, results in input order """
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if n_jobs <= 1 or len(chunks) <= 1:
+        return func(texts)
+    results = []
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+        for chunk_results in executor.map(func, chunks):
+            results.extend(chunk_results)
+    return results
+
+
+def load_bert_pipeline(model: str = BERT_LANG_MODEL, device: int = -1):
+    """ The BERT language classifier, only imported and loaded when the cascade needs it """
+    from transformers import pipeline
+    return pipeline('text-classification', model=model, device=device)
+
+
+class LanguageDetector:
+    """
+    Batch language detection as a cascade: pycld2 on everything, langdetect only on the texts
+    pycld2 is unsure about (unreliable, low percent or mixed-language), and the BERT classifier
+    in padded batches only on what is still ambiguous. Without a BERT pipeline the best guess
+    of the cheaper stages is kept. Results are memoized by text hash, the least recently used
+    dropped first past cache_size; cache_size=0 turns the memo off.
+    """
+    def __init__(self, bert_pipe=None, batch_size: int = 32, n_jobs: Optional[int] = None,
+                 chunk_size: int = 2000, cld2_min_percent: int = CLD2_MIN_PERCENT,
+                 langdetect_min_prob: float = LANGDETECT_MIN_PROB, cache_size: int = LANG_CACHE_SIZE):
+        self.bert_pipe = bert_pipe
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs if n_jobs is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.cld2_min_percent = cld2_min_percent
+        self.langdetect_min_prob = langdetect_min_prob
+        if cache_size < 0:
+            raise ValueError(f'cache_size must be 0 or more, got {cache_size}')
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.stage_counts = Counter()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @profiler.instrument('bert_language')
+    def _bert_stage(self, texts: List[str]) -> List[str]:
+        # Length-sorted so each padded batch holds texts of similar length
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        predictions = self.bert_pipe([texts[i] for i in order], batch_size=self.batch_size, truncation=True)
+        codes = [None] * len(texts)
+        for i, prediction in zip(order, predictions):
+            codes[i] = bert_label_code(prediction['label'])
+        return codes
+
+    def _detect_new(self, texts: List[str]) -> List[str]:
+        with profiler.span('pycld2', count=len(texts)):
+            cld2_results = _map_chunks(partial(_cld2_stage, min_percent=self.cld2_min_percent), texts,
+                                       self.n_jobs, self.chunk_size)
+        codes = [code for code, _ in cld2_results]
+        unsure = [i for i, (_, confident) in enumerate(cld2_results) if not confident]
+        self.stage_counts['pycld2'] += len(texts) - len(unsure)
+        if not unsure:
+            return codes
+
+        with profiler.span('langdetect', count=len(unsure)):
+            langdetect_results = _map_chunks(partial(_langdetect_stage, min_prob=self.langdetect_min_prob),
+                                             [texts[i] for i in unsure], self.n_jobs, self.chunk_size)
+        ambiguous = []
+        for i, (code, confident) in zip(unsure, langdetect_results):
+            if code is not None:
+                codes[i] = code
+            if not confident:
+                ambiguous.append(i)
+        self.stage_counts['langdetect'] += len(unsure) - len(ambiguous)
+
+        if ambiguous and self.bert_pipe is not None:
+            for i, code in zip(ambiguous, self._bert_stage([texts[i] for i in ambiguous])):
+                codes[i] = code
+            self.stage_counts['bert'] += len(ambiguous)
+        else:
+            self.stage_counts['best_guess'] += len(ambiguous)
+        return codes
+
+    def detect(self, texts: List[str]) -> List[str]:
+        """ Language code of every text, '' for empty input and None when no stage could tell """
+        results = [''] * len(texts)
+        pending = {}
+        for i, text in enumerate(texts):
+            if text is None or len(text) == 0:
+                continue
+            key = self._key(text)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[i] = self.cache[key]
+                self.stage_counts['cache'] += 1
+            else:
+                pending.setdefault(key, (text, []))[1].append(i)
+
+        if pending:
+            keys = list(pending)
+            for key, code in zip(keys, self._detect_new([pending[key][0] for key in keys])):
+                if self.cache_size:
+                    if len(self.cache) >= self.cache_size:
+                        self.cache.popitem(last=False)
+                    self.cache[key] = code
+                for i in pending[key][1]:
+                    results[i] = code
+        return results
+
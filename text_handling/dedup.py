@@ -0,0 +1,197 @@
+import zlib
+import logging
+
+import numpy as np
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+NUM_PERM = 128
+SHINGLE_SIZE = 3
+THRESHOLD = 0.8
+BATCH_SIZE = 2000
+PERM_CHUNK = 16
+
+# Multiply-shift hashing of 32-bit shingle hashes: the high 32 bits of a * x + b mod 2 ** 64,
+# with a odd, which needs no modulo and wraps natively in uint64
+_SHIFT_32 = np.uint64(32)
+_MASK_32 = np.uint64(0xFFFFFFFF)
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                                 0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53], dtype=np.uint64)
+
+
+def lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    (bands, rows) with bands * rows <= num_perm minimizing the false positive probability below
+    threshold plus the false negative probability above it, as datasketch's MinHashLSH does
+    """
+    def collision(similarity, bands, rows):
+        return 1 - (1 - similarity ** rows) ** bands
+
+    below = np.linspace(0, threshold, 200)
+    above = np.linspace(threshold, 1, 200)
+    best, best_error = None, float('inf')
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            error = (collision(below, bands, rows).mean() * threshold
+                     + (1 - collision(above, bands, rows)).mean() * (1 - threshold))
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+class MinHasher:
+    """ MinHash signatures of word shingles, computed for a batch of texts at once with numpy """
+    def __init__(self, num_perm: int = NUM_PERM, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        if shingle_size > len(_SHINGLE_MULTIPLIERS):
+            raise ValueError(f'shingle_size is at most {len(_SHINGLE_MULTIPLIERS)}')
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(0, 1 << 63, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._token_hashes: Dict[str, int] = {}
+
+    def _token_hash(self, token: str) -> int:
+        token_hash = self._token_hashes.get(token)
+        if token_hash is None:
+            token_hash = self._token_hashes[token] = zlib.crc32(token.encode('utf-8'))
+        return token_hash
+
+    def shingles(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """ 32-bit hashes of every text's word shingles concatenated, and the number of shingles per text """
+        tokens, lengths = [], []
+        for text in texts:
+            words = text.split()
+            tokens.extend(self._token_hash(word) for word in words)
+            lengths.append(len(words))
+        tokens = np.array(tokens, dtype=np.uint64)
+        lengths = np.array(lengths, dtype=np.int64)
+        if not len(tokens):
+            return tokens, np.zeros(len(texts), dtype=np.int64)
+
+        ends = np.repeat(np.cumsum(lengths), lengths)
+        starts = ends - np.repeat(lengths, lengths)
+        positions = np.arange(len(tokens))
+        # A shingle starts wherever shingle_size words fit before the text ends; shorter texts are one shingle
+        valid = (positions + self.shingle_size <= ends) | ((positions == starts) & (ends - starts < self.shingle_size))
+
+        combined = np.zeros(len(tokens), dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            index = positions + offset
+            inside = index < ends
+            combined += np.where(inside, tokens[np.minimum(index, len(tokens) - 1)], 0) * _SHINGLE_MULTIPLIERS[offset]
+        hashes = (combined >> _SHIFT_32) ^ (combined & _MASK_32)
+
+        counts = np.bincount(np.repeat(np.arange(len(texts)), lengths)[valid], minlength=len(texts))
+        return hashes[valid], counts
+
+    def signatures(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """ (n, num_perm) uint32 signatures and a mask of texts that had any word """
+        shingles, counts = self.shingles(texts)
+        signatures = np.full((len(texts), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        non_empty = counts > 0
+        if not non_empty.any():
+            return signatures, non_empty
+        offsets = np.concatenate([[0], np.cumsum(counts[non_empty])[:-1]])
+        values = np.empty((PERM_CHUNK, len(shingles)), dtype=np.uint64)
+        for start in range(0, self.num_perm, PERM_CHUNK):
+            a = self.a[start:start + PERM_CHUNK, None]
+            b = self.b[start:start + PERM_CHUNK, None]
+            chunk = values[:len(a)]
+            np.multiply(a, shingles[None, :], out=chunk)
+            chunk += b
+            chunk >>= _SHIFT_32
+            signatures[non_empty, start:start + PERM_CHUNK] = np.minimum.reduceat(chunk, offsets, axis=1).T
+        return signatures, non_empty
+
+
+class NearDuplicateFinder:
+    """
+    MinHash LSH near-duplicate detection over preprocessed texts. Texts are hashed in batches and
+    only the band keys (bands x 8 bytes per text) are kept, so memory grows slowly with the corpus
+    instead of with the text or signature size. Texts whose band collides are linked, linked
+    texts form a duplicate group. With groups (e.g. jids) only texts of the same group are linked.
+    """
+    def __init__(self, threshold: float = THRESHOLD, num_perm: int = NUM_PERM,
+                 shingle_size: int = SHINGLE_SIZE, batch_size: int = BATCH_SIZE, seed: int = 1):
+        self.hasher = MinHasher(num_perm, shingle_size, seed)
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+        self.batch_size = batch_size
+        self._band_multipliers = np.array(_SHINGLE_MULTIPLIERS.tolist() * (-(-self.rows // len(_SHINGLE_MULTIPLIERS))),
+                                          dtype=np.uint64)[:self.rows]
+        self._keys: List[np.ndarray] = []
+        self._non_empty: List[np.ndarray] = []
+        self.n_texts = 0
+
+    def _band_keys(self, signatures: np.ndarray, groups: Optional[np.ndarray]) -> np.ndarray:
+        used = self.bands * self.rows
+        bands = signatures[:, :used].astype(np.uint64).reshape(len(signatures), self.bands, self.rows)
+        keys = (bands * self._band_multipliers).sum(axis=2, dtype=np.uint64)
+        # Band index is mixed in so equal rows in different bands do not collide
+        keys += np.arange(self.bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        if groups is not None:
+            keys ^= (groups.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F))[:, None]
+        return keys
+
+    def add(self, texts: List[str], groups: Optional[Iterable[int]] = None):
+        """ Hash a batch of texts, optionally with the group (jid) of every text """
+        groups = np.asarray(list(groups), dtype=np.int64) if groups is not None else None
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            signatures, non_empty = self.hasher.signatures(batch)
+            batch_groups = groups[start:start + self.batch_size] if groups is not None else None
+            self._keys.append(self._band_keys(signatures, batch_groups))
+            self._non_empty.append(non_empty)
+            self.n_texts += len(batch)
+
+    def labels(self) -> np.ndarray:
+        """ Duplicate group label of every text added so far, in order; texts without words stay alone """
+        if not self.n_texts:
+            return np.zeros(0, dtype=np.int64)
+        keys = np.concatenate(self._keys)
+        non_empty = np.concatenate(self._non_empty)
+        candidates = np.flatnonzero(non_empty)
+        sources, targets = [], []
+        for band in range(self.bands):
+            band_keys = keys[candidates, band]
+            order = np.argsort(band_keys, kind='stable')
+            same = band_keys[order][1:] == band_keys[order][:-1]
+            sources.append(candidates[order[:-1][same]])
+            targets.append(candidates[order[1:][same]])
+        sources = np.concatenate(sources)
+        targets = np.concatenate(targets)
+        graph = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)),
+                           shape=(self.n_texts, self.n_texts))
+        _, labels = connected_components(graph, directed=False)
+        return labels
+
+    def keep_mask(self) -> np.ndarray:
+        """ True for the first text of every duplicate group, like drop_duplicates(keep='first') """
+        labels = self.labels()
+        keep = np.zeros(len(labels), dtype=bool)
+        keep[np.unique(labels, return_index=True)[1]] = True
+        return keep
+
+
+def near_duplicate_labels(texts: List[str], groups: Optional[Iterable[int]] = None,
+                          threshold: float = THRESHOLD, **kwargs) -> np.ndarray:
+    """ Duplicate group label of every text, texts of a group are near-duplicates of each other """
+    finder = NearDuplicateFinder(threshold, **kwargs)
+    finder.add(texts, groups)
+    return finder.labels()
+
+
+def drop_near_duplicates(df, text_column: str = 'cleaned_text', group_column: Optional[str] = 'jid',
+                         threshold: float = THRESHOLD, **kwargs):
+    """ Keep the first row of every near-duplicate group, per group_column (None for corpus-wide) """
+    finder = NearDuplicateFinder(threshold, **kwargs)
+    finder.add(df[text_column].fillna('').astype(str).tolist(),
+               df[group_column].tolist() if group_column is not None else None)
+    keep = finder.keep_mask()
+    LOGGER.info(f'Near-duplicates: kept {keep.sum()} of {len(keep)} rows')
+    return df[keep]
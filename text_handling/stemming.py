@@ -0,0 +1,168 @@
+import os
+import re
+import logging
+
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+STEM_CACHE_SIZE = 500_000
+# New stems kept in memory before they are merged into the cache file, pool workers have no
+# exit hook so they flush on the way instead
+FLUSH_EVERY = 5_000
+
+# Sastrawi's TextNormalizer: lower case, anything but letters, digits, space and '-' is a separator
+_NON_WORD_PATTERN = re.compile(r'[^a-z0-9 -]')
+
+
+class _SetDictionary:
+    """ Root word dictionary for Sastrawi's Stemmer, its ArrayDictionary scans a list on every lookup """
+    def __init__(self, words: Iterable[str]):
+        self.words = frozenset(word for word in words if word and word.strip())
+
+    def contains(self, word: str) -> bool:
+        return word in self.words
+
+    def count(self) -> int:
+        return len(self.words)
+
+
+def load_sastrawi_stemmer() -> Callable[[str], str]:
+    """ Sastrawi's word stemmer on a set dictionary, without its own unbounded CachedStemmer wrapper """
+    from Sastrawi.Stemmer.Stemmer import Stemmer
+    from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+    return Stemmer(_SetDictionary(StemmerFactory().get_words())).stem_word
+
+
+def load_sastrawi_stopwords() -> frozenset:
+    from Sastrawi.StopWordRemover.StopWordRemoverFactory import StopWordRemoverFactory
+    return frozenset(StopWordRemoverFactory().get_stop_words())
+
+
+def load_sastrawi_stopword_remover() -> Callable[[str], str]:
+    """ Sastrawi's StopWordRemover.remove on a set dictionary, quirks included (a stopword after another stays) """
+    from Sastrawi.StopWordRemover.StopWordRemover import StopWordRemover
+    return StopWordRemover(_SetDictionary(load_sastrawi_stopwords())).remove
+
+
+class StemCache:
+    """ Bounded word -> stem memo dropping the least recently used entries first, optionally backed by a TSV file """
+    def __init__(self, max_entries: int = STEM_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.stems: OrderedDict = OrderedDict()
+        self.new_entries = 0
+
+    def __len__(self):
+        return len(self.stems)
+
+    def get(self, word: str) -> Optional[str]:
+        stem = self.stems.get(word)
+        if stem is not None:
+            self.stems.move_to_end(word)
+        return stem
+
+    def put(self, word: str, stem: str):
+        if len(self.stems) >= self.max_entries:
+            self.stems.popitem(last=False)
+        self.stems[word] = stem
+        self.new_entries += 1
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        stems = {}
+        try:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    word, _, stem = line.rstrip('\n').partition('\t')
+                    stems[word] = stem
+        except FileNotFoundError:
+            pass
+        return stems
+
+    def load(self, path: str):
+        for word, stem in self._read(path).items():
+            if len(self.stems) >= self.max_entries:
+                break
+            self.stems[word] = stem
+        LOGGER.info(f'Loaded {len(self.stems)} stems from {path}')
+
+    def save(self, path: str):
+        """
+        Merge the entries into the file and replace it atomically. Processes sharing the file
+        each merge what is on disk, a stem lost to a concurrent write is only computed again.
+        """
+        stems = self._read(path)
+        stems.update(self.stems)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.writelines(f'{word}\t{stem}\n' for word, stem in stems.items())
+        os.replace(tmp_path, path)
+        self.new_entries = 0
+
+
+class IndonesianNormalizer:
+    """
+    Stopword removal and stemming as one preprocess_text step, e.g.
+    preprocess_texts(texts, DEFAULT_PROCESSING_FUNCTION_LIST + [IndonesianNormalizer(cache_path='stems.tsv')]).
+    The text is tokenized once, stopwords are dropped by set lookup and every distinct word is
+    stemmed once through the StemCache, so the stemmer only sees the corpus vocabulary.
+    Sastrawi is loaded on first use; in pool workers the cache file is loaded again and new
+    stems are merged back every FLUSH_EVERY words, call save() once done in the parent.
+    """
+    __name__ = 'stem_and_remove_stopwords'
+
+    def __init__(self, stem: bool = True, remove_stopwords: bool = True, cache_path: Optional[str] = None,
+                 max_entries: int = STEM_CACHE_SIZE, stem_word: Optional[Callable[[str], str]] = None,
+                 stopwords: Optional[Iterable[str]] = None, flush_every: int = FLUSH_EVERY):
+        self.stem = stem
+        self.remove_stopwords = remove_stopwords
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.stem_word = stem_word
+        self.stopwords = frozenset(stopwords) if stopwords is not None else None
+        self.flush_every = flush_every
+        self.cache: Optional[StemCache] = None
+
+    def __reduce__(self):
+        # Workers rebuild the stemmer and reload the cache file instead of receiving a copy of the memo
+        return (IndonesianNormalizer, (self.stem, self.remove_stopwords, self.cache_path, self.max_entries,
+                                       self.stem_word, self.stopwords, self.flush_every))
+
+    def _load(self):
+        if self.stem_word is None and self.stem:
+            self.stem_word = load_sastrawi_stemmer()
+        if self.stopwords is None and self.remove_stopwords:
+            self.stopwords = load_sastrawi_stopwords()
+        self.cache = StemCache(self.max_entries)
+        if self.cache_path is not None:
+            self.cache.load(self.cache_path)
+
+    def __call__(self, input_text: str) -> str:
+        if input_text is None or len(input_text) == 0:
+            return ''
+        if self.cache is None:
+            self._load()
+        words = _NON_WORD_PATTERN.sub(' ', input_text.lower()).split()
+        if self.remove_stopwords:
+            stopwords = self.stopwords
+            words = [word for word in words if word not in stopwords]
+        if self.stem:
+            get = self.cache.get
+            stems = []
+            for word in words:
+                stem = get(word)
+                if stem is None:
+                    stem = self.stem_word(word)
+                    self.cache.put(word, stem)
+                stems.append(stem)
+            words = stems
+            if self.cache_path is not None and self.cache.new_entries >= self.flush_every:
+                self.cache.save(self.cache_path)
+        return ' '.join(words)
+
+    def save(self):
+        """ Write the new stems to cache_path """
+        if self.cache is not None and self.cache_path is not None and self.cache.new_entries:
+            self.cache.save(self.cache_path)
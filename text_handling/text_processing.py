@@ -1,14 +1,40 @@
 import os
 import re
+import sys
 import string
 import logging
 
-from typing import List, Optional, Callable
-from functools import wraps
+from typing import Iterable, List, Optional, Callable, Tuple
+from functools import lru_cache, wraps
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import profiler
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+# TODO: add more special characters
+DEFAULT_SPECIAL_CHARACTERS = 'å¼«¥ª°©ð±§µæ¹¢³¿®ä£'
+
+_URL_PATTERN = re.compile(r'(www|http)\S+')
+_NUMBER_PATTERN = re.compile(r'\d+')
+_NBSP_PATTERN = re.compile('&nbsp')
+_ABS_WORD_PATTERN = re.compile('^(Abstrak|Abstract|ABSTRAK|ABSTRACT)+')
+_MULTILANG_PATTERN = re.compile('(Abstract|Abstrak|ABSTRAK|ABSTRACT).*')
+_KATAKUNCI_PATTERN = re.compile('(Kata kunci|Keywords|Keyword).*')
+_BULLET_PATTERN = re.compile(r'[(\s][0-9a-zA-Z][.)]\s+|[(\s][ivxIVX]+[.)]\s+')
+_NON_ALPHA_NUMERIC_PATTERN = re.compile(r'[^ \w+]')
+_WHITESPACE_PATTERN = re.compile(r'\s+', flags=re.UNICODE)
+_EMAIL_PATTERN = re.compile(r'[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}')
+_TAG_PATTERN = re.compile('<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});')
+_PHONE_NUMBER_PATTERN = re.compile(r'(?:\+?(\d{1,3}))?[-. (]*(\d{3})[-. )]*(\d{3})[-. ]*(\d{4})(?: *x(\d+))?')
+_ABSTRACT_SPLIT_PATTERN = re.compile(r'abstrak|abstract')
+_LINE_SPLIT_PATTERN = re.compile(r'\n|\.\s|\.')
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+_SPECIAL_CHARACTER_TABLE = str.maketrans('', '', DEFAULT_SPECIAL_CHARACTERS)
+
 def _return_empty_string_for_invalid_input(func):
     """ Return empty string if the input is None or empty """
     @wraps(func)
@@ -41,36 +67,36 @@ def to_upper(input_text: str) -> str:
 @_return_empty_string_for_invalid_input
 def remove_url(input_text: str) -> str:
     """ Remove url in the input text """
-    return re.sub('(www|http)\S+', '', input_text)
+    return _URL_PATTERN.sub('', input_text)
 
 @_return_empty_string_for_invalid_input
 def remove_number(input_text: str) -> str:
     """ Remove number in the input text """
-    processed_text = re.sub('\d+', '', input_text)
+    processed_text = _NUMBER_PATTERN.sub('', input_text)
     return processed_text
 
 @_return_empty_string_for_invalid_input
 def remove_nbsp(input_text: str) -> str:
     """ Remove tag nbsp in the input text """
-    processed_text = re.sub('&nbsp', '', input_text)
+    processed_text = _NBSP_PATTERN.sub('', input_text)
     return processed_text
 
 @_return_empty_string_for_invalid_input
 def remove_abs_word(input_text: str) -> str:
     """ Remove abstract words in first sentence in the input text """
-    processed_text = re.sub('^(Abstrak|Abstract|ABSTRAK|ABSTRACT)+', '', input_text)
+    processed_text = _ABS_WORD_PATTERN.sub('', input_text)
     return processed_text
 
 @_return_empty_string_for_invalid_input
 def remove_multilang(input_text: str) -> str:
     """ Remove multi lang and only keep the first language in the input text """
-    processed_text = re.sub('(Abstract|Abstrak|ABSTRAK|ABSTRACT).*', '', input_text)
+    processed_text = _MULTILANG_PATTERN.sub('', input_text)
     return processed_text
 
 @_return_empty_string_for_invalid_input
 def remove_katakunci(input_text: str) -> str:
     """ Remove kata kunci if theres in the input text """
-    processed_text = re.sub('(Kata kunci|Keywords|Keyword).*', '', input_text)
+    processed_text = _KATAKUNCI_PATTERN.sub('', input_text)
     return processed_text
 
 # @_return_empty_string_for_invalid_input
@@ -82,7 +108,7 @@ def remove_katakunci(input_text: str) -> str:
 @_return_empty_string_for_invalid_input
 def remove_itemized_bullet_and_numbering(input_text: str) -> str:
     """ Remove bullets or numbering in itemized input """
-    processed_text = re.sub('[(\s][0-9a-zA-Z][.)]\s+|[(\s][ivxIVX]+[.)]\s+', ' ', input_text)
+    processed_text = _BULLET_PATTERN.sub(' ', input_text)
     return processed_text
 
 @_return_empty_string_for_invalid_input
@@ -92,8 +118,10 @@ def remove_punctuation(input_text: str, punctuations: Optional[str] = None) -> s
     For reference, Python's string.punctuation is equivalent to '!"#$%&\'()*+,-./:;<=>?@[\\]^_{|}~'
     """
     if punctuations is None:
-        punctuations = string.punctuation
-    processed_text = input_text.translate(str.maketrans('', '', punctuations))
+        table = _PUNCTUATION_TABLE
+    else:
+        table = str.maketrans('', '', punctuations)
+    processed_text = input_text.translate(table)
     return processed_text
 
 
@@ -101,52 +129,50 @@ def remove_punctuation(input_text: str, punctuations: Optional[str] = None) -> s
 def remove_special_character(input_text: str, special_characters: Optional[str] = None) -> str:
     """ Removes special characters """
     if special_characters is None:
-        # TODO: add more special characters
-        special_characters = 'å¼«¥ª°©ð±§µæ¹¢³¿®ä£'
-    processed_text = input_text.translate(str.maketrans('', '', special_characters))
+        table = _SPECIAL_CHARACTER_TABLE
+    else:
+        table = str.maketrans('', '', special_characters)
+    processed_text = input_text.translate(table)
     return processed_text
 
 
 @_return_empty_string_for_invalid_input
 def keep_alpha_numeric(input_text: str) -> str:
     """ Remove any character except alphanumeric characters """
-    return re.sub(r'[^ \w+]', '', input_text)
+    return _NON_ALPHA_NUMERIC_PATTERN.sub('', input_text)
 
 
 @_return_empty_string_for_invalid_input
 def remove_whitespace(input_text: str, remove_duplicate_whitespace: bool = True) -> str:
     """ Removes leading, trailing, and (optionally) duplicated whitespace """
     if remove_duplicate_whitespace:
-        return ' '.join(re.split('\s+', input_text.strip(), flags=re.UNICODE))
+        return ' '.join(_WHITESPACE_PATTERN.split(input_text.strip()))
     return input_text.strip()
 
 @_return_empty_string_for_invalid_input
 def remove_email(input_text: str) -> str:
     """ Remove email in the input text """
-    regex_pattern = '[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}'
-    return re.sub(regex_pattern, '', input_text)
+    return _EMAIL_PATTERN.sub('', input_text)
 
 @_return_empty_string_for_invalid_input
 def remove_tag(input_text: str) -> str:
     """ Remove email in the input text """
-    CLEANR = re.compile('<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});')
-    return re.sub(CLEANR, '', input_text)
+    return _TAG_PATTERN.sub('', input_text)
 
 @_return_empty_string_for_invalid_input
 def remove_phone_number(input_text: str) -> str:
     """ Remove phone number in the input text """
-    regex_pattern = '(?:\+?(\d{1,3}))?[-. (]*(\d{3})[-. )]*(\d{3})[-. ]*(\d{4})(?: *x(\d+))?'
-    return re.sub(regex_pattern, '', input_text)
+    return _PHONE_NUMBER_PATTERN.sub('', input_text)
 
 @_return_empty_string_for_invalid_input
 def bersihkan_abstrak(input_text: str) -> str:
     """Clean abstract text by removing keywords, special characters, and non-alphanumeric characters."""
     input_text = input_text.lower()
     # Split text based on "ABSTRAK" or "Abstract" to get the abstract section
-    bagian_abstrak = re.split(r'abstrak|abstract', input_text)[-1].strip()
+    bagian_abstrak = _ABSTRACT_SPLIT_PATTERN.split(input_text)[-1].strip()
 
     # Split the resulting text by '\n', '.' to get individual lines
-    lines = re.split(r'\n|\.\s|\.', bagian_abstrak)
+    lines = _LINE_SPLIT_PATTERN.split(bagian_abstrak)
 
     # Remove lines containing keywords "Kata kunci" or "kata kunci:"
     cleaned_lines = [line for line in lines if not line.startswith('kata kunci')]
@@ -168,29 +194,259 @@ def bersihkan_abstrak(input_text: str) -> str:
 
     # Find the position of the keyword "kata kunci"
     keyword_position = cleaned_abstract.find('kata kunci')
-    
+
     # If the keyword is found, remove text after it
     if keyword_position != -1:
         cleaned_abstract = cleaned_abstract[:keyword_position]
 
     return cleaned_abstract
 
+DEFAULT_PROCESSING_FUNCTION_LIST = [
+    remove_tag,
+    bersihkan_abstrak,
+    remove_nbsp,
+    remove_special_character,
+    keep_alpha_numeric,
+    remove_number
+]
+
 def preprocess_text(input_text: str, processing_function_list: Optional[List[Callable]] = None) -> str:
     """ Preprocess an input text by executing a series of preprocessing functions specified in functions list """
     if processing_function_list is None:
-        processing_function_list = [
-            remove_tag,
-            bersihkan_abstrak,
-            remove_nbsp,
-            remove_special_character,
-            keep_alpha_numeric,
-            remove_number
-        ]
-    for func in processing_function_list:
-        input_text = func(input_text)
+        processing_function_list = DEFAULT_PROCESSING_FUNCTION_LIST
+    if profiler.is_enabled():
+        for func in processing_function_list:
+            with profiler.span(func.__name__) as step_span:
+                processed_text = func(input_text)
+                if isinstance(input_text, str) and isinstance(processed_text, str):
+                    step_span.add(bytes_in=len(input_text.encode('utf-8')), bytes_out=len(processed_text.encode('utf-8')),
+                                  chars_removed=len(input_text) - len(processed_text))
+            input_text = processed_text
+    else:
+        for func in processing_function_list:
+            input_text = func(input_text)
     if isinstance(input_text, str):
         processed_text = input_text
     else:
         processed_text = ' '.join(input_text)
     return processed_text
 
+
+# Steps that only delete single characters, independent of their neighbours. Deleting one set
+# of characters and then another gives the same text as deleting their union in one pass, so
+# adjacent steps from this table are merged into a single regex by ``PreprocessingPlan``.
+# Value: (body of the character class to delete, whether the class is negated)
+_CHARACTER_DELETION_STEPS = {
+    remove_number: (r'\d', False),
+    keep_alpha_numeric: (r' \w+', True),
+    remove_special_character: (re.escape(DEFAULT_SPECIAL_CHARACTERS), False),
+    remove_punctuation: (re.escape(string.punctuation), False),
+}
+
+
+class _DeleteCharacters:
+    """ Fused step deleting the union of characters of several character deletion steps """
+    def __init__(self, character_classes: List[tuple], name: str = 'delete_characters'):
+        self.__name__ = name
+        positive = ''.join(body for body, negated in character_classes if not negated)
+        alternatives = ['[^{}]'.format(body) for body, negated in character_classes if negated]
+        if positive:
+            alternatives.append('[{}]'.format(positive))
+        self.regex = re.compile('|'.join(alternatives))
+
+    def __call__(self, input_text: str) -> str:
+        return self.regex.sub('', input_text)
+
+
+def _compile_steps(processing_function_list: List[Callable]) -> List[tuple]:
+    """ Turn a preprocessing function list into (step, skip_empty_input) pairs, fusing character deletions """
+    steps = []
+    character_classes = []
+    fused_names = []
+    for func in processing_function_list:
+        if func in _CHARACTER_DELETION_STEPS:
+            if _CHARACTER_DELETION_STEPS[func] not in character_classes:
+                character_classes.append(_CHARACTER_DELETION_STEPS[func])
+            fused_names.append(func.__name__)
+            continue
+        if character_classes:
+            steps.append((_DeleteCharacters(character_classes, '+'.join(fused_names)), True))
+            character_classes, fused_names = [], []
+        # Skip the decorator and do the empty input check once per step in the plan instead
+        steps.append((getattr(func, '__wrapped__', func), hasattr(func, '__wrapped__')))
+    if character_classes:
+        steps.append((_DeleteCharacters(character_classes, '+'.join(fused_names)), True))
+    return steps
+
+
+class PreprocessingPlan:
+    """ Preprocessing function list compiled once, giving the same output as preprocess_text """
+    def __init__(self, processing_function_list: Optional[List[Callable]] = None):
+        if processing_function_list is None:
+            processing_function_list = DEFAULT_PROCESSING_FUNCTION_LIST
+        self.processing_function_list = list(processing_function_list)
+        self.steps = _compile_steps(self.processing_function_list)
+
+    def __reduce__(self):
+        # Undecorated step functions can not be pickled by reference, recompile in the worker instead
+        return (PreprocessingPlan, (self.processing_function_list,))
+
+    def __call__(self, input_text: str) -> str:
+        for step, skip_empty_input in self.steps:
+            if skip_empty_input and (input_text is None or len(input_text) == 0):
+                input_text = ''
+                continue
+            input_text = step(input_text)
+        if isinstance(input_text, str):
+            return input_text
+        return ' '.join(input_text)
+
+    def process_many(self, texts: List[str]) -> List[str]:
+        """ Run the plan over a list of texts """
+        if profiler.is_enabled():
+            return self._process_many_profiled(texts)
+        return [self(text) for text in texts]
+
+    def _process_many_profiled(self, texts: List[str]) -> List[str]:
+        """ Same result as process_many, run step by step over all texts so each step is timed on its own """
+        with profiler.span('preprocess_texts', count=len(texts)):
+            for step, skip_empty_input in self.steps:
+                with profiler.span(step.__name__, count=len(texts)) as step_span:
+                    processed = [
+                        '' if skip_empty_input and (text is None or len(text) == 0) else step(text)
+                        for text in texts
+                    ]
+                    chars_in = sum(len(text) for text in texts if isinstance(text, str))
+                    chars_out = sum(len(text) for text in processed if isinstance(text, str))
+                    step_span.add(bytes_in=profiler.text_bytes(texts), bytes_out=profiler.text_bytes(processed),
+                                  chars_removed=chars_in - chars_out)
+                texts = processed
+        return [text if isinstance(text, str) else ' '.join(text) for text in texts]
+
+
+def _process_many_in_worker(plan: PreprocessingPlan, texts: List[str]) -> Tuple[List[str], Optional[dict]]:
+    """ plan.process_many in a pool worker, with the worker's profile of it while profiling is on """
+    if not profiler.is_enabled():
+        return plan.process_many(texts), None
+    # A forked worker starts with a copy of the parent's profile, only this chunk's spans go back
+    profiler.PROFILER.reset()
+    processed = plan.process_many(texts)
+    return processed, profiler.PROFILER.collect()
+
+
+def preprocess_texts(texts: Iterable[str],
+                     processing_function_list: Optional[List[Callable]] = None,
+                     n_jobs: Optional[int] = None,
+                     chunk_size: int = 2000):
+    """
+    Preprocess many texts with a compiled PreprocessingPlan, splitting them into chunks that run
+    across a process pool. Results keep the input order; a pandas Series input gives back a Series
+    with the same index and name, any other iterable gives back a list.
+    Functions in processing_function_list must be picklable (module level) when n_jobs > 1.
+    While profiling, the workers send their per-step spans back and they are merged into the
+    parent's profile, step times are then summed over the workers.
+    """
+    plan = PreprocessingPlan(processing_function_list)
+
+    pd = sys.modules.get('pandas')
+    series = texts if pd is not None and isinstance(texts, pd.Series) else None
+    texts = list(texts)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+
+    if n_jobs <= 1 or len(chunks) <= 1:
+        processed_texts = plan.process_many(texts)
+    else:
+        processed_texts = []
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chunks))) as executor:
+            for processed_chunk, profile in executor.map(_process_many_in_worker, repeat(plan), chunks):
+                processed_texts.extend(processed_chunk)
+                if profile is not None:
+                    profiler.PROFILER.merge(profile)
+
+    if series is not None:
+        return pd.Series(processed_texts, index=series.index, name=series.name)
+    return processed_texts
+
+
+_COMPREHENSIVE_URL_PATTERN = re.compile(r"http\S+|www\S+|https\S+", flags=re.MULTILINE)
+_NON_WORD_OR_DIGIT_PATTERN = re.compile(r'\W|[\d_]')
+_REPEATED_WORD_PATTERN = re.compile(r'\b(\w+)( \1\b)+')
+_EMOJI_PATTERN = re.compile(
+    "["
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F700-\U0001F77F"  # alchemical symbols
+    u"\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
+    u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    u"\U0001FA00-\U0001FA6F"  # Chess Symbols
+    u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    u"\U00002702-\U000027B0"  # Dingbats
+    u"\U000024C2-\U0001F251"
+    "]+"
+)
+_PUNCTUATION_PATTERN = re.compile(r'[^\w\s#]')
+_MENTION_PATTERN = re.compile(r'@\w+')
+
+def comprehensive_preprocessing(text: str) -> str:
+    """ Clean title + abstract before embedding, as done by the clustering and prediction notebooks """
+    # Menghapus URL
+    text = _COMPREHENSIVE_URL_PATTERN.sub('', text)
+
+    # Menghapus karakter khusus dan angka
+    text = _NON_WORD_OR_DIGIT_PATTERN.sub(' ', text)
+
+    # Menghapus kata yang berulang
+    text = _REPEATED_WORD_PATTERN.sub(r'\1', text)
+
+    # Menghapus emoji atau simbol khusus
+    text = _EMOJI_PATTERN.sub(r'', text)
+
+    # Menghapus tanda baca
+    text = _PUNCTUATION_PATTERN.sub(' ', text)
+
+    # Menghapus kata-kata singkat
+    text = ' '.join([word for word in text.split() if len(word) > 2])
+
+    # Menghapus mention
+    text = _MENTION_PATTERN.sub('', text)
+
+    # Mengonversi teks ke huruf kecil
+    text = text.lower()
+
+    # Menghapus spasi berlebih
+    text = ' '.join(text.split())
+
+    return text
+
+
+@lru_cache(maxsize=1)
+def _stopword_remover() -> Callable[[str], str]:
+    # Sastrawi is only imported when texts are built for embedding, not on the cheap clean path
+    from text_handling.stemming import load_sastrawi_stopword_remover
+    return load_sastrawi_stopword_remover()
+
+
+def training_preprocessing(text: str) -> str:
+    """ comprehensive_preprocessing of cluster_multibert_kmeans_pca.ipynb, ending with Sastrawi's stopword removal """
+    return _stopword_remover()(comprehensive_preprocessing(text))
+
+
+def preprocess_articles(titles: Iterable[str], abstracts: Iterable[str],
+                        n_jobs: Optional[int] = None) -> Tuple[List[str], List[str]]:
+    """
+    Cleaned abstracts and the texts to embed of (title, abstract) pairs, as main.ipynb and the
+    clustering notebooks built them: bersihkan_abstrak and the default steps run on the abstract
+    alone (word counts for the length filter are taken on it), then the title is put back in
+    front and training_preprocessing(title + cleaned abstract) is the embedded text.
+    Training and scoring both go through here so the models see one text distribution.
+    """
+    titles = [title if isinstance(title, str) else '' for title in titles]
+    abstracts = [abstract if isinstance(abstract, str) else '' for abstract in abstracts]
+    cleaned_abstracts = preprocess_texts(abstracts, n_jobs=n_jobs)
+    texts = [training_preprocessing(title + abstract) for title, abstract in zip(titles, cleaned_abstracts)]
+    return cleaned_abstracts, texts
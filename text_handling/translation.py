@@ -0,0 +1,212 @@
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+MAX_CHARS = 4500
+CONCURRENCY = 8
+RATE_LIMIT = 5.0
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class GoogleBackend:
+    """
+    deep_translator's GoogleTranslator, one instance per language pair and thread instead of one per text:
+    an instance rewrites its request parameters on every call, so threads must not share one
+    """
+    name = 'google'
+    # GoogleTranslator rejects texts of 5000 characters or more
+    max_chars = MAX_CHARS
+
+    def __init__(self):
+        from deep_translator import GoogleTranslator
+        self._translator_class = GoogleTranslator
+        self._local = threading.local()
+
+    def translate(self, text: str, source: str, target: str) -> str:
+        translators: Optional[Dict[Tuple[str, str], object]] = getattr(self._local, 'translators', None)
+        if translators is None:
+            translators = self._local.translators = {}
+        if (source, target) not in translators:
+            translators[(source, target)] = self._translator_class(source=source, target=target)
+        return translators[(source, target)].translate(text)
+
+
+def split_chunks(text: str, max_chars: int) -> List[str]:
+    """ Split a text into sentence-aligned chunks of at most max_chars, cutting at spaces only inside over-long sentences """
+    chunks, current = [], ''
+    for sentence in _SENTENCE_END.split(_WHITESPACE.sub(' ', text).strip()):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f'{current} {sentence}' if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RateLimiter:
+    """ Spaces calls at least 1 / rate seconds apart across threads """
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if wait:
+            time.sleep(wait)
+
+
+class TranslationCache:
+    """ Persistent translations in SQLite, keyed by (source, target, sha1 of the text) """
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS translations ('
+                                     'source TEXT, target TEXT, hash TEXT, translation TEXT, '
+                                     'PRIMARY KEY (source, target, hash))')
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, source: str, target: str, texts: List[str]) -> Dict[str, str]:
+        """ Cached translations of the given texts, by text """
+        hashes = {self.text_hash(text): text for text in texts}
+        found = {}
+        keys = list(hashes)
+        with self._lock:
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f'SELECT hash, translation FROM translations WHERE source = ? AND target = ? '
+                    f'AND hash IN ({",".join("?" * len(batch))})', [source, target, *batch])
+                found.update((hashes[key], translation) for key, translation in rows)
+        return found
+
+    def put(self, source: str, target: str, text: str, translation: str):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)',
+                                     (source, target, self.text_hash(text), translation))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+
+class TranslationStats:
+    def __init__(self):
+        self.texts = 0
+        self.chunks = 0
+        self.unique_chunks = 0
+        self.cache_hits = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def summary(self) -> str:
+        return (f'texts: {self.texts}, chunks: {self.chunks}, unique: {self.unique_chunks}, '
+                f'cache hits: {self.cache_hits}, requests: {self.requests}, retries: {self.retries}, '
+                f'failures: {self.failures}')
+
+
+class Translator:
+    """
+    Translates many texts at once: texts are split into sentence chunks within the backend's size
+    limit, identical chunks are translated once, cached chunks are not sent at all, and the rest
+    go to the backend from a thread pool under a shared rate limit with retry and backoff.
+    A backend is any object with translate(text, source, target) and max_chars.
+    """
+    def __init__(self, backend=None, cache: Optional[TranslationCache] = None, source: str = 'en',
+                 target: str = 'id', concurrency: int = CONCURRENCY, rate_limit: float = RATE_LIMIT,
+                 max_retries: int = MAX_RETRIES, backoff_seconds: float = BACKOFF_SECONDS):
+        self.backend = backend if backend is not None else GoogleBackend()
+        self.cache = cache if cache is not None else TranslationCache()
+        self.source = source
+        self.target = target
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.stats = TranslationStats()
+        self._stats_lock = threading.Lock()
+
+    def _translate_chunk(self, chunk: str) -> Optional[str]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                translation = self.backend.translate(chunk, self.source, self.target)
+                with self._stats_lock:
+                    self.stats.requests += 1
+                break
+            except Exception as e:
+                with self._stats_lock:
+                    self.stats.requests += 1
+                if attempt == self.max_retries:
+                    LOGGER.error(f'Translation failed after {attempt + 1} attempts: {e!r}')
+                    with self._stats_lock:
+                        self.stats.failures += 1
+                    return None
+                with self._stats_lock:
+                    self.stats.retries += 1
+                delay = self.backoff_seconds * 2 ** attempt
+                LOGGER.warning(f'Translation failed ({e!r}), retrying in {delay:.1f}s')
+                time.sleep(delay)
+        self.cache.put(self.source, self.target, chunk, translation)
+        return translation
+
+    def translate_texts(self, texts: List[str]) -> List[Optional[str]]:
+        """ Translations in input order; '' for empty input and None when a chunk could not be translated """
+        chunked = [split_chunks(text, self.backend.max_chars) if text else [] for text in texts]
+        unique = list(dict.fromkeys(chunk for chunks in chunked for chunk in chunks))
+        translations = self.cache.get_many(self.source, self.target, unique)
+        missing = [chunk for chunk in unique if chunk not in translations]
+
+        self.stats.texts += len(texts)
+        self.stats.chunks += sum(len(chunks) for chunks in chunked)
+        self.stats.unique_chunks += len(unique)
+        self.stats.cache_hits += len(unique) - len(missing)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                translations.update(zip(missing, executor.map(self._translate_chunk, missing)))
+
+        results = []
+        for chunks in chunked:
+            parts = [translations[chunk] for chunk in chunks]
+            results.append(None if any(part is None for part in parts) else ' '.join(parts))
+        return results
+
+    def translate(self, text: str) -> Optional[str]:
+        return self.translate_texts([text])[0]